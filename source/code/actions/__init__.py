@@ -91,6 +91,10 @@ ACTION_MAX_CONCURRENCY = "MaxConcurrent"
 ACTION_COMPLETION_TIMEOUT_MINUTES = "CompletionTimeout"
 # Allow wildcards in tag filter
 ACTION_ALLOW_TAGFILTER_WILDCARD = "AllowTagFilterWildcards"
+# max number of account/region combinations in which resources are selected concurrently, int
+ACTION_SELECT_CONCURRENCY = "SelectConcurrency"
+# max number of new action items from the same account and region that are executed by a single Lambda invocation, int
+ACTION_MICRO_BATCH_SIZE = "MicroBatchSize"
 
 DEFAULT_COMPLETION_TIMEOUT_MINUTES_DEFAULT = 60
 
@@ -13,18 +13,26 @@
 
 
 import json
+import threading
 from datetime import datetime
+from time import time
+
+from botocore.exceptions import ParamValidationError
 
 import services.ec2_service
 from actions import *
 from boto_retry import get_client_with_retries, get_default_retry_strategy
 from util import safe_json
 from util.tag_filter_set import TagFilterSet
+from util.worker_pool import WorkerPool
 
 SNAPHOT_STATE_ERROR = "error"
 SNAPSHOT_STATE_PENDING = "pending"
 SNAPSHOT_STATE_COMPLETED = "completed"
 
+# max number of volumes of an instance for which snapshots are created concurrently
+MAX_CONCURRENT_SNAPSHOTS = 5
+
 GROUP_TITLE_SNAPHOT_OPTIONS = "Snapshot volume options"
 GROUP_TITLE_TAGGING_NAMING = "Tagging and naming options"
 
@@ -51,8 +59,9 @@ SNAPSHOT_NAME = "{}-{:0>4d}{:0>2d}{:0>2d}{:0>02d}{:0>02d}"
 INFO_COMPLETED = "Creation of snapshot(s) completed"
 INFO_CREATE_SNAPSHOT = "Creating snapshot for {}volume {} ({}) of instance {}"
 INFO_CREATE_TAGS = "Creating tags {} for snapshot"
+INFO_CREATE_TAGS_SEPARATELY = "Tags can not be set when creating snapshot ({}), tags will be created separately"
 INFO_CREATION_PENDING = "Creation of snapshots not completed yet"
-INFO_SNAPSHOT_CREATED = "Snapshot is {}"
+INFO_SNAPSHOT_CREATED = "Snapshot is {}, created in {:>.3f} seconds"
 INFO_SNAPSHOT_NAME = "Name of the snapshot will be set to {}"
 INFO_START_SNAPSHOT_ACTION = "Creating snapshot for EC2 instance {} for task {}"
 INFO_STATE_SNAPSHOTS = "State of created snapshot(s) is {}"
@@ -83,6 +92,7 @@ class Ec2CreateSnapshotAction:
         ACTION_RESOURCES: services.ec2_service.INSTANCES,
         ACTION_AGGREGATION: ACTION_AGGREGATION_RESOURCE,
         ACTION_MEMORY: 128,
+        ACTION_MICRO_BATCH_SIZE: 10,
 
         ACTION_COMPLETION_TIMEOUT_MINUTES: 60,
 
@@ -164,7 +174,12 @@ class Ec2CreateSnapshotAction:
 
     }
 
-    def __init__(self, arguments):
+    def __init__(self, arguments, lock=None):
+        """
+        Initializes the action
+        :param arguments: Action arguments
+        :param lock: Optional lock used to serialize logging, used when the logger is shared with other action instances
+        """
 
         self._arguments = arguments
         self.logger = self._arguments[ACTION_PARAM_LOGGER]
@@ -203,6 +218,11 @@ class Ec2CreateSnapshotAction:
 
         self._all_volume_tags = None
 
+        # the logger is shared by the threads creating the snapshots for the volumes
+        self._lock = lock if lock is not None else threading.Lock()
+        # set to False if the version of the service api does not support setting tags when creating a snapshot
+        self._tag_on_create = True
+
         self.result = {
             "account": self.instance["AwsAccount"],
             "region": self.instance["Region"],
@@ -252,6 +272,38 @@ class Ec2CreateSnapshotAction:
                     raise ex
         return self._all_volume_tags
 
+    def set_volume_tags(self, tags):
+        """
+        Sets the tags of the volumes of the instance, used if the tags were read for multiple instances
+        :param tags: Tags indexed by volume id
+        :return:
+        """
+        self._all_volume_tags = tags
+
+    @property
+    def volumes_to_snapshot(self):
+        """
+        Returns the volumes of the instance for which a snapshot is created
+        :return: List of volume ids
+        """
+        volumes = []
+        if self.backup_root_device:
+            volumes.append(self.root_volume)
+        if self.backup_data_devices:
+            volumes += [volume for volume in self.volumes if volume != self.root_volume]
+        return volumes
+
+    def _log(self, log_method, msg, *args):
+        """
+        Logs a message, serializing access to the logger for the threads creating the snapshots
+        :param log_method: Logger method to call
+        :param msg: Message format string
+        :param args: Message arguments
+        :return:
+        """
+        with self._lock:
+            log_method(msg, *args)
+
     def create_volume_snapshot(self, volume):
         def get_tags_for_volume_snapshot(vol):
             vol_tags = self.copied_instance_tagfilter.pairs_matching_any_filter(self.instance_tags)
@@ -262,53 +314,71 @@ class Ec2CreateSnapshotAction:
             return {tag_key: vol_tags[tag_key] for tag_key in vol_tags if
                     not (tag_key.startswith("aws:") or tag_key.startswith("cloudformation:"))}
 
+        def create_snapshot(create_snapshot_args, tags):
+            if self._tag_on_create and len(tags) > 0:
+                try:
+                    resp = self.ec2_client.create_snapshot_with_retries(
+                        TagSpecifications=[{"ResourceType": "snapshot", "Tags": tags}], **create_snapshot_args)
+                    return resp, True
+                except ParamValidationError as param_ex:
+                    # api version used does not support tags on create, fall back to creating the tags after the snapshot
+                    self._log(self.logger.info, INFO_CREATE_TAGS_SEPARATELY, str(param_ex))
+                    self._tag_on_create = False
+            return self.ec2_client.create_snapshot_with_retries(**create_snapshot_args), False
+
+        start = time()
+
         device = self.volumes[volume]
         self.result[volume] = {"device": device}
+        self.result["volumes"][volume] = {}
 
         description = SNAPSHOT_DESCRIPTION.format(self.task, "root " if volume == self.root_volume else "", volume, device,
                                                   self.instance_id)
 
-        self.logger.info(INFO_CREATE_SNAPSHOT, volume, "root " if volume == self.root_volume else "", device, self.instance_id)
+        self._log(self.logger.info, INFO_CREATE_SNAPSHOT, volume, "root " if volume == self.root_volume else "", device,
+                  self.instance_id)
+
+        tags = get_tags_for_volume_snapshot(volume)
+        if self.set_snapshot_name:
+            dt = datetime.utcnow()
+            snapshot_name = SNAPSHOT_NAME.format(volume, dt.year, dt.month, dt.day, dt.hour, dt.minute)
+            if self.name_prefix:
+                snapshot_name = self.name_prefix + snapshot_name
+            tags["Name"] = snapshot_name
+            self._log(self.logger.info, INFO_SNAPSHOT_NAME, snapshot_name)
+        snapshot_tags = [{"Key": t, "Value": tags[t]} for t in tags]
 
         snapshot = ""
+        tagged = False
         try:
-            create_snapshot_resp = self.ec2_client.create_snapshot_with_retries(DryRun=self.dryrun, VolumeId=volume,
-                                                                                Description=description)
-            self.result["volumes"][volume] = {}
+            self._log(self.logger.info, INFO_CREATE_TAGS, tags)
+            create_snapshot_resp, tagged = create_snapshot({"DryRun": self.dryrun, "VolumeId": volume,
+                                                            "Description": description}, snapshot_tags)
             self.result["volumes"][volume]["create_snapshot"] = create_snapshot_resp
             snapshot = create_snapshot_resp["SnapshotId"]
-            self.logger.info(INFO_SNAPSHOT_CREATED, snapshot)
+            self._log(self.logger.info, INFO_SNAPSHOT_CREATED, snapshot, time() - start)
 
         except Exception as ex:
             if self.dryrun:
-                self.logger.info(str(ex))
+                self._log(self.logger.info, str(ex))
                 self.result["volumes"][volume]["create_snapshot"] = str(ex)
             else:
                 raise ex
 
-        try:
-            tags = get_tags_for_volume_snapshot(volume)
-
-            if self.set_snapshot_name:
-                dt = datetime.utcnow()
-                snapshot_name = SNAPSHOT_NAME.format(volume, dt.year, dt.month, dt.day, dt.hour, dt.minute)
-                if self.name_prefix:
-                    snapshot_name = self.name_prefix + snapshot_name
-                tags["Name"] = snapshot_name
-                self.logger.info(INFO_SNAPSHOT_NAME, snapshot_name)
-
-            self.logger.info(INFO_CREATE_TAGS, tags)
-            snapshot_tags = [{"Key": t, "Value": tags[t]} for t in tags]
-            create_tags_resp = self.ec2_client.create_tags_with_retries(DryRun=self.dryrun, Tags=snapshot_tags,
-                                                                        Resources=[snapshot])
-            self.result["volumes"][volume]["create_tags"] = create_tags_resp
-            self.logger.info(INFO_TAGS_CREATED)
-        except Exception as ex:
-            if self.dryrun:
-                self.logger.debug(str(ex))
-                self.result["volumes"][volume]["create_tags"] = str(ex)
-            else:
-                raise ex
+        if not tagged and len(snapshot_tags) > 0:
+            try:
+                create_tags_resp = self.ec2_client.create_tags_with_retries(DryRun=self.dryrun, Tags=snapshot_tags,
+                                                                            Resources=[snapshot])
+                self.result["volumes"][volume]["create_tags"] = create_tags_resp
+                self._log(self.logger.info, INFO_TAGS_CREATED)
+            except Exception as ex:
+                if self.dryrun:
+                    self._log(self.logger.debug, str(ex))
+                    self.result["volumes"][volume]["create_tags"] = str(ex)
+                else:
+                    raise ex
+
+        self.result["volumes"][volume]["latency"] = round(time() - start, 3)
 
     def is_completed(self, _, start_results):
         """
@@ -373,13 +443,11 @@ class Ec2CreateSnapshotAction:
         self.logger.info(INFO_START_SNAPSHOT_ACTION, self.instance_id, self.task)
         self.logger.debug("Instance block device mappings are {}", self.instance["BlockDeviceMappings"])
 
-        if self.backup_root_device:
-            self.create_volume_snapshot(self.root_volume)
-
-        if self.backup_data_devices:
-            for volume in self.volumes:
-                if volume != self.root_volume:
-                    self.create_volume_snapshot(volume)
+        volumes = self.volumes_to_snapshot
+        if len(volumes) > 0:
+            # read the tags of all volumes before the snapshots are created concurrently
+            _ = self.all_volume_tags
+            WorkerPool(max_workers=MAX_CONCURRENT_SNAPSHOTS).map(self.create_volume_snapshot, volumes)
 
         self.result[METRICS_DATA] = build_action_metrics(
             action=self,
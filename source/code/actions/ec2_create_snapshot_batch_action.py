@@ -0,0 +1,226 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import copy
+import json
+import threading
+
+import services
+from actions import *
+from actions.ec2_create_snapshot_action import Ec2CreateSnapshotAction, SNAPHOT_STATE_ERROR, SNAPSHOT_STATE_PENDING
+from boto_retry import get_client_with_retries, get_default_retry_strategy
+from util import safe_json
+from util.worker_pool import WorkerPool
+
+# max number of instances in a single action item
+MAX_INSTANCES = 100
+# max number of volumes for which snapshots are created concurrently
+MAX_CONCURRENT_SNAPSHOTS = 8
+# max number of values in a single filter for the describe_tags and describe_snapshots calls
+MAX_FILTER_VALUES = 200
+
+INFO_COMPLETED = "Creation of snapshot(s) completed"
+INFO_CREATION_PENDING = "Creation of {} snapshot(s) not completed yet"
+INFO_START_SNAPSHOT_ACTION = "Creating snapshots for {} volume(s) of {} EC2 instance(s) in account {}, region {} for task {}"
+INFO_STATE_SNAPSHOTS = "State of created snapshot(s) is {}"
+INFO_VOLUME_TAGS = "Read tags for {} volume(s) in {} describe_tags call(s)"
+
+ERR_CREATE_SNAPSHOT = "Error creating snapshot for volume {} of instance {}, {}"
+ERR_FAILED_SNAPSHOT = "Error creating snapshot {} for volume {}"
+ERR_NO_SNAPSHOTS_CREATED = "No snapshots created, {} error(s) creating snapshots"
+
+
+class Ec2CreateSnapshotBatchAction:
+    """
+    Creates snapshots for the volumes of multiple instances in the same account and region. Uses the same parameters as the
+    Ec2CreateSnapshot action, but the tags of the volumes of all instances are read with a single (paginated) describe_tags call
+    for every MAX_FILTER_VALUES volumes and the snapshots for all volumes are created concurrently.
+    """
+    properties = copy.deepcopy(Ec2CreateSnapshotAction.properties)
+    properties.update({
+        ACTION_TITLE: "EC2 Create Snapshot (aggregated)",
+        ACTION_VERSION: "1.0",
+        ACTION_DESCRIPION: "Creates snapshots for multiple EC2 Instances in the same account and region",
+        ACTION_ID: "0579fa4b-2411-469b-bb37-049f8822ca6c",
+
+        ACTION_AGGREGATION: ACTION_AGGREGATION_ACCOUNT,
+        ACTION_BATCH_SIZE: MAX_INSTANCES
+    })
+    properties.pop(ACTION_MICRO_BATCH_SIZE, None)
+
+    def __init__(self, arguments):
+
+        self._arguments = arguments
+        self.logger = self._arguments[ACTION_PARAM_LOGGER]
+        self.context = self._arguments[ACTION_PARAM_CONTEXT]
+        self.session = self._arguments[ACTION_PARAM_SESSION]
+
+        self.task = self._arguments[ACTION_PARAM_TASK]
+        self.instances = self._arguments[ACTION_PARAM_RESOURCES]
+        self.dryrun = self._arguments.get(ACTION_PARAM_DRYRUN, False)
+
+        self.account = self.instances[0]["AwsAccount"] if len(self.instances) > 0 else None
+        self.region = self.instances[0]["Region"] if len(self.instances) > 0 else None
+        self._ec2_client = None
+
+        # shared by the threads creating the snapshots to serialize logging
+        self._lock = threading.Lock()
+
+        # the snapshots for the volumes of each instance are created by an instance of the action for a single instance
+        self._instance_actions = []
+        for instance in self.instances:
+            instance_arguments = dict(self._arguments)
+            instance_arguments[ACTION_PARAM_RESOURCES] = instance
+            self._instance_actions.append(Ec2CreateSnapshotAction(instance_arguments, lock=self._lock))
+
+        self.result = {
+            "account": self.account,
+            "region": self.region,
+            "task": self.task,
+            "instances": {}
+        }
+
+    @property
+    def ec2_client(self):
+        if self._ec2_client is None:
+            self._ec2_client = get_client_with_retries("ec2", ["describe_tags"], region=self.region, session=self.session)
+        return self._ec2_client
+
+    def _read_volume_tags(self, volumes):
+        """
+        Reads the tags for a list of volumes, using a single paginated describe_tags call for every MAX_FILTER_VALUES volumes
+        :param volumes: Volume ids
+        :return: Tags indexed by volume id
+        """
+        volume_tags = {}
+        calls = 0
+        try:
+            for i in range(0, len(volumes), MAX_FILTER_VALUES):
+                describe_tags_args = {
+                    "DryRun": self.dryrun,
+                    "Filters": [{"Name": "resource-id", "Values": volumes[i:i + MAX_FILTER_VALUES]}]
+                }
+                while True:
+                    describe_tag_resp = self.ec2_client.describe_tags_with_retries(**describe_tags_args)
+                    calls += 1
+                    for tag in describe_tag_resp.get("Tags", []):
+                        volume_tags.setdefault(tag["ResourceId"], {})[tag["Key"]] = tag["Value"]
+                    if "NextToken" in describe_tag_resp:
+                        describe_tags_args["NextToken"] = describe_tag_resp["NextToken"]
+                    else:
+                        break
+        except Exception as ex:
+            if self.dryrun:
+                self.logger.debug(str(ex))
+                self.result["describe_tags"] = str(ex)
+                return {v: {"dryrun": ""} for v in volumes}
+            raise ex
+
+        self.logger.info(INFO_VOLUME_TAGS, len(volumes), calls)
+        return volume_tags
+
+    def is_completed(self, _, start_results):
+        """
+        Tests if the snapshots for all instances have been completed
+        :param start_results: Result of the execute method that started the creation of the snapshots
+        :param _: not used
+        :return:  Result of test if all snapshots are available, None if at least one snapshot is in pending state
+        """
+
+        snapshot_create_data = json.loads(start_results)
+
+        self.logger.debug("Start result data is {}", start_results)
+
+        snapshot_ids = []
+        for instance_data in snapshot_create_data.get("instances", {}).values():
+            for volume in instance_data.get("volumes", {}).values():
+                create_snapshot = volume.get("create_snapshot", {})
+                if isinstance(create_snapshot, dict) and "SnapshotId" in create_snapshot:
+                    snapshot_ids.append(create_snapshot["SnapshotId"])
+
+        self.logger.info("Checking status of {} snapshot(s)", len(snapshot_ids))
+
+        ec2 = services.create_service("ec2", session=self.session,
+                                      service_retry_strategy=get_default_retry_strategy("ec2", context=self.context))
+
+        snapshots = []
+        for i in range(0, len(snapshot_ids), MAX_FILTER_VALUES):
+            snapshots += list(ec2.describe("Snapshots", region=snapshot_create_data.get("region"), OwnerIds=["self"],
+                                           Filters=[{"Name": "snapshot-id", "Values": snapshot_ids[i:i + MAX_FILTER_VALUES]}]))
+
+        test_result = {
+            "Volumes": [{
+                "VolumeId": s["VolumeId"],
+                "SnapshotId": s["SnapshotId"],
+                "State": s["State"],
+                "Progress": s["Progress"]
+            } for s in snapshots]
+        }
+
+        self.logger.info(INFO_STATE_SNAPSHOTS, json.dumps(test_result))
+
+        pending = [volume for volume in test_result["Volumes"] if volume["State"] == SNAPSHOT_STATE_PENDING]
+        if len(pending) > 0:
+            self.logger.info(INFO_CREATION_PENDING, len(pending))
+            return None
+
+        failed = [volume for volume in test_result["Volumes"] if volume["State"] == SNAPHOT_STATE_ERROR]
+        if len(failed) > 0:
+            s = ",".join([ERR_FAILED_SNAPSHOT.format(volume["SnapshotId"], volume["VolumeId"]) for volume in failed])
+            raise Exception(s)
+
+        self.logger.info(INFO_COMPLETED)
+        return safe_json(test_result)
+
+    def execute(self, _):
+        self.logger.info("{}, version {}", self.properties[ACTION_TITLE], self.properties[ACTION_VERSION])
+
+        volumes = [(instance_action, volume) for instance_action in self._instance_actions
+                   for volume in instance_action.volumes_to_snapshot]
+
+        self.logger.info(INFO_START_SNAPSHOT_ACTION, len(volumes), len(self.instances), self.account, self.region, self.task)
+
+        if len(volumes) > 0:
+            volume_tags = self._read_volume_tags([v[1] for v in volumes])
+            for instance_action in self._instance_actions:
+                instance_action.set_volume_tags({v: volume_tags.get(v, {}) for v in instance_action.volumes})
+
+        def create_volume_snapshot(instance_volume):
+            instance_action, volume = instance_volume
+            instance_action.create_volume_snapshot(volume)
+
+        results = WorkerPool(max_workers=MAX_CONCURRENT_SNAPSHOTS).map(create_volume_snapshot, volumes, return_exceptions=True)
+
+        # failed snapshots are reported, the snapshots that were created are checked for completion
+        errors = []
+        for (instance_action, volume), result in zip(volumes, results):
+            if isinstance(result, Exception):
+                self.logger.error(ERR_CREATE_SNAPSHOT, volume, instance_action.instance_id, str(result))
+                errors.append({"instance": instance_action.instance_id, "volume": volume, "error": str(result)})
+
+        for instance_action in self._instance_actions:
+            self.result["instances"][instance_action.instance_id] = {"volumes": instance_action.result["volumes"]}
+
+        created = [volume for instance_data in self.result["instances"].values() for volume in instance_data["volumes"].values()
+                   if isinstance(volume.get("create_snapshot"), dict)]
+
+        if len(errors) > 0:
+            self.result["errors"] = errors
+            if len(created) == 0 and not self.dryrun:
+                raise Exception(ERR_NO_SNAPSHOTS_CREATED.format(len(errors)))
+
+        self.result[METRICS_DATA] = build_action_metrics(
+            action=self,
+            CreatedSnapshots=len(created),
+            SnapshotsSizeTotal=sum([volume["create_snapshot"].get("VolumeSize", 0) for volume in created]))
+
+        return safe_json(self.result)
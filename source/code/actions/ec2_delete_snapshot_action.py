@@ -11,6 +11,7 @@
 #  and limitations under the License.                                                                                #
 ######################################################################################################################
 
+from collections import namedtuple
 from datetime import datetime, timedelta
 from botocore.exceptions import ClientError
 
@@ -21,10 +22,17 @@ import services.ec2_service
 from actions import *
 from boto_retry import get_client_with_retries
 from util import safe_json
+from util.worker_pool import WorkerPool
 
 
 MAX_SNAPSHOTS = 1000
 
+# max number of snapshots deleted concurrently in a region, throttled calls are retried by the retry strategy of the client
+MAX_CONCURRENT_DELETES = 5
+
+# snapshot attributes used by the action, the start time is parsed once
+SnapshotRecord = namedtuple("SnapshotRecord", ["snapshot_id", "volume_id", "region", "start_time", "start_time_str"])
+
 GROUP_TITLE_DELETE_OPTIONS = "Snapshot delete options"
 
 PARAM_DESC_RETENTION_COUNT = "Number of snapshots to keep for a volume, use 0 to use retention days"
@@ -156,80 +164,101 @@ class Ec2DeleteSnapshotAction:
             "task": self.task
         }
 
+    def _snapshot_records(self):
+        """
+        Returns the snapshots as records with a parsed start time
+        :return: List of snapshot records
+        """
+        return [SnapshotRecord(snapshot_id=sn["SnapshotId"],
+                               volume_id=sn["VolumeId"],
+                               region=sn["Region"],
+                               start_time=dateutil.parser.parse(sn["StartTime"]),
+                               start_time_str=sn["StartTime"]) for sn in self.snapshots]
+
     def execute(self, _):
 
-        def snapshots_to_delete():
+        def snapshots_to_delete(snapshot_records):
 
             def by_retention_days():
 
                 delete_before_dt = datetime.utcnow().replace(tzinfo=pytz.timezone("UTC")) - timedelta(days=int(self.retention_days))
                 self.logger.info(INFO_RETENTION_DAYS, delete_before_dt)
 
-                for sn in sorted(self.snapshots, key=lambda s: s["Region"]):
-                    snapshot_dt = dateutil.parser.parse(sn["StartTime"])
-                    if snapshot_dt < delete_before_dt:
-                        self.logger.info(INFO_SN_RETENTION_DAYS, sn["SnapshotId"], sn["StartTime"], self.retention_days)
+                for sn in snapshot_records:
+                    if sn.start_time < delete_before_dt:
+                        self.logger.info(INFO_SN_RETENTION_DAYS, sn.snapshot_id, sn.start_time_str, self.retention_days)
                         yield sn
 
             def by_retention_count():
 
                 self.logger.info(INFO_KEEP_RETENTION_COUNT, self.retention_count)
-                sorted_snapshots = sorted(self.snapshots,
-                                          key=lambda s: (s["VolumeId"], dateutil.parser.parse(s["StartTime"])),
-                                          reverse=True)
+                sorted_snapshots = sorted(snapshot_records, key=lambda s: (s.volume_id, s.start_time), reverse=True)
                 volume = None
                 count_for_volume = 0
                 for sn in sorted_snapshots:
-                    if sn["VolumeId"] != volume:
-                        volume = sn["VolumeId"]
+                    if sn.volume_id != volume:
+                        volume = sn.volume_id
                         count_for_volume = 0
 
                     count_for_volume += 1
                     if count_for_volume > self.retention_count:
-                        self.logger.info(INFO_SN_DELETE_RETENTION_COUNT, sn["SnapshotId"], count_for_volume)
+                        self.logger.info(INFO_SN_DELETE_RETENTION_COUNT, sn.snapshot_id, count_for_volume)
                         yield sn
 
             return by_retention_days() if self.retention_days else by_retention_count()
 
+        def delete_snapshot(ec2_client, sn):
+            # runs in a worker thread, logging is done by the caller
+            try:
+                ec2_client.delete_snapshot_with_retries(DryRun=self.dryrun, SnapshotId=sn.snapshot_id)
+                return True
+            except ClientError as ex_client:
+                if ex_client.response.get("Error", {}).get("Code", "") == "InvalidSnapshot.NotFound":
+                    return False
+                raise ex_client
+
         self.logger.info("{}, version {}", self.properties[ACTION_TITLE], self.properties[ACTION_VERSION])
 
-        region = None
-        ec2 = None
         deleted_count = 0
 
         self.logger.info(INFO_ACCOUNT_SNAPSHOTS, len(self.snapshots), self.account)
 
         self.logger.debug("Snapshots : {}", self.snapshots)
 
-        snapshot_id = ""
-        for snapshot in snapshots_to_delete():
-
-            if snapshot["Region"] != region:
-                region = snapshot["Region"]
-                self.logger.info(INFO_REGION, region)
-                ec2 = get_client_with_retries("ec2", ["delete_snapshot"], region=region, context=self.context, session=self.session)
-                if "deleted" not in self.result:
-                    self.result["deleted"] = {}
-                self.result["deleted"][region] = []
-
-            try:
-                snapshot_id = snapshot["SnapshotId"]
-                ec2.delete_snapshot_with_retries(DryRun=self.dryrun, SnapshotId=snapshot_id)
-                deleted_count += 1
-                self.logger.info(INFO_SNAPSHOT_DELETED, snapshot_id, snapshot["VolumeId"])
-                self.result["deleted"][region].append(snapshot_id)
-            except ClientError as ex_client:
-                if ex_client.response.get("Error", {}).get("Code", "") == "InvalidSnapshot.NotFound":
-                    self.logger.info("Snapshot \"{}\" was not found and could not be deleted", snapshot_id)
+        snapshots_by_region = {}
+        for snapshot in snapshots_to_delete(self._snapshot_records()):
+            snapshots_by_region.setdefault(snapshot.region, []).append(snapshot)
+
+        for region in sorted(snapshots_by_region):
+
+            self.logger.info(INFO_REGION, region)
+            ec2 = get_client_with_retries("ec2", ["delete_snapshot"], region=region, context=self.context, session=self.session)
+            if "deleted" not in self.result:
+                self.result["deleted"] = {}
+            self.result["deleted"][region] = []
+
+            region_snapshots = snapshots_by_region[region]
+            results = WorkerPool(max_workers=MAX_CONCURRENT_DELETES).map(lambda sn: delete_snapshot(ec2, sn), region_snapshots,
+                                                                         return_exceptions=True)
+            error = None
+            for snapshot, result in zip(region_snapshots, results):
+                if isinstance(result, Exception):
+                    if self.dryrun:
+                        self.logger.debug(str(result))
+                        self.result["delete_snapshot"] = str(result)
+                        return self.result
+                    if error is None:
+                        error = result
+                elif result:
+                    deleted_count += 1
+                    self.logger.info(INFO_SNAPSHOT_DELETED, snapshot.snapshot_id, snapshot.volume_id)
+                    self.result["deleted"][region].append(snapshot.snapshot_id)
                 else:
-                    raise ex_client
-            except Exception as ex:
-                if self.dryrun:
-                    self.logger.debug(str(ex))
-                    self.result["delete_snapshot"] = str(ex)
-                    return self.result
-                else:
-                    raise ex
+                    self.logger.info("Snapshot \"{}\" was not found and could not be deleted", snapshot.snapshot_id)
+
+            # snapshots that were deleted concurrently with the failed delete are logged before raising the error
+            if error is not None:
+                raise error
 
         self.result.update({
             "snapshots": len(self.snapshots),
@@ -239,4 +268,3 @@ class Ec2DeleteSnapshotAction:
         })
 
         return safe_json(self.result)
-
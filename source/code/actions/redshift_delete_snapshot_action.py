@@ -11,7 +11,9 @@
 #  and limitations under the License.                                                                                #
 ######################################################################################################################
 
+from collections import namedtuple
 from datetime import datetime, timedelta
+from time import time
 
 import dateutil.parser
 
@@ -19,6 +21,16 @@ import pytz
 import services.redshift_service
 from actions import *
 from boto_retry import get_client_with_retries
+from util.worker_pool import WorkerPool
+
+# max number of snapshots deleted concurrently in a region
+MAX_CONCURRENT_DELETES = 5
+# max number of concurrent calls revoking access to a snapshot
+MAX_CONCURRENT_REVOKES = 5
+
+# snapshot attributes used by the action, the create time is parsed once
+ClusterSnapshotRecord = namedtuple("ClusterSnapshotRecord", ["snapshot_id", "cluster_id", "region", "create_time",
+                                                             "create_time_str", "granted_accounts"])
 
 INFO_REVOKE_ACCESS = "Revoking restore access for account {}"
 
@@ -39,6 +51,8 @@ INFO_RETENTION_DAYS = "Deleting snapshots older than {}"
 INFO_SN_DELETE_RETENTION_COUNT = "Deleting snapshot {}, because count for its volume is {}"
 INFO_SN_RETENTION_DAYS = "Deleting snapshot {} ({}) because it is older than retention period of {} days"
 INFO_SNAPSHOT_DELETED = "Deleted snapshot {} for volume {}"
+INFO_SNAPSHOT_TIMINGS = "Revoked access for {} account(s) in {:>.3f} seconds, deleted snapshot in {:>.3f} seconds"
+INFO_THROUGHPUT = "Deleted {} snapshot(s) in {:>.3f} seconds, {:>.2f} snapshots per second"
 
 ERR_RETENTION_PARAM_BOTH = "Only one of {} or {} parameters can be specified"
 ERR_RETENTION_PARAM_NONE = "{} or {} parameter must be specified"
@@ -136,92 +150,130 @@ class RedshiftDeleteSnapshotAction:
             "task": self.task
         }
 
+    def _snapshot_records(self):
+        """
+        Returns the snapshots as records with a parsed create time
+        :return: List of snapshot records
+        """
+        return [ClusterSnapshotRecord(snapshot_id=sn["SnapshotIdentifier"],
+                                      cluster_id=sn["ClusterIdentifier"],
+                                      region=sn["Region"],
+                                      create_time=dateutil.parser.parse(sn["SnapshotCreateTime"]),
+                                      create_time_str=sn["SnapshotCreateTime"],
+                                      granted_accounts=sn.get("AccountsWithRestoreAccess") or []) for sn in self.snapshots]
+
     def execute(self, _):
 
-        def snapshots_to_delete():
+        def snapshots_to_delete(snapshot_records):
 
             def by_retention_days():
 
                 delete_before_dt = datetime.utcnow().replace(tzinfo=pytz.timezone("UTC")) - timedelta(days=int(self.retention_days))
                 self.logger.info(INFO_RETENTION_DAYS, delete_before_dt)
 
-                for sn in sorted(self.snapshots, key=lambda s: s["Region"]):
-                    snapshot_dt = dateutil.parser.parse(sn["SnapshotCreateTime"])
-                    if snapshot_dt < delete_before_dt:
-                        self.logger.info(INFO_SN_RETENTION_DAYS, sn["SnapshotIdentifier"], sn["SnapshotCreateTime"],
-                                         self.retention_days)
+                for sn in snapshot_records:
+                    if sn.create_time < delete_before_dt:
+                        self.logger.info(INFO_SN_RETENTION_DAYS, sn.snapshot_id, sn.create_time_str, self.retention_days)
                         yield sn
 
             def by_retention_count():
 
                 self.logger.info(INFO_KEEP_RETENTION_COUNT, self.retention_count)
-                sorted_snapshots = sorted(self.snapshots,
-                                          key=lambda s: (s["ClusterIdentifier"], dateutil.parser.parse(s["SnapshotCreateTime"])),
-                                          reverse=True)
+                sorted_snapshots = sorted(snapshot_records, key=lambda s: (s.cluster_id, s.create_time), reverse=True)
                 volume = None
                 count_for_volume = 0
                 for sn in sorted_snapshots:
-                    if sn["ClusterIdentifier"] != volume:
-                        volume = sn["ClusterIdentifier"]
+                    if sn.cluster_id != volume:
+                        volume = sn.cluster_id
                         count_for_volume = 0
 
                     count_for_volume += 1
                     if count_for_volume > self.retention_count:
-                        self.logger.info(INFO_SN_DELETE_RETENTION_COUNT, sn["SnapshotIdentifier"], count_for_volume)
+                        self.logger.info(INFO_SN_DELETE_RETENTION_COUNT, sn.snapshot_id, count_for_volume)
                         yield sn
 
             return by_retention_days() if self.retention_days else by_retention_count()
 
+        def delete_snapshot(redshift_client, sn):
+            # runs in a worker thread, logging is done by the caller, returns the timings for the snapshot
+            start_snapshot = time()
+
+            def revoke_access(account):
+                redshift_client.revoke_snapshot_access_with_retries(SnapshotIdentifier=sn.snapshot_id,
+                                                                    SnapshotClusterIdentifier=sn.cluster_id,
+                                                                    AccountWithRestoreAccess=account)
+
+            WorkerPool(max_workers=MAX_CONCURRENT_REVOKES).map(revoke_access, sn.granted_accounts)
+            revoke_time = time() - start_snapshot
+
+            redshift_client.delete_cluster_snapshot_with_retries(SnapshotIdentifier=sn.snapshot_id,
+                                                                 SnapshotClusterIdentifier=sn.cluster_id)
+            return {
+                "revoked": len(sn.granted_accounts),
+                "revoke-time": round(revoke_time, 3),
+                "delete-time": round(time() - start_snapshot - revoke_time, 3)
+            }
+
         self.logger.info("{}, version {}", self.properties[ACTION_TITLE], self.properties[ACTION_VERSION])
 
-        region = None
-        redshift = None
+        start = time()
         deleted_count = 0
 
         self.logger.info(INFO_ACCOUNT_SNAPSHOTS, len(self.snapshots), self.account)
 
         self.logger.debug("Cluster Snapshots : {}", self.snapshots)
 
-        for snapshot in snapshots_to_delete():
-
-            if snapshot["Region"] != region:
-                region = snapshot["Region"]
-                self.logger.info(INFO_REGION, region)
-                redshift = get_client_with_retries("redshift", ["delete_cluster_snapshot", "revoke_snapshot_access"], region=region,
-                                                   context=self.context, session=self.session)
-                if "deleted" not in self.result:
-                    self.result["deleted"] = {}
-                self.result["deleted"][region] = []
-            try:
-                snapshot_id = snapshot["SnapshotIdentifier"]
-                cluster_id = snapshot["ClusterIdentifier"]
-                granted_accounts = snapshot.get("AccountsWithRestoreAccess", [])
-                if granted_accounts is None:
-                    granted_accounts = []
-
-                self.logger.info(INFO_DELETE_SNAPHOT, snapshot_id, cluster_id)
-                for account in granted_accounts:
+        snapshots_by_region = {}
+        for snapshot in snapshots_to_delete(self._snapshot_records()):
+            snapshots_by_region.setdefault(snapshot.region, []).append(snapshot)
+
+        for region in sorted(snapshots_by_region):
+
+            self.logger.info(INFO_REGION, region)
+            redshift = get_client_with_retries("redshift", ["delete_cluster_snapshot", "revoke_snapshot_access"], region=region,
+                                               context=self.context, session=self.session)
+            if "deleted" not in self.result:
+                self.result["deleted"] = {}
+                self.result["timings"] = {}
+            self.result["deleted"][region] = []
+
+            region_snapshots = snapshots_by_region[region]
+            for sn in region_snapshots:
+                self.logger.info(INFO_DELETE_SNAPHOT, sn.snapshot_id, sn.cluster_id)
+                for account in sn.granted_accounts:
                     self.logger.info(INFO_REVOKE_ACCESS, account)
-                    redshift.revoke_snapshot_access_with_retries(SnapshotIdentifier=snapshot_id,
-                                                                 SnapshotClusterIdentifier=cluster_id,
-                                                                 AccountWithRestoreAccess=account)
 
-                redshift.delete_cluster_snapshot_with_retries(SnapshotIdentifier=snapshot_id,
-                                                              SnapshotClusterIdentifier=cluster_id)
+            results = WorkerPool(max_workers=MAX_CONCURRENT_DELETES).map(lambda sn: delete_snapshot(redshift, sn),
+                                                                         region_snapshots, return_exceptions=True)
+            error = None
+            for snapshot, result in zip(region_snapshots, results):
+                if isinstance(result, Exception):
+                    if self.dryrun:
+                        self.logger.debug(str(result))
+                        self.result["delete_cluster_snapshot"] = str(result)
+                        return self.result
+                    if error is None:
+                        error = result
+                    continue
+
                 deleted_count += 1
-                self.logger.info(INFO_SNAPSHOT_DELETED, snapshot_id, cluster_id)
-                self.result["deleted"][region].append(snapshot_id)
+                self.logger.info(INFO_SNAPSHOT_DELETED, snapshot.snapshot_id, snapshot.cluster_id)
+                self.logger.info(INFO_SNAPSHOT_TIMINGS, result["revoked"], result["revoke-time"], result["delete-time"])
+                self.result["deleted"][region].append(snapshot.snapshot_id)
+                self.result["timings"][snapshot.snapshot_id] = result
+
+            # snapshots that were deleted concurrently with the failed delete are logged before raising the error
+            if error is not None:
+                raise error
 
-            except Exception as ex:
-                if self.dryrun:
-                    self.logger.debug(str(ex))
-                    self.result["delete_cluster_snapshot"] = str(ex)
-                    return self.result
-                else:
-                    raise ex
+        running_time = time() - start
+        throughput = deleted_count / running_time if running_time > 0 else 0.0
+        self.logger.info(INFO_THROUGHPUT, deleted_count, running_time, throughput)
 
         self.result.update({
             "snapshots": len(self.snapshots),
-            "total-deleted": deleted_count
+            "total-deleted": deleted_count,
+            "running-time": round(running_time, 3),
+            "snapshots-per-second": round(throughput, 2)
         })
         return self.result
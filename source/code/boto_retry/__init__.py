@@ -16,6 +16,8 @@ import types
 
 import boto3
 
+from util import rate_limiter
+from . import client_pool
 from .aws_service_retry import AwsApiServiceRetry
 from .dynamodb_service_retry import DynamoDbServiceRetry
 from .ec2_service_retry import Ec2ServiceRetry
@@ -29,16 +31,20 @@ DEFAULT_RANDOM_FACTOR = 0.2
 MAX_WAIT = 24 * 3600
 
 
-def make_method_with_retries(boto_client_or_resource, name, service_retry_strategy=None, method_suffix=DEFAULT_SUFFIX):
+def make_method_with_retries(boto_client_or_resource, name, service_retry_strategy=None, method_suffix=DEFAULT_SUFFIX,
+                             account=None, context=None):
     """
     Creates a wrapper for a boto3 method call that handles boto_retry in case of an exception from which
     it can recover. Situations in which case this is possible are defined in the service specific 
-    service_retry_strategy class
+    service_retry_strategy class. Calls are limited by the adaptive rate limiter for the service, method, account and region,
+    which is shared by all clients in the process.
     :param boto_client_or_resource: boto client or resource to add method to
     :param name: Name of the boto call
     :param service_retry_strategy: Strategy that implements the logic that determines if boto_retry are possible 
     in case of an exception
     :param method_suffix: suffix for wrapped boto method
+    :param account: Account the client or resource is used for, None if unknown
+    :param context: Lambda context passed to the strategy for every call, if None the context of the strategy is used
     :return: 
     """
 
@@ -47,9 +53,18 @@ def make_method_with_retries(boto_client_or_resource, name, service_retry_strate
     # new method name
     method_name = name + method_suffix
 
+    client_meta = getattr(boto_client_or_resource, "meta", None)
+    # resources use the meta data of their client
+    client_meta = getattr(getattr(client_meta, "client", None), "meta", client_meta)
+    service_model = getattr(client_meta, "service_model", None)
+    limiter = rate_limiter.get_rate_limiter(service=getattr(service_model, "service_name", None),
+                                            api=name,
+                                            account=account,
+                                            region=getattr(client_meta, "region_name", None))
+
     # closure function
     def wrapped_api_method(client_or_resource, **args):
-        return retry_strategy.call(client_or_resource, name, args)
+        return retry_strategy.call(client_or_resource, name, args, rate_limiter=limiter, context=context)
 
     # add closure function to the client or resource
     # noinspection PyArgumentList
@@ -110,11 +125,21 @@ def get_client_with_retries(service_name, methods, context=None, region=None, se
     :param methods: List of methods for which a new method will be added to the client wrapped in retry logic
     :param context: Lambda execution context
     :param region: Region for the client
-    :param session: Boto3 session, if None a new session will be created
+    :param session: Boto3 session, if None the pooled default session will be used
     :param wait_strategy: WaitStrategy to use for the added methods, if None the default strategy will be used for the service
     :param method_suffix: Suffix to add to the methods with retry logic that are added to the client, use none for DEFAULT_SUFFIX
     :return: Client for the service with additional method that use retry logic
     """
+
+    # clients for pooled sessions using the default strategy are reused, including warm Lambda invocations
+    if wait_strategy is None and (session is None or client_pool.is_pooled_session(session)):
+        return client_pool.get_client(service_name=service_name,
+                                      methods=methods,
+                                      context=context,
+                                      region=region,
+                                      session=session,
+                                      method_suffix=method_suffix)
+
     args = {
         "service_name": service_name,
     }
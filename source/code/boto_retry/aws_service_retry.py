@@ -10,11 +10,12 @@
 #  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
 #  and limitations under the License.                                                                                #
 ######################################################################################################################
+import copy
 from time import sleep, time
 
-from botocore.exceptions import ClientError
 
 import boto_retry
+from util.rate_limiter import is_throttling_error
 
 
 class AwsApiServiceRetry:
@@ -47,12 +48,7 @@ class AwsApiServiceRetry:
         :param ex: 
         :return: 
         """
-        if type(ex) == ClientError:
-            return False
-
-        response = getattr(ex, "response", {})
-        metadata = response.get("ResponseMetaData", {})
-        return metadata.get("HTTPStatusCode", 0) == 400 and metadata.get("RetryAttempts", 0) > 0 and "throttling" in ex.message
+        return is_throttling_error(ex)
 
     @classmethod
     def service_not_available(cls, ex):
@@ -61,12 +57,13 @@ class AwsApiServiceRetry:
         :param ex: 
         :return: 
         """
-        if type(ex) == ClientError:
+        response = getattr(ex, "response", None)
+        if not isinstance(response, dict):
             return False
 
-        response = getattr(ex, "response", {})
-        metadata = response.get("ResponseMetaData", {})
-        return metadata.get("HTTPStatusCode", 0) == 503
+        metadata = response.get("ResponseMetadata", {})
+        return metadata.get("HTTPStatusCode", 0) == 503 or \
+               response.get("Error", {}).get("Code", "") in ["ServiceUnavailable", "ServiceUnavailableException", "Unavailable"]
 
     def can_retry(self, ex):
         """
@@ -76,12 +73,14 @@ class AwsApiServiceRetry:
         """
         return any([rt(ex) for rt in self._call_retry_strategies])
 
-    def call(self, boto_client_or_resource, method_name, call_arguments):
+    def call(self, boto_client_or_resource, method_name, call_arguments, rate_limiter=None, context=None):
         """
         Calls the original boto3 methods that is wrapped in the retry logic
         :param boto_client_or_resource: Boto3 client or resource instance
         :param method_name: Name of the wrapped method with retries
         :param call_arguments: Boto3 method parameters
+        :param rate_limiter: Optional limiter for the calls of the method, the limit is adjusted by the result of every call
+        :param context: Lambda context of the caller, if None the context of the strategy is used
         :return: result of the wrapped boto3 method
         """
         def timed_out_by_specified_timeout(start_time, time_now, next_wait):
@@ -90,28 +89,37 @@ class AwsApiServiceRetry:
 
             return (time_now - start_time) > (self._timeout - next_wait)
 
+        call_context = context if context is not None else self._context
+
         def timed_out_by_lambda_timeout(next_wait):
-            if self._context is None:
+            if call_context is None:
                 return False
 
-            context_seconds_left = self._context.get_remaining_time_in_millis() * 1000
+            context_seconds_left = call_context.get_remaining_time_in_millis() * 1000
             return context_seconds_left < self._lambda_time_out_margin + next_wait
 
         start = time()
         # gets the method with the retry logic
         method = getattr(boto_client_or_resource, method_name)
 
-        # reset wait time strategy
-        self._wait_strategy.reset()
+        # use a reset copy of the wait time strategy as the same strategy instance can be used in concurrent calls
+        wait_strategy = copy.copy(self._wait_strategy)
+        wait_strategy.reset()
 
-        for wait_until_next_retry in self._wait_strategy:
+        for wait_until_next_retry in wait_strategy:
             try:
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
                 # make the "wrapped" call
                 resp = method(**call_arguments)
+                if rate_limiter is not None:
+                    rate_limiter.succeeded()
                 # no exceptions, just return result
                 return resp
             except Exception as ex:
                 # there was an exception
+                if rate_limiter is not None and is_throttling_error(ex):
+                    rate_limiter.throttled()
                 now = time()
                 # test if there should be a retry based on the type of the exception
                 if self.can_retry(ex):
@@ -0,0 +1,163 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import threading
+
+import boto3
+
+import boto_retry
+
+# sessions and clients are kept in module level variables so they are reused by warm Lambda invocations
+_lock = threading.RLock()
+
+# pooled sessions by role arn (None for the default session), items are tuples (session, id of credentials used by session)
+_sessions = {}
+# maps the id of a pooled session to its role arn
+_session_keys = {}
+# pooled clients by (role arn, region, service, method suffix), items are tuples (client, retry strategy)
+_clients = {}
+
+
+def get_session(role_arn=None, session_factory=None, credentials_id=None):
+    """
+    Returns a pooled session for a role, a new session is created if there is no session for the role in the pool or if the
+    pooled session was created for other credentials, in which case the clients created by the replaced session are removed
+    from the pool as well.
+    :param role_arn: Arn of the role, None for the default session
+    :param session_factory: Function that creates a new session for the role, if None a default boto3 session is created
+    :param credentials_id: Id of the credentials for the session, e.g. the access key id
+    :return: Pooled session
+    """
+    with _lock:
+        entry = _sessions.get(role_arn)
+        if entry is not None:
+            session, session_credentials_id = entry
+            if session_credentials_id == credentials_id:
+                return session
+            _remove_session(role_arn)
+
+        session = session_factory() if session_factory is not None else boto3.Session()
+        _sessions[role_arn] = (session, credentials_id)
+        _session_keys[id(session)] = role_arn
+        return session
+
+
+def is_pooled_session(session):
+    """
+    Tests if a session is a pooled session
+    :param session: Tested session
+    :return: True if the session is in the pool
+    """
+    with _lock:
+        return id(session) in _session_keys and _sessions.get(_session_keys[id(session)], (None,))[0] is session
+
+
+class _PooledClient:
+    """
+    Client returned by the pool, calls are delegated to the pooled boto3 client. Methods with retry logic are added to this
+    object and not to the pooled client so they use the Lambda context of the caller.
+    """
+
+    def __init__(self, client):
+        """
+        Initializes the client
+        :param client: Pooled boto3 client
+        """
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def get_client(service_name, methods=None, context=None, region=None, session=None, method_suffix=None):
+    """
+    Returns a pooled client for a service. The boto3 client is shared by all callers, the methods with the retry logic of the
+    default strategy for the service are added to a client object for the caller that delegates all other calls to the shared
+    client, so the methods use the Lambda context of the caller.
+    :param service_name: Name of the service
+    :param methods: List of methods for which a new method will be added to the client wrapped in retry logic
+    :param context: Lambda execution context
+    :param region: Region for the client
+    :param session: Pooled session used to create the client, if None the pooled default session is used
+    :param method_suffix: Suffix to add to the methods with retry logic that are added to the client, use none for DEFAULT_SUFFIX
+    :return: Client for the service using the pooled client
+    """
+    if method_suffix is None:
+        method_suffix = boto_retry.DEFAULT_SUFFIX
+
+    with _lock:
+
+        if session is None:
+            session = get_session()
+        elif not is_pooled_session(session):
+            raise ValueError("Session is not a pooled session")
+
+        key = (_session_keys[id(session)], region, service_name, method_suffix)
+        entry = _clients.get(key)
+        if entry is None:
+            args = {
+                "service_name": service_name,
+            }
+            if region is not None:
+                args["region_name"] = region
+            client = session.client(**args)
+            # strategy is shared by all callers, the context of the caller is passed with every call
+            service_retry_strategy = boto_retry.get_default_retry_strategy(service=service_name)
+            entry = (client, service_retry_strategy)
+            _clients[key] = entry
+
+    client, service_retry_strategy = entry
+    result = _PooledClient(client)
+    for method in methods if methods is not None else []:
+        boto_retry.make_method_with_retries(boto_client_or_resource=result,
+                                            name=method,
+                                            service_retry_strategy=service_retry_strategy,
+                                            method_suffix=method_suffix,
+                                            account=_account_for_role(key[0]),
+                                            context=context)
+    return result
+
+
+def _account_for_role(role_arn):
+    """
+    Returns the account of a role
+    :param role_arn: Arn of the role, None for the default session
+    :return: Account of the role, None for the default session
+    """
+    if role_arn is None:
+        return None
+    elements = role_arn.split(":")
+    return elements[4] if len(elements) > 4 else None
+
+
+def _remove_session(role_arn):
+    """
+    Removes a session and the clients created with that session from the pool
+    :param role_arn: Arn of the role of the session
+    :return:
+    """
+    entry = _sessions.pop(role_arn, None)
+    if entry is not None:
+        _session_keys.pop(id(entry[0]), None)
+    for key in [k for k in _clients if k[0] == role_arn]:
+        del _clients[key]
+
+
+def clear():
+    """
+    Removes all sessions and clients from the pool
+    :return:
+    """
+    with _lock:
+        _sessions.clear()
+        _session_keys.clear()
+        _clients.clear()
@@ -0,0 +1,107 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import calendar
+import threading
+import uuid
+from time import time
+
+from boto_retry import client_pool
+
+# credentials are refreshed when they expire within this period, this must be longer than the max execution time of the
+# Lambda functions using the credentials
+REFRESH_MARGIN_SECONDS = 15 * 60
+
+CREDENTIALS_ACCESS_KEY = "AccessKeyId"
+CREDENTIALS_SECRET_KEY = "SecretAccessKey"
+CREDENTIALS_TOKEN = "SessionToken"
+CREDENTIALS_EXPIRATION = "Expiration"
+
+SESSION_NAME = "{}-{}"
+
+# credentials for assumed roles by role arn, kept in module so they are reused by warm Lambda invocations
+_credentials = {}
+_lock = threading.RLock()
+# lock per role so credentials for different roles can be retrieved concurrently
+_role_locks = {}
+
+
+def _is_valid(credentials):
+    """
+    Tests if credentials can still be used
+    :param credentials: Tested credentials
+    :return: True if the credentials do not expire within the refresh margin
+    """
+    return credentials is not None and credentials[CREDENTIALS_EXPIRATION] - time() > REFRESH_MARGIN_SECONDS
+
+
+def _role_lock(role_arn):
+    """
+    Returns the lock for a role
+    :param role_arn: Arn of the role
+    :return: Lock for the role
+    """
+    with _lock:
+        if role_arn not in _role_locks:
+            _role_locks[role_arn] = threading.Lock()
+        return _role_locks[role_arn]
+
+
+def _assume_role(role_arn, sts_client=None):
+    """
+    Gets new credentials by assuming the role
+    :param role_arn: Arn of the role
+    :param sts_client: Optional sts client
+    :return: Credentials for the role
+    """
+    sts = sts_client if sts_client is not None else client_pool.get_client("sts")
+    account = role_arn.split(":")[4] if len(role_arn.split(":")) > 4 else ""
+    token = sts.assume_role(RoleArn=role_arn, RoleSessionName=SESSION_NAME.format(account, str(uuid.uuid4())))
+    credentials = token["Credentials"]
+    return {
+        CREDENTIALS_ACCESS_KEY: credentials[CREDENTIALS_ACCESS_KEY],
+        CREDENTIALS_SECRET_KEY: credentials[CREDENTIALS_SECRET_KEY],
+        CREDENTIALS_TOKEN: credentials[CREDENTIALS_TOKEN],
+        CREDENTIALS_EXPIRATION: float(calendar.timegm(credentials[CREDENTIALS_EXPIRATION].utctimetuple()))
+    }
+
+
+def get_credentials(role_arn, sts_client=None):
+    """
+    Returns credentials for a role. Credentials are reused until they expire within the refresh margin, in which case they are
+    retrieved by assuming the role.
+    :param role_arn: Arn of the role
+    :param sts_client: Optional sts client used to assume the role
+    :return: Dictionary with AccessKeyId, SecretAccessKey, SessionToken and Expiration (seconds since epoch)
+    """
+    credentials = _credentials.get(role_arn)
+    if _is_valid(credentials):
+        return credentials
+
+    with _role_lock(role_arn):
+        # test again as credentials might have been refreshed by another thread
+        credentials = _credentials.get(role_arn)
+        if _is_valid(credentials):
+            return credentials
+
+        credentials = _assume_role(role_arn, sts_client)
+        _credentials[role_arn] = credentials
+        return credentials
+
+
+def clear():
+    """
+    Removes all cached credentials from memory
+    :return:
+    """
+    with _lock:
+        _credentials.clear()
@@ -56,6 +56,14 @@ CONFIG_EVENTS = "Events"
 CONFIG_STACK_ID = "StackId"
 # action timeout
 CONFIG_TASK_TIMEOUT = "TaskTimeout"
+# max number of account/region combinations in which resources are selected concurrently
+CONFIG_SELECT_CONCURRENCY = "SelectConcurrency"
 
 
 
+
+# name of the item in the configuration table that holds the version of the configuration, the version is increased for every
+# change made to the configuration
+CONFIG_VERSION_ITEM = "__ConfigurationVersion__"
+# attribute holding the version number
+CONFIG_VERSION = "Version"
@@ -93,6 +93,9 @@ def create_task(context=None, **kwargs):
     
     -CONFIG_TASK_TIMEOUT: Timeout in minutes for task to complete (optional, default is action's value or global timeout, number)
 
+    -CONFIG_SELECT_CONCURRENCY: Max number of account/region combinations in which resources are selected concurrently
+    (optional, default is action's value or the default of the select resources handler, number)
+
     -CONFIG_TASK_NAME: Name of the task, exception is raised if not specified or name does already exist (mandatory, string)
 
     -CONFIG_PARAMETERS: dictionary with names and values passed to the executed action of this task(optional,default {}, dictionary)
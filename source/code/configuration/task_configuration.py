@@ -11,9 +11,12 @@
 #  and limitations under the License.                                                                                #
 ######################################################################################################################
 
+import copy
 import decimal
 import os
 import re
+import threading
+import time
 
 import boto3
 
@@ -49,6 +52,7 @@ WARN_NOT_REGIONAL_SERVICE = "One or more regions ({}) are specified but service
 WARN_OVERLAPPING_ROLES = "Account {} in cross account role \"{}\" is overlapping with account other role or scheduler account"
 WARN_NO_ENV_CONFIG_BUCKET = "No configuration bucket defined in environment variable \"{}\""
 WARN_READING_TASK_ROLES = "Error reading roles from {} in bucket {}, ({})"
+WARN_INVALID_EVENTS = "Events of configuration item {} are not valid, item is not used for routing events ({})"
 
 ERR_ERR_IN_CONFIG_ITEM = "Error in configuration item : {} ({})"
 ERR_INVALID_CRON_EXPRESSION = "{} is not a valid cron expression, ({})"
@@ -70,6 +74,8 @@ ERR_WRONG_PARAM_TYPE = "Type of parameter \"{}\" must be \"{}\", current type fo
 ERR_TIMEOUT_NOT_ALLOWED = "Action {} has no completion handling, timeout parameter not allowed"
 ERR_INVALID_NUMERIC_TIMEOUT = "{} is not a valid numeric value for timeout parameter ({})"
 ERR_TIMEOUT_MUST_BE_GREATER_0 = "Timeout parameter value must be > 0, current value is {}"
+ERR_INVALID_NUMERIC_SELECT_CONCURRENCY = "{} is not a valid numeric value for select concurrency parameter ({})"
+ERR_SELECT_CONCURRENCY_MUST_BE_GREATER_0 = "Select concurrency parameter value must be > 0, current value is {}"
 
 _checked_timezones = dict()
 _invalid_timezones = set()
@@ -77,6 +83,63 @@ _invalid_timezones = set()
 _service_regions = {}
 _service_is_regional = {}
 
+# max age in seconds of a configuration snapshot, after this period the configuration is read again even if the version of the
+# configuration did not change, which picks up changes that were not made through this class and changed task roles files
+CONFIG_SNAPSHOT_MAX_AGE = 300
+
+# snapshots of the configuration by table name, kept in module so they are reused by warm Lambda invocations
+_config_snapshots = {}
+_config_snapshots_lock = threading.Lock()
+
+
+class ConfigurationSnapshot:
+    """
+    Items read from the configuration table for a version of the configuration and the tasks for these items
+    """
+
+    def __init__(self, version, items):
+        self.version = version
+        self.items = items
+        self.items_by_name = {item[configuration.CONFIG_TASK_NAME]: item for item in items
+                              if configuration.CONFIG_TASK_NAME in item}
+        self.created = time.time()
+        # validated tasks by task name, None for items that are not valid, tasks are validated when first used
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self._event_index = None
+
+    @property
+    def expired(self):
+        return time.time() - self.created > CONFIG_SNAPSHOT_MAX_AGE
+
+    def event_index(self, warn):
+        """
+        Returns index for routing events to tasks, the index is built from the items when first used. Items with invalid events
+        are skipped so these do not stop the routing of events to other tasks.
+        :param warn: Function called with a message format string and arguments for items that are skipped
+        :return: Dictionary with for every event name a dictionary with the names of the tasks by event value, "*" for tasks
+        that handle all values
+        """
+        with self.lock:
+            if self._event_index is None:
+                index = {}
+                for item in self.items:
+                    try:
+                        task_name = item[configuration.CONFIG_TASK_NAME]
+                        item_index = {}
+                        for event_name, event_values in item.get(configuration.CONFIG_EVENTS, {}).items():
+                            item_index[event_name] = set([v.strip().lower() for v in str(event_values).split(",")])
+                    except Exception as ex:
+                        warn(WARN_INVALID_EVENTS, item.get(configuration.CONFIG_TASK_NAME, ""), ex)
+                        continue
+
+                    for event_name in item_index:
+                        values = index.setdefault(event_name, {})
+                        for value in item_index[event_name]:
+                            values.setdefault(value, []).append(task_name)
+                self._event_index = index
+            return self._event_index
+
 
 class TaskConfiguration:
     """
@@ -106,7 +169,7 @@ class TaskConfiguration:
         tablename = os.getenv(configuration.ENV_CONFIG_TABLE)
 
         table = boto3.resource("dynamodb").Table(tablename)
-        add_retry_methods_to_resource(table, ["scan", "get_item", "delete_item", "put_item"], context=self._context)
+        add_retry_methods_to_resource(table, ["scan", "get_item", "delete_item", "put_item", "update_item"], context=self._context)
 
         return table
 
@@ -182,7 +245,7 @@ class TaskConfiguration:
 
     def _warn(self, msg, *args):
         if self._logger:
-            self._logger.warn(msg, *args)
+            self._logger.warning(msg, *args)
         else:
             print(msg.format(*args))
 
@@ -192,25 +255,69 @@ class TaskConfiguration:
         else:
             print(msg.format(*args))
 
-    def config_items(self, include_internal=False):
+    def config_version(self):
         """
-        Returns all items from the configuration table
-        :return: all items from the configuration table
+        Returns the version of the configuration
+        :return: Version of the configuration, 0 if the configuration was never changed through this class
+        """
+        resp = self.config_table.get_item_with_retries(Key={configuration.CONFIG_TASK_NAME: configuration.CONFIG_VERSION_ITEM},
+                                                       ConsistentRead=True)
+        return int(resp.get("Item", {}).get(configuration.CONFIG_VERSION, 0))
+
+    def _increase_config_version(self):
+        """
+        Increases the version of the configuration, which makes all snapshots of the configuration read the configuration again
+        :return:
         """
+        self.config_table.update_item_with_retries(Key={configuration.CONFIG_TASK_NAME: configuration.CONFIG_VERSION_ITEM},
+                                                   UpdateExpression="ADD #version :one",
+                                                   ExpressionAttributeNames={"#version": configuration.CONFIG_VERSION},
+                                                   ExpressionAttributeValues={":one": 1})
 
+    def _scan_config_items(self):
+        """
+        Reads all task items from the configuration table
+        :return: all task items from the configuration table
+        """
         scan_args = {
         }
 
         while True:
             scan_resp = self.config_table.scan_with_retries(**scan_args)
             for item in scan_resp.get("Items", []):
-                if not item.get(configuration.CONFIG_INTERNAL, False) or include_internal:
+                if item.get(configuration.CONFIG_TASK_NAME) != configuration.CONFIG_VERSION_ITEM:
                     yield item
             if "LastEvaluatedKey" in scan_resp:
                 scan_args["ExclusiveStartKey"] = scan_resp["LastEvaluatedKey"]
             else:
                 break
 
+    def config_snapshot(self):
+        """
+        Returns a snapshot of the configuration. The table is only scanned if the version of the configuration has changed or if the
+        snapshot is older than the max age of snapshots.
+        :return: Snapshot of the configuration
+        """
+        table_name = os.getenv(configuration.ENV_CONFIG_TABLE)
+        version = self.config_version()
+
+        with _config_snapshots_lock:
+            snapshot = _config_snapshots.get(table_name)
+            if snapshot is None or snapshot.version != version or snapshot.expired:
+                snapshot = ConfigurationSnapshot(version=version, items=list(self._scan_config_items()))
+                _config_snapshots[table_name] = snapshot
+            return snapshot
+
+    def config_items(self, include_internal=False):
+        """
+        Returns all items from the configuration table
+        :return: all items from the configuration table
+        """
+        for item in self.config_snapshot().items:
+            if not item.get(configuration.CONFIG_INTERNAL, False) or include_internal:
+                # copy as items are shared by all users of the snapshot
+                yield copy.deepcopy(item)
+
     def get_config_item(self, name):
         """
         Reads a specific item from the configuration using its name as the key
@@ -229,6 +336,7 @@ class TaskConfiguration:
         """
 
         self.config_table.delete_item_with_retries(Key={configuration.CONFIG_TASK_NAME: name})
+        self._increase_config_version()
 
     def put_config_item(self, **kwargs):
         """
@@ -239,6 +347,7 @@ class TaskConfiguration:
         """
         config_item = self._verify_configuration_item(**kwargs)
         self.config_table.put_item_with_retries(Item=config_item)
+        self._increase_config_version()
         return config_item
 
     @classmethod
@@ -584,6 +693,25 @@ class TaskConfiguration:
         except ValueError as ex:
             raise ValueError(ERR_INVALID_NUMERIC_TIMEOUT.format(timeout, ex))
 
+    @staticmethod
+    def verify_select_concurrency(concurrency):
+        """
+        Verifies the max number of account/region combinations in which resources are selected concurrently
+        :param concurrency: The tested value
+        :return: Verified value, None if no value was specified
+        """
+        if concurrency is None:
+            return None
+
+        try:
+            result = int(str(concurrency).partition(".")[0])
+            if result > 0:
+                return result
+            else:
+                raise ValueError(ERR_SELECT_CONCURRENCY_MUST_BE_GREATER_0.format(result))
+        except ValueError as ex:
+            raise ValueError(ERR_INVALID_NUMERIC_SELECT_CONCURRENCY.format(concurrency, ex))
+
     def configuration_item_to_task(self, item):
         """
         Processes a configuration item into an internally used task specification. The method verifies the attributes from the
@@ -620,6 +748,9 @@ class TaskConfiguration:
                 handlers.TASK_TIMOUT: self.verify_timeout(action_name=action_name,
                                                           timeout=item.get(configuration.CONFIG_TASK_TIMEOUT)),
 
+                handlers.TASK_SELECT_CONCURRENCY: TaskConfiguration.verify_select_concurrency(
+                    concurrency=item.get(configuration.CONFIG_SELECT_CONCURRENCY)),
+
                 handlers.TASK_TAG_FILTER: TaskConfiguration.validate_tagfilter(tag_filter=item.get(configuration.CONFIG_TAG_FILTER),
                                                                                action_name=action_name),
 
@@ -662,6 +793,9 @@ class TaskConfiguration:
         -CONFIG_INTERNAL: Flag to indicate task is used for internal  tasks of the scheduler (optional, default False, boolean)
         
         -CONFIG_TASK_TIMEOUT: Timeout in minutes for task to complete (optional,default is action's value or global timeout, number)
+
+        -CONFIG_SELECT_CONCURRENCY: Max number of account/region combinations in which resources are selected concurrently
+        (optional, default is action's value or the default of the select resources handler, number)
     
         -CONFIG_INTERVAL: Cron expression to schedule time/date based execution of task (optional, default "", string)
     
@@ -715,7 +849,8 @@ class TaskConfiguration:
                             configuration.CONFIG_REGIONS,
                             configuration.CONFIG_DRYRUN,
                             configuration.CONFIG_EVENTS,
-                            configuration.CONFIG_STACK_ID]
+                            configuration.CONFIG_STACK_ID,
+                            configuration.CONFIG_SELECT_CONCURRENCY]
 
         def remove_empty_attributes(o):
 
@@ -794,6 +929,11 @@ class TaskConfiguration:
                         result[attr] = timeout
                     continue
 
+                # verify select concurrency for task
+                if attr == configuration.CONFIG_SELECT_CONCURRENCY:
+                    result[attr] = TaskConfiguration.verify_select_concurrency(attributes[attr])
+                    continue
+
                 # verify timezone
                 if attr == configuration.CONFIG_TIMEZONE:
                     result[attr] = self.verified_timezone(attributes[attr]) or DEFAULT_TIMEZONE
@@ -863,8 +1003,46 @@ class TaskConfiguration:
         :param include_internal: include internal tasks
         :return:
         """
-        for config_item in self.config_items(include_internal=include_internal):
-            try:
-                yield self.configuration_item_to_task(config_item)
-            except Exception as ex:
-                self._warn(str(ex))
+        snapshot = self.config_snapshot()
+        for config_item in snapshot.items:
+            if not config_item.get(configuration.CONFIG_INTERNAL, False) or include_internal:
+                task = self._snapshot_task(snapshot, config_item)
+                if task is not None:
+                    yield task
+
+    def get_tasks_for_event(self, event_name, event_value, include_internal=True):
+        """
+        Gets the configured tasks that handle an event, only the items of these tasks are validated
+        :param event_name: Name of the event, e.g. ec2:state
+        :param event_value: Value of the event, e.g. the new state of an instance
+        :param include_internal: include internal tasks
+        :return: Tasks that handle the event for the value
+        """
+        snapshot = self.config_snapshot()
+        values = snapshot.event_index(self._warn).get(event_name, {})
+        task_names = set(values.get(str(event_value).lower(), []) + values.get("*", []))
+        for task_name in sorted(task_names):
+            config_item = snapshot.items_by_name[task_name]
+            if not config_item.get(configuration.CONFIG_INTERNAL, False) or include_internal:
+                task = self._snapshot_task(snapshot, config_item)
+                if task is not None:
+                    yield task
+
+    def _snapshot_task(self, snapshot, config_item):
+        """
+        Returns the task for an item in a snapshot, items are validated only once for every snapshot
+        :param snapshot: The snapshot
+        :param config_item: Item from the snapshot
+        :return: Copy of the task for the item, None if the item is not valid
+        """
+        task_name = config_item[configuration.CONFIG_TASK_NAME]
+        with snapshot.lock:
+            if task_name not in snapshot.tasks:
+                try:
+                    snapshot.tasks[task_name] = self.configuration_item_to_task(copy.deepcopy(config_item))
+                except Exception as ex:
+                    self._warn(str(ex))
+                    snapshot.tasks[task_name] = None
+            task = snapshot.tasks[task_name]
+        # copy as tasks are shared by all users of the snapshot
+        return copy.deepcopy(task) if task is not None else None
@@ -20,7 +20,7 @@ from os import getenv, listdir
 from os.path import isfile, join
 
 from boto_retry import get_client_with_retries
-from scheduling.cron_expression import CronExpression
+from scheduling import cron_expression_cache
 from util import pascal_to_snake_case
 
 COMPLETION_RULE = "CompletionRule"
@@ -62,6 +62,7 @@ TASK_INTERVAL = "interval"
 TASK_NAME = "name"
 TASK_PARAMETERS = "parameters"
 TASK_REGIONS = "regions"
+TASK_SELECT_CONCURRENCY = "select_concurrency"
 TASK_TAG_FILTER = "tag_filter"
 TASK_THIS_ACCOUNT = "this_account"
 TASK_TIMEZONE = "timezone"
@@ -70,7 +71,10 @@ TASK_TIMOUT = "timeout"
 HANDLER_EVENT_ACTION = "action"
 HANDLER_ACTION_EXECUTE = "execute-action"
 HANDLER_ACTION_TEST_COMPLETION = "execute-test-completion"
+HANDLER_ACTION_EXECUTE_BATCH = "execute-action-batch"
+HANDLER_EVENT_BATCH_ITEMS = "batch-items"
 HANDLER_ACTION_SELECT_RESOURCES = "select-resources"
+HANDLER_ACTION_SELECT_RESOURCES_BATCH = "select-resources-batch"
 HANDLER_SELECT_ARGUMENTS = "select-args"
 
 HANDLER_EVENT_TASK_DT = "task-datetime"
@@ -272,7 +276,7 @@ def _set_scheduler_cloudwatch_rule_expression(expression, context=None):
     try:
         # get the con expression from the expression
         cron_str = " ".join(expression[expression.index("(") + 1:expression.index(")")].split(" ")[0:5])
-        cron = CronExpression(cron_str)
+        cron = cron_expression_cache.get_cron_expression(cron_str)
         next_execution_time = cron.first_within_next(start_dt=datetime.utcnow(), timespan=timedelta(hours=24))
         if next_execution_time is not None:
             description = DESC_EXPRESSION_SET.format(expression, next_execution_time.isoformat())
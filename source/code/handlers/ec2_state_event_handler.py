@@ -12,10 +12,13 @@
 ######################################################################################################################
 
 
+import os
+import time
+import uuid
 from datetime import datetime
 
 import handlers
-from boto_retry import get_client_with_retries
+from boto_retry import client_pool, get_client_with_retries
 from configuration.task_configuration import TaskConfiguration
 from main import lambda_handler
 from util import safe_dict, safe_json
@@ -25,6 +28,33 @@ EC2_STATE_NOTIFICATION = "EC2 Instance State-change Notification"
 EC2_STATE_EVENT = "ec2:state"
 
 INFO_EVENT = "Scheduling task {} for ec2 event with state {} for instance {}, account {} in region {}\nTask definition is {}"
+INFO_SELECT_INSTANCES = "Selecting {} instance(s) for task {} in account {}, region {}"
+
+ERR_BUFFERING_INSTANCE = "Error adding instance {} to buffer {}, instance is selected without coalescing, ({})"
+ERR_FLUSHING_BUFFER = "Error flushing buffer {}, buffer is flushed after {} seconds by the next event or scheduler run, ({})"
+WARN_NO_TASK_FOR_BUFFER = "Task for buffer {} no longer exists or is disabled, {} buffered instance(s) are not selected"
+
+# the first event for a task, account and region selects its instance immediately and creates a buffer. Instance ids for events
+# for the same task, account and region that arrive within this period are added to the buffer, which is flushed by the
+# request for the first of these events at the end of the period
+COALESCE_WINDOW_SECONDS = 10
+# time in seconds that must be left for flushing the buffers after waiting for the end of the period
+COALESCE_TIME_MARGIN = 15
+# period after the end of the window after which a buffer that was not flushed by the waiting request is flushed by the next
+# event for the task, account and region or by the scheduler
+COALESCE_STALE_SECONDS = 60
+# max number of instance ids in a select resources event
+MAX_INSTANCE_IDS_PER_SELECT = 1000
+
+# key for buffer items in the table, uses the name attribute of the last scheduler run table
+BUFFER_NAME = "Name"
+BUFFER_KEY_PREFIX = "ec2-state-events:"
+BUFFER_KEY = BUFFER_KEY_PREFIX + "{}:{}:{}"
+BUFFER_INSTANCE_IDS = "InstanceIds"
+BUFFER_OWNER = "Owner"
+BUFFER_WAITER = "Waiter"
+BUFFER_FLUSH_TIME = "FlushTime"
+BUFFER_EVENT_TIME = "EventTime"
 
 LOG_STREAM = "{}-{:0>4d}{:0>2d}{:0>2d}"
 
@@ -34,21 +64,26 @@ class Ec2StateEventHandler:
     Class that handles time based events from CloudWatch rules
     """
 
-    def __init__(self, event, context):
+    def __init__(self, event, context, logger=None):
         """
         Initializes the instance.
         :param event: event to handle
         :param context: CLambda context
+        :param logger: Optional logger, if None the logger of the handler is used
         """
         self._context = context
         self._event = event
         self._table = None
+        # buffer for coalescing events is stored in the table for the last scheduler run, which is keyed by name
+        self._buffer_table = os.getenv(handlers.ENV_LAST_RUN_TABLE) if context is not None else None
+        self._buffer_owner = context.aws_request_id if context is not None else str(uuid.uuid4())
+        self._buffer_client = None
 
         # setup logging
         classname = self.__class__.__name__
         dt = datetime.utcnow()
         logstream = LOG_STREAM.format(classname, dt.year, dt.month, dt.day)
-        self._logger = Logger(logstream=logstream, buffersize=20, context=context)
+        self._logger = logger if logger is not None else Logger(logstream=logstream, buffersize=20, context=context)
 
     @staticmethod
     def is_handling_request(event):
@@ -66,9 +101,6 @@ class Ec2StateEventHandler:
         :return: Started tasks, if any, information
         """
 
-        def is_matching_event_state(event_state, ec2event):
-            return event_state in [s.strip() for s in ec2event.split(",")] or ec2event != "*"
-
         try:
 
             result = []
@@ -84,49 +116,46 @@ class Ec2StateEventHandler:
             instance_id = self._event["detail"]["instance-id"]
             dt = self._event["time"]
             task = None
+            # buffers that are flushed by this request at the end of the coalescing window, tuples of key, owner, flush time
+            # and task
+            waiting_buffers = []
 
             try:
 
-                # for all ec2 events tasks in configuration
-                for task in [t for t in TaskConfiguration(context=self._context, logger=self._logger).get_tasks() if
-                             t.get("events") is not None
-                             and EC2_STATE_EVENT in t["events"]
-                             and t.get("enabled", True)]:
+                # for all tasks in configuration that handle ec2 events for the state, found using the routing index
+                for task in [t for t in TaskConfiguration(context=self._context, logger=self._logger).get_tasks_for_event(
+                        event_name=EC2_STATE_EVENT, event_value=state) if t.get(handlers.TASK_ENABLED, True)]:
 
-                    task_name = task["name"]
-
-                    ec2_event = task["events"][EC2_STATE_EVENT]
-
-                    if not is_matching_event_state(state, ec2_event):
-                        continue
+                    task_name = task[handlers.TASK_NAME]
 
                     result.append(task_name)
 
                     self._logger.info(
                         INFO_EVENT, task_name, state, instance_id, account, region, safe_json(task, indent=2))
-                    # create an event for lambda function that scans for resources for this task
-                    event = {
-                        handlers.HANDLER_EVENT_ACTION: handlers.HANDLER_ACTION_SELECT_RESOURCES,
-                        handlers.HANDLER_SELECT_ARGUMENTS: {
-                            handlers.HANDLER_EVENT_REGIONS: [region],
-                            handlers.HANDLER_EVENT_ACCOUNT: account,
-                            "InstanceIds": [instance_id]
-                        },
-                        handlers.HANDLER_EVENT_SOURCE: EC2_STATE_EVENT,
-                        handlers.HANDLER_EVENT_TASK: task,
-                        handlers.HANDLER_EVENT_TASK_DT: dt
-                    }
-
-                    if self._context is not None:
-                        # start lambda function to scan for task resources
-                        payload = str.encode(safe_json(event))
-                        client = get_client_with_retries("lambda", ["invoke"], context=self._context)
-                        client.invoke_with_retries(FunctionName=self._context.function_name,
-                                                   Qualifier=self._context.function_version,
-                                                   InvocationType="Event", LogType="None", Payload=payload)
-                    else:
-                        # or if not running in lambda environment pass event to main task handler
-                        lambda_handler(event, None)
+
+                    if self._buffer_table is None:
+                        self._select_resources(task, account, region, [instance_id], dt)
+                        continue
+
+                    key = BUFFER_KEY.format(task_name, account, region)
+                    try:
+                        buffer = self._buffer_instance(key, instance_id, dt)
+                    except Exception as ex:
+                        self._logger.error(ERR_BUFFERING_INSTANCE, instance_id, key, ex)
+                        buffer = None
+
+                    if buffer is None:
+                        # first event for the task, account and region, or the buffer could not be used
+                        self._select_resources(task, account, region, [instance_id], dt)
+                        continue
+
+                    owner, waiter, flush_time = buffer
+                    if waiter == self._buffer_owner or time.time() > flush_time + COALESCE_STALE_SECONDS:
+                        # this request is the first to add an instance to the buffer, or the request that was waiting for the
+                        # buffer did not flush it
+                        waiting_buffers.append((key, owner, flush_time, task))
+
+                self._flush_waiting_buffers(waiting_buffers, account, region)
 
                 return safe_dict({
                     "datetime": datetime.now().isoformat(),
@@ -138,5 +167,216 @@ class Ec2StateEventHandler:
             except ValueError as ex:
                 self._logger.error("{}\n{}".format(ex, safe_json(task, indent=2)))
 
+            finally:
+                # buffered instances are never left behind if handling the event failed after adding them to a buffer
+                self._flush_waiting_buffers(waiting_buffers, account, region, wait=False)
+
         finally:
             self._logger.flush()
+
+    def _flush_waiting_buffers(self, waiting_buffers, account, region, wait=True):
+        """
+        Flushes the buffers this request is waiting for, flushed buffers are removed from the list
+        :param waiting_buffers: List of tuples with key, owner, flush time and task of the buffers
+        :param account: Account of the buffered instances
+        :param region: Region of the buffered instances
+        :param wait: True to wait until the end of the coalescing window of the buffers
+        :return:
+        """
+        if len(waiting_buffers) == 0:
+            return
+
+        if wait:
+            # wait for instance ids of other events to be added to the buffers
+            wait_time = max([b[2] for b in waiting_buffers]) - time.time()
+            if self._context is not None:
+                wait_time = min(wait_time, self._context.get_remaining_time_in_millis() / 1000.0 - COALESCE_TIME_MARGIN)
+            if wait_time > 0:
+                time.sleep(wait_time)
+
+        while len(waiting_buffers) > 0:
+            key, owner, _, task = waiting_buffers.pop(0)
+            try:
+                self._flush_buffer(key, owner, task, account, region)
+            except Exception as ex:
+                self._logger.error(ERR_FLUSHING_BUFFER, key, COALESCE_STALE_SECONDS, ex)
+
+    def flush_expired_buffers(self):
+        """
+        Flushes the buffers that were not flushed by the requests that were waiting for them and deletes the buffers of events
+        that had no other events within their window. Called by the scheduler.
+        :return: Number of flushed buffers
+        """
+        if self._buffer_table is None:
+            return 0
+
+        scan_args = {
+            "TableName": self._buffer_table,
+            "FilterExpression": "begins_with(#name, :prefix) AND #flush < :time",
+            "ExpressionAttributeNames": {"#name": BUFFER_NAME, "#flush": BUFFER_FLUSH_TIME},
+            "ExpressionAttributeValues": {
+                ":prefix": {"S": BUFFER_KEY_PREFIX},
+                ":time": {"N": str(time.time() - COALESCE_STALE_SECONDS)}
+            }
+        }
+
+        expired = []
+        while True:
+            resp = self._buffer.scan_with_retries(**scan_args)
+            expired += resp.get("Items", [])
+            if "LastEvaluatedKey" in resp:
+                scan_args["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+            else:
+                break
+
+        if len(expired) == 0:
+            return 0
+
+        tasks = {t[handlers.TASK_NAME]: t for t in TaskConfiguration(context=self._context, logger=self._logger).get_tasks()
+                 if t.get(handlers.TASK_ENABLED, True)}
+
+        for item in expired:
+            key = item[BUFFER_NAME]["S"]
+            task_name, account, region = key[len(BUFFER_KEY_PREFIX):].rsplit(":", 2)
+            self._flush_buffer(key, item[BUFFER_OWNER]["S"], tasks.get(task_name), account, region)
+
+        return len(expired)
+
+    @property
+    def _buffer(self):
+        """
+        Returns client for the table holding the buffers for coalescing events
+        :return: DynamoDB client
+        """
+        if self._buffer_client is None:
+            self._buffer_client = client_pool.get_client("dynamodb", ["update_item", "delete_item", "scan"],
+                                                         context=self._context)
+        return self._buffer_client
+
+    def _buffer_instance(self, key, instance_id, dt):
+        """
+        Adds an instance id to the buffer for a task, account and region. The first event creates the buffer without adding its
+        instance, which is selected immediately by the caller, the instances of the following events are added to the buffer.
+        :param key: Key of the buffer
+        :param instance_id: Id of the instance
+        :param dt: Time of the event
+        :return: None if the instance must be selected by the caller, else a tuple containing the owner of the buffer, which is
+        the request that created it, the waiter, which is the request that added the first instance and flushes the buffer, and
+        the time the buffer must be flushed
+        """
+        try:
+            self._buffer.update_item_with_retries(
+                TableName=self._buffer_table,
+                Key={BUFFER_NAME: {"S": key}},
+                UpdateExpression="SET #owner = :owner, #flush = :flush, #dt = :dt",
+                ConditionExpression="attribute_not_exists(#owner)",
+                ExpressionAttributeNames={
+                    "#owner": BUFFER_OWNER,
+                    "#flush": BUFFER_FLUSH_TIME,
+                    "#dt": BUFFER_EVENT_TIME
+                },
+                ExpressionAttributeValues={
+                    ":owner": {"S": self._buffer_owner},
+                    ":flush": {"N": str(time.time() + COALESCE_WINDOW_SECONDS)},
+                    ":dt": {"S": dt}
+                })
+            # buffer was created by this request
+            return None
+        except Exception as ex:
+            if type(ex).__name__ != "ConditionalCheckFailedException":
+                raise ex
+
+        try:
+            resp = self._buffer.update_item_with_retries(
+                TableName=self._buffer_table,
+                Key={BUFFER_NAME: {"S": key}},
+                UpdateExpression="ADD #ids :ids SET #waiter = if_not_exists(#waiter, :waiter)",
+                ConditionExpression="attribute_exists(#owner)",
+                ExpressionAttributeNames={
+                    "#ids": BUFFER_INSTANCE_IDS,
+                    "#owner": BUFFER_OWNER,
+                    "#waiter": BUFFER_WAITER
+                },
+                ExpressionAttributeValues={
+                    ":ids": {"SS": [instance_id]},
+                    ":waiter": {"S": self._buffer_owner}
+                },
+                ReturnValues="ALL_NEW")
+        except Exception as ex:
+            if type(ex).__name__ == "ConditionalCheckFailedException":
+                # buffer was flushed after it was tested
+                return None
+            raise ex
+
+        item = resp["Attributes"]
+        return item[BUFFER_OWNER]["S"], item[BUFFER_WAITER]["S"], float(item[BUFFER_FLUSH_TIME]["N"])
+
+    def _flush_buffer(self, key, owner, task, account, region):
+        """
+        Removes a buffer and selects the instances in the buffer. The buffer is removed in a single operation with a condition on
+        its owner, so instances added after it was removed are added to a new buffer and a buffer is only flushed once.
+        :param key: Key of the buffer
+        :param owner: Owner of the buffer
+        :param task: Task for the buffered instances, None if the task no longer exists
+        :param account: Account of the instances
+        :param region: Region of the instances
+        :return:
+        """
+        try:
+            resp = self._buffer.delete_item_with_retries(TableName=self._buffer_table,
+                                                         Key={BUFFER_NAME: {"S": key}},
+                                                         ConditionExpression="#owner = :owner",
+                                                         ExpressionAttributeNames={"#owner": BUFFER_OWNER},
+                                                         ExpressionAttributeValues={":owner": {"S": owner}},
+                                                         ReturnValues="ALL_OLD")
+        except Exception as ex:
+            if type(ex).__name__ == "ConditionalCheckFailedException":
+                # already flushed
+                return
+            raise ex
+
+        item = resp.get("Attributes", {})
+        instance_ids = sorted(item.get(BUFFER_INSTANCE_IDS, {}).get("SS", []))
+        dt = item.get(BUFFER_EVENT_TIME, {}).get("S")
+        if task is None:
+            if len(instance_ids) > 0:
+                self._logger.warning(WARN_NO_TASK_FOR_BUFFER, key, len(instance_ids))
+            return
+        for i in range(0, len(instance_ids), MAX_INSTANCE_IDS_PER_SELECT):
+            self._select_resources(task, account, region, instance_ids[i:i + MAX_INSTANCE_IDS_PER_SELECT], dt)
+
+    def _select_resources(self, task, account, region, instance_ids, dt):
+        """
+        Starts selecting the resources for a task for a list of instances
+        :param task: The task
+        :param account: Account of the instances
+        :param region: Region of the instances
+        :param instance_ids: Ids of the instances
+        :param dt: Time of the event
+        :return:
+        """
+        self._logger.info(INFO_SELECT_INSTANCES, len(instance_ids), task[handlers.TASK_NAME], account, region)
+
+        # create an event for lambda function that scans for resources for this task
+        event = {
+            handlers.HANDLER_EVENT_ACTION: handlers.HANDLER_ACTION_SELECT_RESOURCES,
+            handlers.HANDLER_SELECT_ARGUMENTS: {
+                handlers.HANDLER_EVENT_REGIONS: [region],
+                handlers.HANDLER_EVENT_ACCOUNT: account,
+                "InstanceIds": instance_ids
+            },
+            handlers.HANDLER_EVENT_SOURCE: EC2_STATE_EVENT,
+            handlers.HANDLER_EVENT_TASK: task,
+            handlers.HANDLER_EVENT_TASK_DT: dt
+        }
+
+        if self._context is not None:
+            # start lambda function to scan for task resources
+            payload = str.encode(safe_json(event))
+            client = get_client_with_retries("lambda", ["invoke"], context=self._context)
+            client.invoke_with_retries(FunctionName=self._context.function_name,
+                                       Qualifier=self._context.function_version,
+                                       InvocationType="Event", LogType="None", Payload=payload)
+        else:
+            # or if not running in lambda environment pass event to main task handler
+            lambda_handler(event, None)
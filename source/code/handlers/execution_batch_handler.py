@@ -0,0 +1,237 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import threading
+import traceback
+from datetime import datetime
+
+import actions
+import handlers
+import handlers.task_tracking_table as tracking
+from boto_retry import get_client_with_retries
+from handlers.execution_handler import ExecutionHandler
+from handlers.task_tracking_handler import TaskTrackingHandler
+from handlers.task_tracking_table import TaskTrackingTable
+from util import safe_dict, safe_json
+from util.logger import Logger
+from util.worker_pool import WorkerPool
+
+# items are not started if less than this number of seconds is left for the Lambda invocation, they are passed to a new one
+MIN_SECONDS_LEFT_FOR_ITEM = 60
+# max number of items in a batch that are executed concurrently, actions spend most of their time waiting for service calls
+MAX_CONCURRENT_ITEMS = 8
+
+# result for items that were not started because there was not enough time left
+NOT_STARTED = object()
+
+ERR_EXECUTING_ITEM = "Error executing action item {}, ({})\n{}"
+
+INFO_BATCH = "Executing batch of {} action item{} for action \"{}\""
+INFO_BATCH_RESULT = "Executed {} action item{} in {:>.3f} seconds, {} item{} passed to new invocation"
+INFO_REDISPATCH = "{} seconds left for execution, passing remaining {} action items to new invocation of Lambda function {}"
+
+LOG_STREAM = "{}-{:0>4d}{:0>2d}{:0>2d}"
+
+
+class ExecutionBatchHandler:
+    """
+    Class to handle events to execute a batch of actions items in a single Lambda invocation. The items are executed concurrently,
+    each by an ExecutionHandler which updates the item in the tracking table and writes to the log stream of the item. Items with
+    the same concurrency key are not executed concurrently beyond the max concurrency level of their action. As clients for the
+    same account and region are pooled the items in the batch share the same sessions and clients.
+    """
+
+    def __init__(self, event, context):
+        """
+        Initializes handler.
+        :param event: Event to handle
+        :param context: Context if run within Lambda environment
+        """
+        self._context = context
+        self._event = event
+        self.items = self._event.get(handlers.HANDLER_EVENT_BATCH_ITEMS, [])
+        self.executed_items = []
+        self.failed_items = []
+        self.redispatched_items = []
+        self._tracking_table = None
+        self._semaphores = {}
+        self._min_seconds_left = MIN_SECONDS_LEFT_FOR_ITEM
+
+        # setup logging
+        classname = self.__class__.__name__
+        dt = datetime.utcnow()
+        logstream = LOG_STREAM.format(classname, dt.year, dt.month, dt.day)
+        self._logger = Logger(logstream=logstream, context=self._context, buffersize=20, debug=False)
+
+    @staticmethod
+    def is_handling_request(event):
+        """
+        Tests if event is handled by this handler.
+        :param event: Tested event
+        :return: True if the event is handled by this handler
+        """
+        return event.get(handlers.HANDLER_EVENT_ACTION, "") == handlers.HANDLER_ACTION_EXECUTE_BATCH
+
+    @property
+    def tracking_table(self):
+        """
+        Gets an instance of the tracking table and use it in subsequent calls
+        :return: Instance tracking table
+        """
+        if self._tracking_table is None:
+            self._tracking_table = TaskTrackingTable(self._context)
+        return self._tracking_table
+
+    def _seconds_left(self):
+        """
+        Returns the number of seconds left for the Lambda invocation
+        :return: Seconds left, None if not running in Lambda
+        """
+        if self._context is None:
+            return None
+        return self._context.get_remaining_time_in_millis() / 1000.0
+
+    def _redispatch(self, items):
+        """
+        Passes the items that were not executed to a new invocation of the Lambda function
+        :param items: Events for the items
+        :return:
+        """
+        event = {
+            handlers.HANDLER_EVENT_ACTION: handlers.HANDLER_ACTION_EXECUTE_BATCH,
+            handlers.HANDLER_EVENT_BATCH_ITEMS: items
+        }
+        lambda_name = self._context.function_name
+        self._logger.info(INFO_REDISPATCH, int(self._seconds_left()), len(items), lambda_name)
+        lambda_client = get_client_with_retries("lambda", ["invoke"], context=self._context)
+        lambda_client.invoke_with_retries(FunctionName=lambda_name,
+                                          InvocationType="Event",
+                                          LogType="None",
+                                          Payload=str.encode(safe_json(event)))
+        self.redispatched_items = [i[tracking.TASK_TR_ID] for i in items]
+
+    def _create_item_handler(self, item):
+        """
+        Creates the handler that executes the action for an item in the batch
+        :param item: The task item
+        :return: Handler for the item
+        """
+        event = {i: item.get(i) for i in item}
+        event[handlers.HANDLER_EVENT_ACTION] = handlers.HANDLER_ACTION_EXECUTE
+        return ExecutionHandler(event, self._context)
+
+    def _concurrency_semaphore(self, item):
+        """
+        Returns the semaphore that limits the number of concurrently executing items with the same concurrency key
+        :param item: The task item
+        :return: Semaphore for the concurrency key of the item, None if there is no max concurrency level for the action
+        """
+        action_properties = actions.get_action_properties(item[tracking.TASK_TR_ACTION])
+        max_action_concurrency = action_properties.get(actions.ACTION_MAX_CONCURRENCY)
+        if max_action_concurrency is None:
+            return None
+
+        concurrency_key = TaskTrackingHandler._get_action_concurrency_key(item)
+        if concurrency_key not in self._semaphores:
+            self._semaphores[concurrency_key] = threading.BoundedSemaphore(max(1, max_action_concurrency))
+        return self._semaphores[concurrency_key]
+
+    def _has_time_left(self):
+        """
+        Tests if there is enough time left in the Lambda invocation to start executing an item
+        :return: True if an item can be started
+        """
+        seconds_left = self._seconds_left()
+        return seconds_left is None or seconds_left >= self._min_seconds_left
+
+    def handle_request(self):
+        """
+        Executes the action items in the batch concurrently
+        :return: Results of the executed items
+        """
+
+        def execute_item(entry):
+            _, item_handler, semaphore = entry
+            if not self._has_time_left():
+                return NOT_STARTED
+            if semaphore is None:
+                return item_handler.handle_request()
+            with semaphore:
+                # time might have passed waiting for other items with the same concurrency key
+                if not self._has_time_left():
+                    return NOT_STARTED
+                return item_handler.handle_request()
+
+        try:
+            start = datetime.now()
+
+            self._logger.info("Handler {}", self.__class__.__name__)
+            if len(self.items) > 0:
+                self._logger.info(INFO_BATCH, len(self.items), "" if len(self.items) == 1 else "s",
+                                  self.items[0].get(tracking.TASK_TR_ACTION))
+
+            # items are not started when the remaining time drops below the minimum, or half the time of the invocation if that
+            # is shorter, so at least the first items are always executed
+            seconds_left = self._seconds_left()
+            if seconds_left is not None:
+                self._min_seconds_left = min(MIN_SECONDS_LEFT_FOR_ITEM, seconds_left / 2)
+
+            # handlers are created before the items are executed concurrently as creating them creates boto3 clients and
+            # sessions, which is not thread safe for the default session
+            entries = []
+            for item in self.items:
+                try:
+                    entries.append((item, self._create_item_handler(item), self._concurrency_semaphore(item)))
+                except Exception as ex:
+                    # the handler for the item could not be created, e.g. because the role for the account could not be assumed
+                    self._logger.error(ERR_EXECUTING_ITEM, item.get(tracking.TASK_TR_ID), str(ex), traceback.format_exc())
+                    self.tracking_table.update_action(action_id=item.get(tracking.TASK_TR_ID), status=tracking.STATUS_FAILED,
+                                                      status_data={tracking.TASK_TR_ERROR: str(ex)})
+                    self.failed_items.append(item.get(tracking.TASK_TR_ID))
+
+            # every item is executed by its own handler instance that updates the status of the item and writes
+            # to the log stream for the item
+            pool = WorkerPool(max_workers=MAX_CONCURRENT_ITEMS)
+            item_results = pool.map(execute_item, entries, return_exceptions=True)
+
+            results = []
+            not_started = []
+            for entry, result in zip(entries, item_results):
+                item = entry[0]
+                if result is NOT_STARTED:
+                    not_started.append(item)
+                    continue
+                if isinstance(result, Exception):
+                    self._logger.error(ERR_EXECUTING_ITEM, item.get(tracking.TASK_TR_ID), str(result), "")
+                    self.failed_items.append(item.get(tracking.TASK_TR_ID))
+                else:
+                    results.append(result)
+                    self.executed_items.append(item.get(tracking.TASK_TR_ID))
+
+            if len(not_started) > 0:
+                self._redispatch(not_started)
+
+            running_time = float((datetime.now() - start).total_seconds())
+            self._logger.info(INFO_BATCH_RESULT, len(self.executed_items), "" if len(self.executed_items) == 1 else "s",
+                              running_time, len(self.redispatched_items), "" if len(self.redispatched_items) == 1 else "s")
+
+            return safe_dict({
+                "datetime": datetime.now().isoformat(),
+                "executed-items": self.executed_items,
+                "failed-items": self.failed_items,
+                "redispatched-items": self.redispatched_items,
+                "results": results,
+                "running-time": running_time
+            })
+
+        finally:
+            self._logger.flush()
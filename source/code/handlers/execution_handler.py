@@ -89,7 +89,8 @@ class ExecutionHandler:
 
         debug = event[tracking.TASK_TR_DEBUG]
 
-        self._logger = Logger(logstream=self.execution_log_stream, buffersize=40 if debug else 20, context=context, debug=debug)
+        self._logger = Logger(logstream=self.execution_log_stream, buffersize=40 if debug else 20, context=context, debug=debug,
+                              background_flush=True)
 
     @staticmethod
     def is_handling_request(event):
@@ -20,10 +20,11 @@ import dateutil.parser
 import configuration
 import handlers.task_tracking_table
 import pytz
-from boto_retry import add_retry_methods_to_resource, get_client_with_retries
+from boto_retry import add_retry_methods_to_resource
 from configuration.task_configuration import TaskConfiguration
-from main import lambda_handler
-from scheduling.cron_expression import CronExpression
+from handlers.task_dispatcher import TaskDispatcher
+from scheduling import cron_expression_cache
+from scheduling.schedule_timeline import ScheduleTimeline
 from util import safe_dict, safe_json
 from util.logger import Logger
 
@@ -32,6 +33,7 @@ NAME_ATTR = "Name"
 LAST_SCHEDULER_RUN_KEY = "last-scheduler-run"
 
 INFO_CONFIG_RUN = "Running scheduler for configuration update of task \"{}\""
+INFO_CONFIG_VERSION_UPDATE = "Update of configuration version, scheduler not started"
 INFO_CURRENT_SCHEDULING_DT = "Current datetime used for scheduling is {}"
 INFO_LAST_SAVED = "Last saved scheduler execution was at {}"
 INFO_NO_TASKS_STARTED = "Number of enabled tasks in configuration is {}, no tasks were started"
@@ -45,11 +47,48 @@ INFO_NEXT_EXECUTED_TASK = "The first task that wil be executed within 24 hours i
 INFO_NEXT_ONE_MINUTE = "Next schedule event will be in one minute"
 INFO_NEXT_EVENT = "Next schedule event will be at {}"
 INFO_NO_TASKS_SCHEDULED = "There are no tasks scheduled within the next 24 hours"
-INFO_LAMBDA = "Invoked lambda function, started_tasks is {}, payload is {}"
+INFO_FLUSHED_EVENT_BUFFERS = "Flushed {} expired buffer(s) for ec2 state events"
+
+ERR_FLUSHING_EVENT_BUFFERS = "Error flushing expired buffers for ec2 state events, ({})"
+
+EC2_STATE_EVENT_HANDLER = "Ec2StateEventHandler"
 
 
 LOG_STREAM = "{}-{:0>4d}{:0>2d}{:0>2d}"
 
+# timeline with next execution times of tasks, kept in module so it is reused by warm Lambda invocations
+_timeline = None
+
+
+def _next_task_execution(schedule, dt, timespan):
+    """
+    Returns the first execution of a task within a timespan
+    :param schedule: Tuple of cron expression and timezone of the task
+    :param dt: Start of the timespan (excluding)
+    :param timespan: Length of the timespan
+    :return: First execution in UTC, None if the task is not executed in the timespan
+    """
+    interval, timezone = schedule
+    task_timezone = pytz.timezone(timezone)
+    next_execution = cron_expression_cache.get_cron_expression(interval).first_within_next(timespan, dt.astimezone(task_timezone))
+    if next_execution is None:
+        return None
+    # the offset of the returned time is the offset at the start of the timespan, localize the time again in case the offset
+    # changed within the timespan
+    return task_timezone.localize(next_execution.replace(tzinfo=None)).astimezone(pytz.timezone("UTC"))
+
+
+def _get_timeline():
+    global _timeline
+    if _timeline is None:
+        _timeline = ScheduleTimeline(_next_task_execution)
+    return _timeline
+
+
+def _clear_timeline():
+    global _timeline
+    _timeline = None
+
 
 class ScheduleHandler:
     """
@@ -155,8 +194,15 @@ class ScheduleHandler:
 
         try:
             started_tasks = []
+            dispatcher = TaskDispatcher(context=self._context, logger=self._logger)
+
+            # the version of the configuration is increased for every change of a task, which already triggers the scheduler
+            if self.configuration_update and self.updated_task == configuration.CONFIG_VERSION_ITEM:
+                self._logger.info(INFO_CONFIG_VERSION_UPDATE)
+                return safe_dict({"started-tasks": started_tasks})
 
             start = datetime.now()
+            cron_cache_start = cron_expression_cache.statistics()
 
             last_run_dt = self._get_last_run()
             self._logger.info("Handler {}", self.__class__.__name__)
@@ -176,50 +222,48 @@ class ScheduleHandler:
                 self._logger.info(INFO_CURRENT_SCHEDULING_DT, current_dt)
 
                 task = None
-                enabled_tasks = 0
-
-                next_executed_task = None
-                utc = pytz.timezone("UTC")
 
                 try:
-                    for task in [t for t in TaskConfiguration(context=self._context, logger=self._logger).get_tasks() if
-                                 t.get(handlers.TASK_INTERVAL) is not None
-                                 and t.get(handlers.TASK_ENABLED, True)]:
+                    tasks = {t[handlers.TASK_NAME]: t for t in
+                             TaskConfiguration(context=self._context, logger=self._logger).get_tasks() if
+                             t.get(handlers.TASK_INTERVAL) is not None and t.get(handlers.TASK_ENABLED, True)}
+                    enabled_tasks = len(tasks)
 
-                        enabled_tasks += 1
+                    # new and changed tasks are added to the timeline from the last run so they fire in this run if they have
+                    # to be executed since the last run, other tasks are already in the timeline
+                    timeline = _get_timeline()
+                    changed_tasks = timeline.update_tasks({name: (tasks[name][handlers.TASK_INTERVAL],
+                                                                  tasks[name][handlers.TASK_TIMEZONE]) for name in tasks},
+                                                          last_run_dt)
 
-                        self._logger.debug_enabled = task[handlers.TASK_DEBUG]
+                    # tasks that fire since the last run
+                    fired_tasks = sorted(timeline.fire(current_dt))
+
+                    next_execution = timeline.first(until=current_dt + timedelta(hours=24))
+                    next_executed_task = (next_execution[0], tasks[next_execution[1]]) if next_execution is not None else None
 
-                        task_name = task[handlers.TASK_NAME]
+                    for task_name in sorted(set(changed_tasks + fired_tasks)):
+                        self._log_next_execution(tasks[task_name], timeline.next_fire(task_name), current_dt)
+
+                    for task_name in fired_tasks if not already_ran_this_minute else []:
+
+                        task = tasks[task_name]
+
+                        self._logger.debug_enabled = task[handlers.TASK_DEBUG]
 
                         # timezone for specific task
                         task_timezone = pytz.timezone(task[handlers.TASK_TIMEZONE])
 
-                        # create cron expression to test if task needs te be executed
-                        task_cron_expression = CronExpression(expression=task[handlers.TASK_INTERVAL])
+                        # cron expression to test if task needs te be executed, parsed expressions are reused between runs
+                        task_cron_expression = cron_expression_cache.get_cron_expression(task[handlers.TASK_INTERVAL])
 
                         localized_last_run = last_run_dt.astimezone(task_timezone)
                         localized_current_dt = current_dt.astimezone(task_timezone)
 
-                        next_execution = task_cron_expression.first_within_next(timedelta(hours=24), localized_current_dt)
-                        next_execution_utc = next_execution.astimezone(utc) if next_execution else None
-
-                        if next_execution_utc is not None:
-                            if next_executed_task is None or next_execution_utc < next_executed_task[0]:
-                                next_executed_task = (next_execution_utc, task)
-
-                        if already_ran_this_minute:
-                            continue
-
-                        # test if task needs te be executed since last run of ops automator
+                        # most recent execution since last run of ops automator, timeline might be behind if the scheduler
+                        # did run in another container
                         execute_dt_since_last = task_cron_expression.last_since(localized_last_run, localized_current_dt)
-
                         if execute_dt_since_last is None:
-                            if next_execution is not None:
-                                next_execution = next_execution.astimezone(task_timezone)
-                                self._logger.info(INFO_NEXT_EXECUTION, task_name, next_execution.isoformat(), task_timezone)
-                            else:
-                                self._logger.info(INFO_NO_NEXT_WITHIN, task_name)
                             continue
 
                         started_tasks.append(task_name)
@@ -227,8 +271,13 @@ class ScheduleHandler:
                         self._logger.debug(INFO_SCHEDULED_TASK, task_name, execute_dt_since_last, task_timezone,
                                            str(safe_json(task, indent=2)))
 
-                        # create an event for lambda function that starts execution by selecting for resources for this task
-                        self._execute_task(task, execute_dt_since_last)
+                        # tasks are dispatched when all fired tasks have been processed
+                        dispatcher.add(task, execute_dt_since_last)
+
+                    # start lambda functions that start the execution of the tasks by selecting their resources
+                    dispatched = dispatcher.dispatch()
+
+                    self._flush_expired_event_buffers()
 
                     if started_tasks:
                         self._logger.info(INFO_STARTED_TASKS, enabled_tasks, ",".join(started_tasks))
@@ -241,20 +290,61 @@ class ScheduleHandler:
 
                     self._logger.info(INFO_RESULT, running_time)
 
+                    # cache hits and misses for this run
+                    cron_cache = cron_expression_cache.statistics()
+                    for counter in [cron_expression_cache.CACHE_HITS, cron_expression_cache.CACHE_MISSES]:
+                        cron_cache[counter] -= cron_cache_start[counter]
+
                     return safe_dict({
                         "datetime": datetime.now().isoformat(),
                         "running-time": running_time,
                         "event-datetime": current_dt.isoformat(),
                         "enabled_tasks": enabled_tasks,
-                        "started-tasks": started_tasks
+                        "started-tasks": started_tasks,
+                        "dispatched-tasks": dispatched,
+                        "cron-cache": cron_cache
                     })
 
                 except ValueError as ex:
+                    # timeline is rebuilt in next run as it might be incomplete
+                    _clear_timeline()
                     self._logger.error("{}\n{}".format(ex, safe_json(task, indent=2)))
+                    # tasks that were started before the error are still dispatched
+                    dispatcher.dispatch()
 
         finally:
             self._logger.flush()
 
+    def _flush_expired_event_buffers(self):
+        """
+        Flushes the buffers for coalescing ec2 state events that were not flushed by the requests that created them
+        :return:
+        """
+        try:
+            # handler class is loaded by name as the handler module imports the main module
+            event_handler = handlers.get_class_for_handler(EC2_STATE_EVENT_HANDLER)(event={}, context=self._context,
+                                                                                     logger=self._logger)
+            flushed = event_handler.flush_expired_buffers()
+            if flushed > 0:
+                self._logger.info(INFO_FLUSHED_EVENT_BUFFERS, flushed)
+        except Exception as ex:
+            self._logger.error(ERR_FLUSHING_EVENT_BUFFERS, ex)
+
+    def _log_next_execution(self, task, next_execution, current_dt):
+        """
+        Logs the next execution of a task within the next 24 hours
+        :param task: The task
+        :param next_execution: Next execution of the task in UTC, None if unknown
+        :param current_dt: Datetime used for this scheduler run
+        :return:
+        """
+        task_timezone = pytz.timezone(task[handlers.TASK_TIMEZONE])
+        if next_execution is not None and next_execution <= current_dt + timedelta(hours=24):
+            next_execution = next_execution.astimezone(task_timezone)
+            self._logger.info(INFO_NEXT_EXECUTION, task[handlers.TASK_NAME], next_execution.isoformat(), task_timezone)
+        else:
+            self._logger.info(INFO_NO_NEXT_WITHIN, task[handlers.TASK_NAME])
+
     def _set_next_schedule_event(self, scheduler_dt, next_executed_task):
         """
         Sets the cron expression of the scheduler event rule in cloudwatch depending on next executed task
@@ -282,28 +372,3 @@ class ScheduleHandler:
             self._logger.info(INFO_NO_TASKS_SCHEDULED)
             next_event_time = handlers.set_event_for_time(scheduler_dt)
             self._logger.info(INFO_NEXT_EVENT.format(next_event_time.isoformat()))
-
-    def _execute_task(self, task, dt=None):
-        """
-        Execute a task by starting a lambda function that selects the resources for that action
-        :param task: Task started
-        :param dt: Task start datetime
-        :return: 
-        """
-        event = {
-            handlers.HANDLER_EVENT_ACTION: handlers.HANDLER_ACTION_SELECT_RESOURCES,
-            handlers.HANDLER_EVENT_TASK: task,
-            handlers.HANDLER_EVENT_SOURCE: "aws:events",
-            handlers.HANDLER_EVENT_TASK_DT: dt.isoformat() if dt is not None else datetime.utcnow().isoformat()
-        }
-        if self._context is not None:
-            # start lambda function to scan for task resources
-            payload = str.encode(safe_json(event))
-            client = get_client_with_retries("lambda", ["invoke"], context=self._context)
-            resp = client.invoke_with_retries(FunctionName=self._context.function_name,
-                                              Qualifier=self._context.function_version,
-                                              InvocationType="Event", LogType="None", Payload=payload)
-            self._logger.info(INFO_LAMBDA, resp["StatusCode"], payload)
-        else:
-            # or if not running in lambda environment pass event to main task handler
-            lambda_handler(event, None)
@@ -0,0 +1,175 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import traceback
+from datetime import datetime
+
+import handlers
+from boto_retry import get_client_with_retries
+from handlers.select_resources_handler import SelectResourcesHandler
+from util import safe_dict, safe_json
+from util.logger import Logger
+from util.worker_pool import WorkerPool
+
+# max number of tasks for which resources are selected concurrently
+MAX_CONCURRENT_SELECTS = 4
+# selections are not started if less than this number of seconds is left for the Lambda invocation, they are passed to a new one
+MIN_SECONDS_LEFT_FOR_SELECT = 60
+
+# result for tasks for which the selection was not started because there was not enough time left
+NOT_STARTED = object()
+
+ERR_SELECTING_RESOURCES = "Error selecting resources for task {}, ({})\n{}"
+
+INFO_BATCH = "Selecting resources for {} task(s), {}"
+INFO_BATCH_RESULT = "Selected resources for {} task(s) in {:>.3f} seconds, {} task(s) passed to new invocation"
+INFO_REDISPATCH = "{} seconds left for execution, passing selection for task(s) {} to new invocation of Lambda function {}"
+
+LOG_STREAM = "{}-{:0>4d}{:0>2d}{:0>2d}"
+
+
+class SelectResourcesBatchHandler:
+    """
+    Class that handles events for selecting the resources for multiple tasks in a single invocation, the events for the tasks
+    are packed by the scheduler if the tasks select resources from the same service in a single account and region. Resources
+    for each task are selected by a SelectResourcesHandler. Selections that can not be started in time are passed to a new
+    invocation.
+    """
+
+    def __init__(self, event, context):
+        """
+        Initializes handler.
+        :param event: Event to handle
+        :param context: Context if run within Lambda environment
+        """
+        self._context = context
+        self._event = event
+        self.events = self._event.get(handlers.HANDLER_EVENT_BATCH_ITEMS, [])
+        self.redispatched_tasks = []
+        self._min_seconds_left = MIN_SECONDS_LEFT_FOR_SELECT
+
+        # setup logging
+        classname = self.__class__.__name__
+        dt = datetime.utcnow()
+        logstream = LOG_STREAM.format(classname, dt.year, dt.month, dt.day)
+        self._logger = Logger(logstream=logstream, context=self._context, buffersize=20, debug=False)
+
+    @staticmethod
+    def is_handling_request(event):
+        """
+        Tests if event is handled by this handler.
+        :param event: Tested event
+        :return: True if the event is handled by this handler
+        """
+        return event.get(handlers.HANDLER_EVENT_ACTION, "") == handlers.HANDLER_ACTION_SELECT_RESOURCES_BATCH
+
+    def _seconds_left(self):
+        """
+        Returns the number of seconds left for the Lambda invocation
+        :return: Seconds left, None if not running in Lambda
+        """
+        if self._context is None:
+            return None
+        return self._context.get_remaining_time_in_millis() / 1000.0
+
+    def _has_time_left(self):
+        """
+        Tests if there is enough time left in the Lambda invocation to start selecting the resources for a task
+        :return: True if a selection can be started
+        """
+        seconds_left = self._seconds_left()
+        return seconds_left is None or seconds_left >= self._min_seconds_left
+
+    def _redispatch(self, events):
+        """
+        Passes the events for which the selection was not started to a new invocation of the Lambda function
+        :param events: Select resources events for the tasks
+        :return:
+        """
+        event = events[0] if len(events) == 1 else {
+            handlers.HANDLER_EVENT_ACTION: handlers.HANDLER_ACTION_SELECT_RESOURCES_BATCH,
+            handlers.HANDLER_EVENT_BATCH_ITEMS: events
+        }
+        task_names = [e[handlers.HANDLER_EVENT_TASK][handlers.TASK_NAME] for e in events]
+        lambda_name = self._context.function_name
+        self._logger.info(INFO_REDISPATCH, int(self._seconds_left()), ", ".join(task_names), lambda_name)
+        lambda_client = get_client_with_retries("lambda", ["invoke"], context=self._context)
+        lambda_client.invoke_with_retries(FunctionName=lambda_name,
+                                          InvocationType="Event",
+                                          LogType="None",
+                                          Payload=str.encode(safe_json(event)))
+        self.redispatched_tasks = task_names
+
+    def handle_request(self):
+        """
+        Selects the resources for the tasks in the packed events, selections that can not be started in time are passed to a
+        new invocation
+        :return: Results of selecting the resources for the tasks
+        """
+
+        def select_resources(entry):
+            if not self._has_time_left():
+                return NOT_STARTED
+            return entry[2].handle_request()
+
+        try:
+            start = datetime.now()
+
+            task_names = [e[handlers.HANDLER_EVENT_TASK][handlers.TASK_NAME] for e in self.events]
+            self._logger.info("Handler {}", self.__class__.__name__)
+            self._logger.info(INFO_BATCH, len(self.events), ", ".join(task_names))
+
+            # selections are not started when the remaining time drops below the minimum, or half the time of the invocation if
+            # that is shorter, so at least the first selections are always started
+            seconds_left = self._seconds_left()
+            if seconds_left is not None:
+                self._min_seconds_left = min(MIN_SECONDS_LEFT_FOR_SELECT, seconds_left / 2)
+
+            # handlers are created before selecting resources concurrently as creating them creates boto3 clients, which is not
+            # thread safe for the default session
+            select_handlers = []
+            results = {}
+            for event in self.events:
+                task_name = event[handlers.HANDLER_EVENT_TASK][handlers.TASK_NAME]
+                try:
+                    select_handlers.append((task_name, event, SelectResourcesHandler(event, self._context)))
+                except Exception as ex:
+                    self._logger.error(ERR_SELECTING_RESOURCES, task_name, str(ex), traceback.format_exc())
+                    results[task_name] = {"error": str(ex)}
+
+            select_results = WorkerPool(max_workers=MAX_CONCURRENT_SELECTS).map(select_resources, select_handlers,
+                                                                                return_exceptions=True)
+            not_started = []
+            for (task_name, event, _), result in zip(select_handlers, select_results):
+                if result is NOT_STARTED:
+                    not_started.append(event)
+                elif isinstance(result, Exception):
+                    self._logger.error(ERR_SELECTING_RESOURCES, task_name, str(result), "")
+                    results[task_name] = {"error": str(result)}
+                else:
+                    results[task_name] = result
+
+            if len(not_started) > 0:
+                self._redispatch(not_started)
+
+            running_time = float((datetime.now() - start).total_seconds())
+            self._logger.info(INFO_BATCH_RESULT, len(results), running_time, len(self.redispatched_tasks))
+
+            return safe_dict({
+                "datetime": datetime.now().isoformat(),
+                "redispatched-tasks": self.redispatched_tasks,
+                "running-time": running_time,
+                "tasks": results
+            })
+
+        finally:
+            self._logger.flush()
@@ -15,18 +15,17 @@
 import os
 from datetime import datetime
 
-import boto3
-
 import actions
 import handlers
 import handlers.task_tracking_table as tracking
 import services
-from boto_retry import get_default_retry_strategy
+from boto_retry import client_pool, get_default_retry_strategy
 from handlers.task_tracking_table import TaskTrackingTable
 from services.aws_service import AwsService
-from util import safe_dict, safe_json
-from util.logger import Logger
-from util.tag_filter_set import TagFilterSet
+from util import safe_dict, safe_json, tag_filter_pushdown
+from util.logger import Lazy, Logger
+from util.tag_filter_set import get_tag_filter_set
+from util.worker_pool import WorkerPool
 
 WARN_REGION_NOT_IN_TASK_CONFIGURATION = "Region from event {} is not configured in the list of regions for this task"
 
@@ -53,16 +52,23 @@ INFO_RESOURCE = "Added action item {} for resource of type \"{}\" for task \"{}\
 INFO_RESOURCES_FOUND = "{} resources found"
 INFO_RESOURCES_SELECTED = "{} resources selected"
 INFO_RESULT = "Selecting resources took {:>.3f} seconds"
+INFO_SELECT_CONCURRENCY = "Selecting resources in {} account/region combinations, max {} concurrent"
+INFO_SELECT_TIME = "Selecting resources for account {}{} took {:>.3f} seconds"
 INFO_SELECTED_RESOURCES = "Selecting resources of type \"{}\" from service \"{}\" for task \"{}\""
+INFO_TAG_CONDITIONS_PUSHED_DOWN = "Tag conditions {} are used by service {} to select resources"
 INFO_TASK_AGGREGATED = "Added action item {} for {} aggregated resources of type {} for task {}"
 INFO_USE_TAGS_TO_SELECT = "{}esource tags are used to select resources"
 
 ERR_CAN_NOT_EXECUTE_WITH_THESE_RESOURSES = "Can not execute action \"{}\" for task \"{}\", reason {}"
+ERR_SELECTING_RESOURCES = "Error selecting resources for account {}{} after {:>.3f} seconds, {}"
 
 MSG_NO_CROSS_ACCOUNT_ROLE = "No cross account role configured for task {} for account {} to select resources"
 
 LOG_STREAM = "{}-{}-{:0>4d}{:0>2d}{:0>2d}"
 
+# default max number of account/region combinations in which resources are selected concurrently
+DEFAULT_SELECT_CONCURRENCY = 8
+
 
 class SelectResourcesHandler:
     """
@@ -80,10 +86,11 @@ class SelectResourcesHandler:
         dt = datetime.utcnow()
         logstream = LOG_STREAM.format(classname, self.task[handlers.TASK_NAME], dt.year, dt.month, dt.day)
         debug = event[handlers.HANDLER_EVENT_TASK].get(handlers.TASK_DEBUG, False)
-        self._logger = Logger(logstream=logstream, context=context, buffersize=40 if debug else 20, debug=debug)
+        self._logger = Logger(logstream=logstream, context=context, buffersize=40 if debug else 20, debug=debug,
+                              background_flush=True)
 
         self._sts = None
-        self._dynamodb = boto3.client("dynamodb")
+        self._dynamodb = client_pool.get_client("dynamodb")
 
         self.select_args = event.get(handlers.HANDLER_SELECT_ARGUMENTS, {})
         self.task_dt = event[handlers.HANDLER_EVENT_TASK_DT]
@@ -121,7 +128,7 @@ class SelectResourcesHandler:
     @property
     def sts(self):
         if self._sts is None:
-            self._sts = boto3.client("sts")
+            self._sts = client_pool.get_client("sts")
         return self._sts
 
     def _check_can_execute(self, selected_resources):
@@ -168,6 +175,18 @@ class SelectResourcesHandler:
             for role in self.task.get(handlers.TASK_CROSS_ACCOUNT_ROLES, []):
                 yield services.create_service(service_name=service_name, role_arn=role, service_retry_strategy=retry_strategy)
 
+    @property
+    def _select_concurrency(self):
+        """
+        Returns the max number of account/region combinations in which resources are selected concurrently. The value set for
+        the task overwrites the value set in the properties of the action.
+        :return: Max number of concurrent selections
+        """
+        concurrency = self.task.get(handlers.TASK_SELECT_CONCURRENCY)
+        if concurrency is None:
+            concurrency = self.action_properties.get(actions.ACTION_SELECT_CONCURRENCY, DEFAULT_SELECT_CONCURRENCY)
+        return max(1, int(concurrency))
+
     @property
     def _regions(self):
         """
@@ -214,24 +233,25 @@ class SelectResourcesHandler:
             if tags_filter is None:
                 # test if name of the task is in list of tasks in tag value
                 if tagname in tags and taskname in tags[tagname].split(","):
-                    self._logger.debug(DEBUG_SELECTED_BY_TASK_NAME_IN_TAG_VALUE, safe_json(resource, indent=2),
+                    self._logger.debug(DEBUG_SELECTED_BY_TASK_NAME_IN_TAG_VALUE, Lazy(safe_json, resource, indent=2),
                                        tagname, taskname)
                     return True
             else:
                 # using a tag filter, * means any tag
                 if tags_filter == "*":
-                    self._logger.debug(DEBUG_SELECTED_WILDCARD_TAG_FILTER, safe_json(resource, indent=2),
+                    self._logger.debug(DEBUG_SELECTED_WILDCARD_TAG_FILTER, Lazy(safe_json, resource, indent=2),
                                        taskname)
                     return True
 
-                # test if there are any tags matching the tag filter
-                matched_tags = TagFilterSet(tags_filter).pairs_matching_any_filter(tags)
-                if len(matched_tags) != 0:
-                    self._logger.debug(DEBUG_SELECTED_BY_TAG_FILTER, safe_json(resource, indent=2),
-                                       matched_tags, tag_filter, taskname)
+                # test if there are any tags matching the tag filter, the compiled filter set is shared by all resources
+                filter_set = get_tag_filter_set(tags_filter)
+                if filter_set.matches_any(tags):
+                    if self._logger.debug_enabled:
+                        self._logger.debug(DEBUG_SELECTED_BY_TAG_FILTER, Lazy(safe_json, resource, indent=2),
+                                           filter_set.pairs_matching_any_filter(tags), tags_filter, taskname)
                     return True
 
-            self._logger.debug(DEBUG_RESOURCE_NOT_SELECTED, safe_json(resource, indent=2), taskname)
+            self._logger.debug(DEBUG_RESOURCE_NOT_SELECTED, Lazy(safe_json, resource, indent=2), taskname)
             return False
 
         def resource_batches(resources):
@@ -256,11 +276,12 @@ class SelectResourcesHandler:
 
         try:
             items = []
+            select_errors = []
             start = datetime.now()
 
             self._logger.info("Handler {}", self.__class__.__name__)
-            self._logger.debug(DEBUG_EVENT, safe_json(self._event, indent=2))
-            self._logger.debug(DEBUG_ACTION, safe_json(self.action_properties, indent=2))
+            self._logger.debug(DEBUG_EVENT, Lazy(safe_json, self._event, indent=2))
+            self._logger.debug(DEBUG_ACTION, Lazy(safe_json, self.action_properties, indent=2))
 
             self._logger.info(INFO_SELECTED_RESOURCES, self.resource_name, self.service, self.task[handlers.TASK_NAME])
             self._logger.info(INFO_AGGR_LEVEL, self.aggregation_level)
@@ -268,8 +289,8 @@ class SelectResourcesHandler:
             task_level_aggregated_resources = []
             args = self._build_describe_argument()
 
-            supports_tags = self.action_properties.get(actions.ACTION_RESOURCES) in services.create_service(
-                self.service).resources_with_tags
+            resources_service = services.create_service(self.service)
+            supports_tags = self.action_properties.get(actions.ACTION_RESOURCES) in resources_service.resources_with_tags
             args["tags"] = supports_tags
             self._logger.info(INFO_USE_TAGS_TO_SELECT, "R" if supports_tags else "No r")
 
@@ -284,78 +305,139 @@ class SelectResourcesHandler:
             else:
                 self._logger.debug(DEBUG_TAG_FILTER_USED_TO_SELECT_RESOURCES, self.resource_name)
 
-            with TaskTrackingTable(self._context) as actions_tracking:
+            # let the service filter the resources by their tags if it supports it, the selected resources are still tested
+            # against the task tag or tag filter as the conditions passed to the service may select more resources
+            if supports_tags and tag_filter != "*":
+                if tag_filter is None:
+                    tag_conditions = tag_filter_pushdown.plan_for_task_tag(self._task_tag, task_name)
+                else:
+                    tag_conditions = tag_filter_pushdown.plan_for_tag_filter(tag_filter)
+                pushdown_args = resources_service.describe_args_for_tag_conditions(self.resource_name, tag_conditions, args)
+                if pushdown_args is not None:
+                    args = pushdown_args
+                    self._logger.info(INFO_TAG_CONDITIONS_PUSHED_DOWN, ", ".join(
+                        ["{}={}".format(c.key if c.key is not None else "*", "|".join(c.values)) for c in tag_conditions]),
+                                      self.service)
+
+            # action items are written to the tracking table in batches while resources are being selected, only their ids are
+            # kept for the result of the request
+            with TaskTrackingTable(self._context, flush_size=tracking.AUTO_FLUSH_SIZE) as actions_tracking:
+
+                def add_account_aggregated_actions(assumed_role, selected_resources):
+                    if self._check_can_execute(selected_resources):
+                        # create tasks action for account aggregated resources , optionally split in batch size chunks
+                        for r in resource_batches(selected_resources):
+                            action_item = actions_tracking.add_task_action(
+                                task=self.task,
+                                assumed_role=assumed_role,
+                                action_resources=r,
+                                task_datetime=self.task_dt,
+                                source=self.source)
 
-                for service in self._account_service_sessions(self.service):
-                    assumed_role = service.assumed_role
+                            items.append(action_item[tracking.TASK_TR_ID])
+                            self._logger.info(
+                                INFO_ACCOUNT_AGGREGATED, action_item[tracking.TASK_TR_ID], len(r), self.resource_name,
+                                self.task[
+                                    handlers.TASK_NAME])
+
+                def add_resource_action(assumed_role, res):
+                    # task action for each selected resource
+                    action_item = actions_tracking.add_task_action(
+                        task=self.task,
+                        assumed_role=assumed_role,
+                        action_resources=res,
+                        task_datetime=self.task_dt,
+                        source=self.source)
+
+                    items.append(action_item[tracking.TASK_TR_ID])
+                    self._logger.info_summary(INFO_RESOURCE, action_item[tracking.TASK_TR_ID], self.resource_name,
+                                              self.task[handlers.TASK_NAME])
 
-                    self._logger.info(INFO_ACCOUNT, service.aws_account)
-                    if assumed_role is not None:
-                        self._logger.info(INFO_ASSUMED_ROLE, assumed_role)
+                def describe_args_for_region(region):
+                    describe_args = dict(args)
+                    if region is not None:
+                        describe_args["region"] = region
+                    elif "region" in describe_args:
+                        del describe_args["region"]
+                    return describe_args
 
+                def select_in_account_region(account_region):
+                    # runs in a worker thread, only selects the resources, all logging and processing is done by the consumer
+                    return account_region[0].describe(self.resource_name, **describe_args_for_region(account_region[1]))
+
+                # account and role are resolved before selecting resources concurrently
+                account_regions = []
+                for service in self._account_service_sessions(self.service):
+                    self._logger.info(INFO_ACCOUNT, service.aws_account)
+                    if service.assumed_role is not None:
+                        self._logger.info(INFO_ASSUMED_ROLE, service.assumed_role)
                     for region in self._regions:
+                        self._logger.debug(DEBUG_SELECT_PARAMETERS, self.resource_name, self.service,
+                                           describe_args_for_region(region))
+                        account_regions.append((service, region))
 
-                        if region is not None:
-                            args["region"] = region
-                        else:
-                            if "region" in args:
-                                del args["region"]
+                concurrency = self._select_concurrency
+                self._logger.info(INFO_SELECT_CONCURRENCY, len(account_regions), min(concurrency, len(account_regions)))
 
-                        self._logger.debug(DEBUG_SELECT_PARAMETERS, self.resource_name, self.service, args)
-                        # selecting a list of all resources in this account/region
-                        all_resources = list(service.describe(self.resource_name, **args))
+                found_count = {}
+                selected_count = {}
+                aggregated_resources = {}
 
-                        logstr = INFO_RESOURCES_FOUND.format(len(all_resources))
-                        if region is not None:
-                            logstr = INFO_IN_REGION.format(logstr, region)
-                        self._logger.info(logstr)
+                for event in WorkerPool(max_workers=concurrency).stream(select_in_account_region, account_regions):
 
-                        # select resources that are processed by the task
-                        selected = list([sr for sr in all_resources if is_selected_resource(sr, task_name, tag_filter,
-                                                                                            supports_tags)])
+                    service, region = event.item
+                    in_region = INFO_IN_REGION.format("", region) if region is not None else ""
+
+                    if not event.completed:
+                        resource = event.value
+                        found_count[event.item] = found_count.get(event.item, 0) + 1
 
-                        if len(all_resources) > 0:
-                            self._logger.info(INFO_RESOURCES_SELECTED, len(selected))
-                        if len(selected) == 0:
+                        # select resources that are processed by the task
+                        if not is_selected_resource(resource, task_name, tag_filter, supports_tags):
                             continue
+                        selected_count[event.item] = selected_count.get(event.item, 0) + 1
+
+                        if not self.keep_tags and "Tags" in resource:
+                            del resource["Tags"]
 
-                        if not self.keep_tags:
-                            for res in selected:
-                                if "Tags" in res:
-                                    del res["Tags"]
-
-                        if self.aggregation_level == actions.ACTION_AGGREGATION_TASK:
-                            task_level_aggregated_resources += selected
-                        elif self.aggregation_level == actions.ACTION_AGGREGATION_ACCOUNT:
-
-                            if self._check_can_execute(selected):
-                                # create tasks action for account aggregated resources , optionally split in batch size chunks
-                                for r in resource_batches(selected):
-                                    action_item = actions_tracking.add_task_action(
-                                        task=self.task,
-                                        assumed_role=assumed_role,
-                                        action_resources=r,
-                                        task_datetime=self.task_dt,
-                                        source=self.source)
-
-                                    items.append(action_item)
-                                    self._logger.info(
-                                        INFO_ACCOUNT_AGGREGATED, action_item[tracking.TASK_TR_ID], len(r), self.resource_name,
-                                        self.task[
-                                            handlers.TASK_NAME])
+                        # actions for individual resources are created while the resources are being selected, aggregated
+                        # resources are processed when all resources for the account and region are selected
+                        if self.aggregation_level in [actions.ACTION_AGGREGATION_TASK, actions.ACTION_AGGREGATION_ACCOUNT]:
+                            aggregated_resources.setdefault(event.item, []).append(resource)
                         else:
-                            for res in selected:
-                                # task action for each selected resource
-                                action_item = actions_tracking.add_task_action(
-                                    task=self.task,
-                                    assumed_role=assumed_role,
-                                    action_resources=res,
-                                    task_datetime=self.task_dt,
-                                    source=self.source)
-
-                                items.append(action_item)
-                                self._logger.info(INFO_RESOURCE, action_item[tracking.TASK_TR_ID], self.resource_name,
-                                                  self.task[handlers.TASK_NAME])
+                            add_resource_action(service.assumed_role, resource)
+                        continue
+
+                    selected = aggregated_resources.pop(event.item, [])
+
+                    if event.exception is not None:
+                        # partially selected aggregated resources are not processed for an account/region that failed
+                        self._logger.error(ERR_SELECTING_RESOURCES, service.aws_account, in_region, event.elapsed,
+                                           event.exception)
+                        select_errors.append({
+                            "account": service.aws_account,
+                            "region": region,
+                            "error": str(event.exception)
+                        })
+                        continue
+
+                    self._logger.info(INFO_SELECT_TIME, service.aws_account, in_region, event.elapsed)
+
+                    found = found_count.get(event.item, 0)
+                    logstr = INFO_RESOURCES_FOUND.format(found)
+                    if region is not None:
+                        logstr = INFO_IN_REGION.format(logstr, region)
+                    self._logger.info(logstr)
+
+                    if found > 0:
+                        self._logger.info(INFO_RESOURCES_SELECTED, selected_count.get(event.item, 0))
+                    if len(selected) == 0:
+                        continue
+
+                    if self.aggregation_level == actions.ACTION_AGGREGATION_TASK:
+                        task_level_aggregated_resources += selected
+                    else:
+                        add_account_aggregated_actions(service.assumed_role, selected)
 
                 if self.aggregation_level == actions.ACTION_AGGREGATION_TASK and len(task_level_aggregated_resources) > 0:
 
@@ -369,10 +451,11 @@ class SelectResourcesHandler:
                                 task_datetime=self.task_dt,
                                 source=self.source)
 
-                            items.append(action_item)
+                            items.append(action_item[tracking.TASK_TR_ID])
                             self._logger.info(INFO_TASK_AGGREGATED, action_item[tracking.TASK_TR_ID], len(r), self.resource_name,
                                               self.task[handlers.TASK_NAME])
 
+            self._logger.write_summaries()
             self._logger.info(INFO_ADDED_ITEMS, len(items), self.task[handlers.TASK_NAME])
 
             running_time = float((datetime.now() - start).total_seconds())
@@ -381,7 +464,8 @@ class SelectResourcesHandler:
             return safe_dict({
                 "datetime": datetime.now().isoformat(),
                 "running-time": running_time,
-                "dispatched-tasks": items
+                "dispatched-tasks": items,
+                "select-errors": select_errors
             })
 
         finally:
@@ -0,0 +1,180 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+from datetime import datetime
+from time import time
+
+import actions
+import handlers
+from boto_retry import get_client_with_retries
+from main import lambda_handler
+from util import safe_json
+from util.worker_pool import WorkerPool
+
+# max number of concurrent invocations of the Lambda function
+MAX_CONCURRENT_INVOKES = 10
+# max number of select resources events for tasks of the same service that are packed in a single invocation
+MAX_EVENTS_PER_INVOKE = 5
+# select resources events up to this size are packed with other events for the same service
+MAX_PACKED_EVENT_SIZE = 4096
+
+INFO_DISPATCHED = "Dispatched {} task(s) in {} invocation(s) in {:>.3f} seconds"
+INFO_LAMBDA = "Invoked lambda function for task(s) {}, status code is {}, latency is {:>.3f} seconds"
+
+ERR_DISPATCHING = "Error dispatching task(s) {}, {}"
+
+
+class TaskDispatcher:
+    """
+    Starts the selection of resources for tasks by asynchronous invocations of the Lambda function. The invocations are made
+    concurrently using a single client, and small events for tasks that select resources from the same service in a single
+    account and region are packed in a single invocation.
+    """
+
+    def __init__(self, context, logger, max_concurrent_invokes=MAX_CONCURRENT_INVOKES, max_events_per_invoke=MAX_EVENTS_PER_INVOKE):
+        """
+        Initializes the dispatcher
+        :param context: Lambda context, if None the events are passed to the main handler in this process
+        :param logger: Logger used by the dispatcher
+        :param max_concurrent_invokes: Max number of concurrent invocations
+        :param max_events_per_invoke: Max number of select resources events in a single invocation
+        """
+        self._context = context
+        self._logger = logger
+        self._max_concurrent_invokes = max_concurrent_invokes
+        self._max_events_per_invoke = max(1, max_events_per_invoke)
+        self._events = []
+        self._lambda_client = None
+
+    @property
+    def lambda_client(self):
+        if self._lambda_client is None:
+            self._lambda_client = get_client_with_retries("lambda", ["invoke"], context=self._context)
+        return self._lambda_client
+
+    def add(self, task, dt=None):
+        """
+        Adds a task for which resources are selected when the tasks are dispatched
+        :param task: Task started
+        :param dt: Task start datetime
+        :return:
+        """
+        self._events.append({
+            handlers.HANDLER_EVENT_ACTION: handlers.HANDLER_ACTION_SELECT_RESOURCES,
+            handlers.HANDLER_EVENT_TASK: task,
+            handlers.HANDLER_EVENT_SOURCE: "aws:events",
+            handlers.HANDLER_EVENT_TASK_DT: dt.isoformat() if dt is not None else datetime.utcnow().isoformat()
+        })
+
+    @staticmethod
+    def _is_packable(event):
+        """
+        Tests if the event for a task can be packed with other events. The size of the event does not tell how long selecting
+        the resources takes, therefore only small events for tasks that select resources in a single account and region are
+        packed, tasks for multiple accounts or regions are selected in their own invocation.
+        :param event: The select resources event
+        :return: True if the event can be packed
+        """
+        if len(safe_json(event)) > MAX_PACKED_EVENT_SIZE:
+            return False
+        task = event[handlers.HANDLER_EVENT_TASK]
+        accounts = (1 if task.get(handlers.TASK_THIS_ACCOUNT, True) else 0) + len(task.get(handlers.TASK_CROSS_ACCOUNT_ROLES, []))
+        return accounts <= 1 and len(task.get(handlers.TASK_REGIONS, None) or [None]) <= 1
+
+    def _invocation_events(self):
+        """
+        Returns the events for the invocations, small events for tasks selecting resources from the same service in a single
+        account and region are packed
+        :return: List of events
+        """
+        packed = {}
+        result = []
+        for event in self._events:
+            task = event[handlers.HANDLER_EVENT_TASK]
+            service = actions.get_action_properties(task[handlers.TASK_ACTION]).get(actions.ACTION_SERVICE)
+            if self._max_events_per_invoke == 1 or not TaskDispatcher._is_packable(event):
+                result.append(event)
+                continue
+            events_for_service = packed.setdefault(service, [])
+            events_for_service.append(event)
+            if len(events_for_service) == self._max_events_per_invoke:
+                result.append(self._packed_event(packed.pop(service)))
+
+        for service in sorted(packed):
+            events_for_service = packed[service]
+            result.append(events_for_service[0] if len(events_for_service) == 1 else self._packed_event(events_for_service))
+        return result
+
+    @staticmethod
+    def _packed_event(events):
+        return {
+            handlers.HANDLER_EVENT_ACTION: handlers.HANDLER_ACTION_SELECT_RESOURCES_BATCH,
+            handlers.HANDLER_EVENT_BATCH_ITEMS: events
+        }
+
+    @staticmethod
+    def _task_names(event):
+        if event[handlers.HANDLER_EVENT_ACTION] == handlers.HANDLER_ACTION_SELECT_RESOURCES_BATCH:
+            return [e[handlers.HANDLER_EVENT_TASK][handlers.TASK_NAME] for e in event[handlers.HANDLER_EVENT_BATCH_ITEMS]]
+        return [event[handlers.HANDLER_EVENT_TASK][handlers.TASK_NAME]]
+
+    def dispatch(self):
+        """
+        Dispatches the added tasks
+        :return: Dispatch results for every task, containing the status code and the latency of the invocation for the task
+        """
+        if len(self._events) == 0:
+            return []
+
+        start = time()
+        invocation_events = self._invocation_events()
+
+        def invoke(event):
+            # runs in a worker thread, logging is done by the caller
+            start_invoke = time()
+            if self._context is None:
+                lambda_handler(event, None)
+                return None, time() - start_invoke
+            resp = self.lambda_client.invoke_with_retries(FunctionName=self._context.function_name,
+                                                          Qualifier=self._context.function_version,
+                                                          InvocationType="Event", LogType="None",
+                                                          Payload=str.encode(safe_json(event)))
+            return resp["StatusCode"], time() - start_invoke
+
+        # if not running in lambda environment the events are passed to the main handler one at a time
+        if self._context is not None:
+            # client is created before the invocations are made concurrently
+            _ = self.lambda_client
+            pool = WorkerPool(max_workers=self._max_concurrent_invokes)
+        else:
+            pool = WorkerPool(max_workers=1)
+        invocation_results = pool.map(invoke, invocation_events, return_exceptions=True)
+
+        results = []
+        for event, result in zip(invocation_events, invocation_results):
+            task_names = TaskDispatcher._task_names(event)
+            if isinstance(result, Exception):
+                self._logger.error(ERR_DISPATCHING, ", ".join(task_names), result)
+                results += [{"task": name, "error": str(result)} for name in task_names]
+                continue
+            status_code, latency = result
+            self._logger.info(INFO_LAMBDA, ", ".join(task_names), status_code, latency)
+            results += [{
+                "task": name,
+                "status-code": status_code,
+                "latency": round(latency, 3),
+                "packed": len(task_names)
+            } for name in task_names]
+
+        self._logger.info(INFO_DISPATCHED, len(self._events), len(invocation_events), time() - start)
+        self._events = []
+        return results
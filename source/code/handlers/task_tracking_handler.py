@@ -27,7 +27,7 @@ from boto_retry import add_retry_methods_to_resource
 from handlers.task_tracking_table import TaskTrackingTable
 from main import lambda_handler
 from util import safe_dict, safe_json
-from util.logger import Logger
+from util.logger import Lazy, Logger
 
 ACTIVE_INSTANCES = "InstanceCount"
 CONCURRENCY_ID = tracking.TASK_TR_CONCURRENCY_ID
@@ -40,12 +40,14 @@ DEBUG_ACTION = "Action is \"{}\" for task \"{}\", task-id is {}"
 DEBUG_DRYRUN = "Action will be executed in in dry-run mode"
 DEBUG_LAMBDA = "Lambda function invoked {}"
 DEBUG_ACTION_PARAMETERS = "Action parameters are {}"
+DEBUG_MICRO_BATCH = "Action item {} added to micro-batch for action \"{}\" in account {}, region {}"
 
 INFO_NUMBER_OF_EXECUTING = "{} action item{} dispatched for execution"
 INFO_NUMBER_OF_WAIING = "{} action item{} put in waiting state"
 INFO_RESULT = "Handling actions tracking update took {:>.3f} seconds"
 INFO_MEMORY_SIZE = "Task memory size for lambda is {} MB"
 INFO_LAMBDA_FUNCTION_ = "Executing action with Lambda function {}, payload is {}"
+INFO_LAMBDA_FUNCTION_BATCH = "Executing batch of {} items for action \"{}\" with Lambda function {}, ids are {}"
 INFO_START_WAITING = "Waiting list count for ConcurrencyKey \"{}\" is {}, action is \"{}\", starting waiting task \"{}\" with id {}"
 INFO_WAITING = "The waiting list for action \"{}\" with concurrency key \"{}\" is {}, the maximum number of concurrent " \
                "running actions for this key is {}, action with id \"{}\" has been put in waiting state"
@@ -54,6 +56,9 @@ LOG_STREAM = "{}-{:0>4d}{:0>2d}{:0>2d}"
 SCHEDULER_LAMBDA_FUNTION_DEFAULT = "SchedulerDefault"
 SIZED_SCHEDULER_NAME_TEMPLATE = "Scheduler{:0>04d}"
 
+# max size of the payload of a Lambda function that executes a micro-batch of action items, limit for Event invocations is 128KB
+MAX_MICRO_BATCH_PAYLOAD_SIZE = 120 * 1024
+
 
 class TaskTrackingHandler:
     """
@@ -75,8 +80,11 @@ class TaskTrackingHandler:
         self.waiting_for_execution_tasks = 0
         self.started_completion_checks = 0
         self.finished_concurrency_tasks = 0
+        self.started_micro_batches = 0
         self.done_work = False
         self.invoked_lambda_functions = []
+        # new action items that are executed in micro-batches, indexed by action, account and region
+        self._micro_batches = {}
 
         self.events_client = None
 
@@ -228,6 +236,32 @@ class TaskTrackingHandler:
 
         return False
 
+    def _lambda_function_for_action(self, action_properties):
+        """
+        Returns the name of the Lambda function that executes an action, based on the memory requirements of the action
+        :param action_properties: Properties of the action
+        :return: Name of the Lambda function
+        """
+        lambda_name = self._context.function_name
+        action_memory_size = action_properties.get(actions.ACTION_MEMORY, None)
+        if action_memory_size is not None and action_memory_size != actions.LAMBDA_DEFAULT_MEMORY:
+            lambda_name = lambda_name.replace(SCHEDULER_LAMBDA_FUNTION_DEFAULT,
+                                              SIZED_SCHEDULER_NAME_TEMPLATE.format(action_memory_size))
+        return lambda_name
+
+    def _invoke_lambda_function(self, lambda_name, payload):
+        """
+        Starts an asynchronous invocation of a Lambda function
+        :param lambda_name: Name of the Lambda function
+        :param payload: Payload for the invocation
+        :return: Response of the invoke call
+        """
+        lambda_client = boto_retry.get_client_with_retries("lambda", ["invoke"], context=self._context)
+        return lambda_client.invoke_with_retries(FunctionName=lambda_name,
+                                                 InvocationType="Event",
+                                                 LogType="None",
+                                                 Payload=payload)
+
     def _start_task_execution(self, task_item, action=handlers.HANDLER_ACTION_EXECUTE):
         """
         Creates an instance of the lambda function that executes the tasks action. It first checks is the action has specific memory
@@ -254,7 +288,7 @@ class TaskTrackingHandler:
             self._logger.debug(DEBUG_ACTION, task_item[tracking.TASK_TR_ACTION],
                                task_item[tracking.TASK_TR_NAME],
                                task_item[tracking.TASK_TR_ID])
-            self._logger.debug(DEBUG_ACTION_PARAMETERS, safe_json(task_item.get(tracking.TASK_TR_PARAMETERS, {})))
+            self._logger.debug(DEBUG_ACTION_PARAMETERS, Lazy(safe_json, task_item.get(tracking.TASK_TR_PARAMETERS, {})))
 
             if self._context is not None:
                 # if running in a Lambda environment the action will be executed asynchronously in a new instance of a
@@ -263,20 +297,10 @@ class TaskTrackingHandler:
 
                 # create event payload
                 payload = str.encode(safe_json(event))
-                lambda_name = self._context.function_name
-
-                # based on the memory requirements determine the lambda function to use
-                if action_memory_size is not None and action_memory_size != actions.LAMBDA_DEFAULT_MEMORY:
-                    lambda_name = lambda_name.replace(SCHEDULER_LAMBDA_FUNTION_DEFAULT,
-                                                      SIZED_SCHEDULER_NAME_TEMPLATE.format(action_memory_size))
+                lambda_name = self._lambda_function_for_action(action_properties)
 
                 self._logger.info(INFO_LAMBDA_FUNCTION_, lambda_name, payload)
-                # start lambda function
-                lambda_client = boto_retry.get_client_with_retries("lambda", ["invoke"], context=self._context)
-                resp = lambda_client.invoke_with_retries(FunctionName=lambda_name,
-                                                         InvocationType="Event",
-                                                         LogType="None",
-                                                         Payload=payload)
+                resp = self._invoke_lambda_function(lambda_name, payload)
 
                 task_info = {
                     "id": task_item[tracking.TASK_TR_ID],
@@ -298,6 +322,94 @@ class TaskTrackingHandler:
         except Exception as ex:
             self._logger.error("Error running task {}, {}, {}", task_item, str(ex), traceback.format_exc())
 
+    @staticmethod
+    def _micro_batch_key(task_item):
+        """
+        Returns the key used to group new action items that can be executed in the same micro-batch, None if the action of the
+        item is not executed in micro-batches
+        :param task_item: Task item
+        :return: Tuple of action, account and region, None if the item is executed by its own Lambda invocation
+        """
+        action = task_item[tracking.TASK_TR_ACTION]
+        action_properties = actions.get_action_properties(action)
+        if action_properties.get(actions.ACTION_MICRO_BATCH_SIZE, 1) <= 1:
+            return None
+
+        resources = json.loads(task_item.get(tracking.TASK_TR_RESOURCES, "{}"))
+        region = resources.get("Region") if isinstance(resources, dict) else None
+        return action, task_item.get(tracking.TASK_TR_ACCOUNT), region
+
+    def _dispatch_micro_batches(self):
+        """
+        Starts the execution of the action items collected in micro-batches. Batches are split into batches that do not exceed
+        the max batch size of the action and the max payload size of the Lambda function. Each item in the batch is still
+        updated individually in the tracking table by the Lambda function executing the batch.
+        :return:
+        """
+
+        def split_batch(items, max_items):
+            batch = []
+            batch_size = 0
+            for task_item in items:
+                item_size = len(safe_json(task_item))
+                if len(batch) > 0 and (len(batch) >= max_items or batch_size + item_size > MAX_MICRO_BATCH_PAYLOAD_SIZE):
+                    yield batch
+                    batch = []
+                    batch_size = 0
+                batch.append(task_item)
+                batch_size += item_size
+            if len(batch) > 0:
+                yield batch
+
+        for (action, _, _), items in self._micro_batches.items():
+            max_batch_size = actions.get_action_properties(action)[actions.ACTION_MICRO_BATCH_SIZE]
+            for batch in split_batch(sorted(items, key=lambda i: i.get(tracking.TASK_TR_CREATED_TS)), max_batch_size):
+                if len(batch) == 1:
+                    self._start_task_execution(batch[0])
+                else:
+                    self._start_batch_execution(batch)
+        self._micro_batches = {}
+
+    def _start_batch_execution(self, task_items):
+        """
+        Creates an instance of the lambda function that executes the actions for a batch of task items of the same action,
+        account and region
+        :param task_items: Task items for which actions are executed
+        :return:
+        """
+
+        action = task_items[0][tracking.TASK_TR_ACTION]
+        ids = [i[tracking.TASK_TR_ID] for i in task_items]
+
+        try:
+            event = {
+                handlers.HANDLER_EVENT_ACTION: handlers.HANDLER_ACTION_EXECUTE_BATCH,
+                handlers.HANDLER_EVENT_BATCH_ITEMS: task_items
+            }
+
+            self.started_micro_batches += 1
+
+            if self._context is not None:
+                payload = str.encode(safe_json(event))
+                lambda_name = self._lambda_function_for_action(actions.get_action_properties(action))
+
+                self._logger.info(INFO_LAMBDA_FUNCTION_BATCH, len(task_items), action, lambda_name, ", ".join(ids))
+                resp = self._invoke_lambda_function(lambda_name, payload)
+
+                for task_item in task_items:
+                    self.invoked_lambda_functions.append({
+                        "id": task_item[tracking.TASK_TR_ID],
+                        "task": task_item[tracking.TASK_TR_NAME],
+                        "action": action,
+                        "batch": ids,
+                        "status-code": resp["StatusCode"]
+                    })
+            else:
+                lambda_handler(event, None)
+
+        except Exception as ex:
+            self._logger.error("Error running batch of tasks {}, {}, {}", ids, str(ex), traceback.format_exc())
+
     def _handle_new_task_item(self, task_item):
         """
         Handles stream updates for new tasks added to the task tracking table
@@ -312,6 +424,14 @@ class TaskTrackingHandler:
 
         # if not wait listed start the action for the task
         self.started_tasks += 1
+
+        # actions that support micro-batches are started after all records in the event are processed
+        micro_batch_key = TaskTrackingHandler._micro_batch_key(task_item)
+        if micro_batch_key is not None:
+            self._logger.debug(DEBUG_MICRO_BATCH, task_item[tracking.TASK_TR_ID], *micro_batch_key)
+            self._micro_batches.setdefault(micro_batch_key, []).append(task_item)
+            return
+
         self._start_task_execution(task_item)
 
     def _handle_completed_concurrency_item(self, task_item):
@@ -387,7 +507,7 @@ class TaskTrackingHandler:
 
             for record in self._event.get("Records"):
 
-                self._logger.debug("Record to process is {}", safe_json(record, indent=2))
+                self._logger.debug("Record to process is {}", Lazy(safe_json, record, indent=2))
 
                 if record.get("eventSource") == "aws:dynamodb":
                     if record["eventName"] == "REMOVE":
@@ -432,6 +552,8 @@ class TaskTrackingHandler:
                 if not self.done_work:
                     self._logger.clear()
 
+            self._dispatch_micro_batches()
+
             running_time = float((datetime.now() - start).total_seconds())
             if self.done_work:
                 self._logger.info(INFO_RESULT, running_time)
@@ -442,6 +564,7 @@ class TaskTrackingHandler:
                 "started-check-for-completion": self.started_completion_checks,
                 "started-execution": self.started_tasks,
                 "started-waiting": self.started_waiting_tasks,
+                "started-micro-batches": self.started_micro_batches,
                 "completed-concurrency-tasks": self.finished_concurrency_tasks,
                 "running-time": running_time
             })
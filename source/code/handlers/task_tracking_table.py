@@ -13,10 +13,12 @@
 
 
 import os
+import random
 import uuid
+from collections import deque
 from datetime import datetime
 from decimal import Decimal
-from time import time
+from time import sleep, time
 
 import boto3
 from boto3.dynamodb.conditions import Attr, Key
@@ -26,6 +28,7 @@ import main
 from boto_retry import add_retry_methods_to_resource, get_client_with_retries
 from services.aws_service import AwsService
 from util import safe_json
+from util.worker_pool import WorkerPool
 
 # name of environment variable that hold the dynamodb action table
 TASK_TR_ACCOUNT = "Account"
@@ -68,19 +71,37 @@ STATUS_WAITING = "wait-for-exec"
 
 ITEMS_NOT_WRITTEN = "Items can not be written to action table, items not writen are {}, ({})"
 
+# max number of items in a single batch write request
+BATCH_WRITE_MAX_ITEMS = 25
+# max number of batch write requests that are executed concurrently
+BATCH_WRITE_WORKERS = 8
+# number of cached items for which all workers can write a full batch, used as the default flush size when items are flushed
+# automatically
+AUTO_FLUSH_SIZE = BATCH_WRITE_MAX_ITEMS * BATCH_WRITE_WORKERS
+
+# initial and max wait in seconds before retrying to write unprocessed items of a batch write request
+UNPROCESSED_ITEMS_WAIT = 0.05
+UNPROCESSED_ITEMS_MAX_WAIT = 5
+# max number of retries for writing unprocessed items of a batch write request
+UNPROCESSED_ITEMS_MAX_RETRIES = 10
+
 class TaskTrackingTable:
     """
     Class that implements logic to create and update the status of action in a dynamodb table.
     """
 
-    def __init__(self, context=None):
+    def __init__(self, context=None, flush_size=None):
         """
         Initializes the instance
+        :param context: Lambda context
+        :param flush_size: If set the cached action items are written to the table when this number of items is cached
         """
         self._table = None
         self._client = None
-        self._new_action_items = []
+        self._new_action_items = deque()
         self._context = context
+        self._flush_size = flush_size
+        self._account = None
 
     def __enter__(self):
         """
@@ -102,8 +123,8 @@ class TaskTrackingTable:
     def add_task_action(self, task, assumed_role, action_resources, task_datetime, source):
         """
         Creates and adds a new action to be written to the tracking table. Note that the items are kept in an internal
-        buffer and written in batches to the dynamodb table when the instance goes out of scope or the close method
-        is called explicitly.
+        buffer and written in batches to the dynamodb table when the instance goes out of scope, the flush method
+        is called explicitly or the number of buffered items reaches the flush size of the instance.
         :param task: Task that executes the action
         :param assumed_role: Role to assume to execute the action
         :param action_resources: Resources on which the action is performed
@@ -131,15 +152,18 @@ class TaskTrackingTable:
             item[TASK_TR_ASSUMED_ROLE] = assumed_role
             item[TASK_TR_ACCOUNT] = AwsService.account_from_role_arn(assumed_role)
         else:
-            item[TASK_TR_ACCOUNT] = AwsService.get_aws_account()
+            if self._account is None:
+                self._account = AwsService.get_aws_account()
+            item[TASK_TR_ACCOUNT] = self._account
 
         if len(task[handlers.TASK_PARAMETERS]) > 0:
-            item[TASK_TR_PARAMETERS] = task[handlers.TASK_PARAMETERS]
-
-        if item[TASK_TR_PARAMETERS]:
-            item[TASK_TR_PARAMETERS] = safe_json(item[TASK_TR_PARAMETERS])
+            item[TASK_TR_PARAMETERS] = safe_json(task[handlers.TASK_PARAMETERS])
 
         self._new_action_items.append(item)
+
+        if self._flush_size is not None and len(self._new_action_items) >= self._flush_size:
+            self.flush()
+
         return item
 
     @property
@@ -178,53 +202,64 @@ class TaskTrackingTable:
             return {"N": str(o)}
         return {"S": str(o)}
 
+    def _write_batch(self, table_name, batch_write_items):
+        """
+        Writes a batch of items to the table, unprocessed items are retried with an exponential backoff
+        :param table_name: Name of the table
+        :param batch_write_items: Put requests for the items to write
+        :return:
+        """
+        retries = 0
+        while len(batch_write_items) > 0:
+
+            resp = self._dynamodb_client.batch_write_item_with_retries(RequestItems={table_name: batch_write_items})
+            batch_write_items = resp.get("UnprocessedItems", {}).get(table_name, [])
+
+            if len(batch_write_items) > 0:
+                if retries == UNPROCESSED_ITEMS_MAX_RETRIES:
+                    raise Exception(ITEMS_NOT_WRITTEN.format(",".join([str(i) for i in batch_write_items]),
+                                                             "max retries for unprocessed items reached"))
+                wait = min(UNPROCESSED_ITEMS_WAIT * (2 ** retries), UNPROCESSED_ITEMS_MAX_WAIT)
+                sleep(random.uniform(wait / 2, wait))
+                retries += 1
+
     def flush(self):
         """
-        Writes all cached action items in batches to the dynamodb table
+        Writes all cached action items in batches to the dynamodb table, batches are written concurrently
         :return:
         """
 
-        items_to_write = []
-        has_failed_items_to_retry = False
+        written_items = []
+        batches = []
+        batch_write_items = []
 
-        # create items to write to table
-        for item in self._new_action_items:
-            items_to_write.append(
+        # create batches of max 25 items to write to table
+        while len(self._new_action_items) > 0:
+            item = self._new_action_items.popleft()
+            written_items.append(item)
+            batch_write_items.append(
                 {
                     "PutRequest": {
                         "Item": {attr: TaskTrackingTable.typed_item(item[attr]) for attr in item if item[attr] is not None}
                     }
                 })
+            if len(batch_write_items) == BATCH_WRITE_MAX_ITEMS:
+                batches.append(batch_write_items)
+                batch_write_items = []
 
-        # buffer to hold a max of 25 items to write in a batch
-        batch_write_items = []
-        # write until all items are written
-        while len(items_to_write) > 0:
-
-            try:
-                batch_write_items.append(items_to_write.pop(0))
-                if len(batch_write_items) == 25 or len(items_to_write) == 0:
-                    putrequest = {self._action_table.name: batch_write_items}
-                    resp = self._dynamodb_client.batch_write_item_with_retries(RequestItems=putrequest)
-
-                    # unprocessed items are put back in the list of items to write
-                    unprocessed_items = resp.get("UnprocessedItems", [])
-                    has_failed_items_to_retry = has_failed_items_to_retry or len(unprocessed_items) > 0
-                    for unprocessed_item in unprocessed_items:
-                        has_failed_items_to_retry = True
-                        items_to_write.append(unprocessed_item)
-                    batch_write_items = []
-            except Exception as ex:
-                # when there are items that are retried to write check for timeout in loop
-                if has_failed_items_to_retry:
-                    raise Exception(ITEMS_NOT_WRITTEN.format(",".join([str(i) for i in items_to_write]), str(ex)))
+        if len(batch_write_items) > 0:
+            batches.append(batch_write_items)
+
+        if len(batches) == 0:
+            return
+
+        table_name = self._action_table.name
+        WorkerPool(max_workers=BATCH_WRITE_WORKERS).map(lambda b: self._write_batch(table_name, b), batches)
 
         if self._context is None:
-            for i in self._new_action_items:
+            for i in written_items:
                 TaskTrackingTable._simulate_stream_processing("INSERT", i)
 
-        self._new_action_items = []
-
     @property
     def _action_table(self):
         """
@@ -11,6 +11,8 @@
 #  and limitations under the License.                                                                                #
 ######################################################################################################################
 
+import bisect
+import calendar
 from datetime import datetime, timedelta, tzinfo
 
 import pytz
@@ -21,6 +23,14 @@ from scheduling.month_setbuilder import MonthSetBuilder
 from scheduling.monthday_setbuilder import MonthdaySetBuilder
 from scheduling.weekday_setbuilder import WeekdaySetBuilder
 
+# max number of months for which the matching days of month are kept by an expression
+MAX_CACHED_MONTHS = 120
+# max number of dates for which a match of the weekday is kept by an expression
+MAX_CACHED_DATES = 1000
+
+# marker for weekday sets that depend on the tested date
+DATE_DEPENDENT = object()
+
 
 class CronExpression:
     """
@@ -78,6 +88,12 @@ class CronExpression:
         self._month = None
         self._day_of_week = None
 
+        # matching days of month by (year, month), set of weekdays for expressions that do not depend on the date and
+        # matching weekdays by (year, month, day) for expressions that do
+        self._month_days = {}
+        self._weekdays = None
+        self._date_weekdays = {}
+
         # builders for date and time elements
         self._minutes_builder = None
         self._hours_builder = None
@@ -119,10 +135,11 @@ class CronExpression:
         :param dt: Datetime to test or None to use current datetime
         :return: The tested dt if it does match the expression, None if it does not
         """
-        dtz = self._prepare_expression(self._localized_time(dt))
-        return dtz if all([dtz.day in self._day_of_month,
-                           dtz.month in self._month,
-                           dtz.weekday() in self._day_of_week,
+        dtz = self._localized_time(dt)
+        self._prepare_sets()
+        return dtz if all([dtz.month in self._month,
+                           dtz.day in self._days_in_month(dtz.year, dtz.month),
+                           self._is_matching_weekday(dtz.year, dtz.month, dtz.day),
                            dtz.minute in self._minutes,
                            dtz.hour in self._hours]) else None
 
@@ -291,13 +308,11 @@ class CronExpression:
             return dt.replace(tzinfo=self._timezone) if dt.tzinfo is None else dt
         return datetime.now(tz=self._timezone)
 
-    def _prepare_expression(self, dt):
+    def _prepare_sets(self):
         """
-        Prepares internal builders for expression elements for testing a datetime
-        :param dt: Tested datetime
-        :return: Tested datetime
+        Builds the sets for the elements of the expression that do not depend on the tested date
+        :return:
         """
-
         # minute set builder
         if self._minutes is None:
             self._minutes_builder = MinuteSetBuilder()
@@ -313,8 +328,17 @@ class CronExpression:
             self._month_builder = MonthSetBuilder()
             self._month = sorted(MonthSetBuilder().build(self._month_str))
 
+    def _prepare_expression(self, dt):
+        """
+        Prepares internal builders for expression elements for testing a datetime
+        :param dt: Tested datetime
+        :return: Tested datetime
+        """
+
+        self._prepare_sets()
+
         # day of month and day in week builders, note that these depend on the date being tested
-        if self._date is None or self._date.date() != dt.date():
+        if self._date is None or self._day_of_month is None or self._date.date() != dt.date():
             # first time or if date to be tested differs from previous test
             # day of month builder
             self._day_of_month_builder = MonthdaySetBuilder(year=dt.year, month=dt.month)
@@ -326,12 +350,62 @@ class CronExpression:
             self._date = dt.replace(hour=0, minute=0, second=0, microsecond=0)
         return dt
 
+    def _days_in_month(self, year, month):
+        """
+        Returns the days in a month that match the day of month element of the expression, the days are calculated once for
+        every month
+        :param year: Year of the month
+        :param month: Month
+        :return: Sorted list of matching days in the month
+        """
+        key = (year, month)
+        days = self._month_days.get(key)
+        if days is None:
+            last_day = calendar.monthrange(year, month)[1]
+            month_days = MonthdaySetBuilder(year=year, month=month).build(self._day_of_month_str)
+            days = [d for d in sorted(month_days) if 1 <= d <= last_day]
+            if len(self._month_days) >= MAX_CACHED_MONTHS:
+                self._month_days.clear()
+            self._month_days[key] = days
+        return days
+
+    def _is_matching_weekday(self, year, month, day):
+        """
+        Tests if the weekday of a date matches the day of week element of the expression. The set of weekdays only depends on the
+        date for the # and L features, for other expressions the set is built once.
+        :param year: Year of the date
+        :param month: Month of the date
+        :param day: Day of the date
+        :return: True if the weekday matches
+        """
+        weekday = calendar.weekday(year, month, day)
+
+        if self._weekdays is None:
+            if WeekdaySetBuilder.WEEKDAY_NUMBER_CHAR in self._day_of_week_str or \
+                    WeekdaySetBuilder.LAST_DAY_WILDCARD in self._day_of_week_str:
+                self._weekdays = DATE_DEPENDENT
+            else:
+                self._weekdays = set(WeekdaySetBuilder().build(self._day_of_week_str))
+
+        if self._weekdays is not DATE_DEPENDENT:
+            return weekday in self._weekdays
+
+        key = (year, month, day)
+        matching = self._date_weekdays.get(key)
+        if matching is None:
+            matching = weekday in WeekdaySetBuilder(year=year, month=month, day=day).build(self._day_of_week_str)
+            if len(self._date_weekdays) >= MAX_CACHED_DATES:
+                self._date_weekdays.clear()
+            self._date_weekdays[key] = matching
+        return matching
+
     def _matches_backwards(self, start_dt, end_dt):
 
         """
         Find matches in a period specified by a start and end datetime. The search is performed backwards starting from the end
         datetime (including) until the start datetime (excluding). For efficiency there are separate methods for searching forwards
-        and backwards.
+        and backwards. Months, days, hours and minutes that do not match are skipped by searching the sorted sets of the
+        expression.
         :param start_dt: Start datetime (excluding)
         :param end_dt: End datetime (including), use None for localized current datetime
         :return: Set of matching datetimes for the expression in the period, [] if there are no matches
@@ -339,37 +413,49 @@ class CronExpression:
         start_dtz = self._localized_time(start_dt).replace(second=0, microsecond=0)
         dtz = self._localized_time(end_dt).replace(second=0, microsecond=0)
 
-        # until the start of the period is reached move backwards
-        while dtz > start_dtz:
-            self._prepare_expression(dtz)
-            # month does not match, move back previous month
-            if dtz.month not in self._month:
-                dtz = self._move_to_previous_month(dtz)
-                continue
-
-            # day or weekday does not match, move back to previous day
-            if dtz.day not in self._day_of_month or dtz.weekday() not in self._day_of_week:
-                dtz = self._move_to_previous_day(dtz)
-                continue
-
-            # hours do not match move to last event in previous hour
-            if dtz.hour not in self._hours:
-                dtz = self._move_to_previous_hour(dtz)
-                continue
-
-            # minutes do not match, move back to last event in previous minute
-            if dtz.minute not in self._minutes:
-                dtz = self._move_to_previous_minute(dtz)
-                continue
-
-            yield dtz
-            dtz = self._move_to_previous_minute(dtz)
+        self._prepare_sets()
+        if len(self._month) == 0 or len(self._hours) == 0 or len(self._minutes) == 0:
+            return
+
+        year, month, day, hour, minute = dtz.year, dtz.month, dtz.day, dtz.hour, dtz.minute
+
+        while True:
+            # move back to latest month in the set that is <= current month
+            index = bisect.bisect_right(self._month, month) - 1
+            if index < 0:
+                year, month, day, hour, minute = year - 1, self._month[-1], 31, 23, 59
+            elif self._month[index] != month:
+                month, day, hour, minute = self._month[index], 31, 23, 59
+
+            # stop if the last minute of the month is before the start of the period
+            if datetime(year=year, month=month, day=calendar.monthrange(year, month)[1], hour=23, minute=59,
+                        tzinfo=dtz.tzinfo) <= start_dtz:
+                return
+
+            days = self._days_in_month(year, month)
+            for d in reversed(days[:bisect.bisect_right(days, day)]):
+                if datetime(year=year, month=month, day=d, hour=23, minute=59, tzinfo=dtz.tzinfo) <= start_dtz:
+                    return
+                if not self._is_matching_weekday(year, month, d):
+                    continue
+                last_hour = hour if d == day else 23
+                for h in reversed(self._hours[:bisect.bisect_right(self._hours, last_hour)]):
+                    last_minute = minute if d == day and h == hour else 59
+                    for m in reversed(self._minutes[:bisect.bisect_right(self._minutes, last_minute)]):
+                        match = datetime(year=year, month=month, day=d, hour=h, minute=m, tzinfo=dtz.tzinfo)
+                        if match <= start_dtz:
+                            return
+                        yield match
+
+            # continue at the end of the previous month
+            year, month, day, hour, minute = (year, month - 1, 31, 23, 59) if month > 1 else (year - 1, 12, 31, 23, 59)
 
     def _matches_forwards(self, start_dt, end_dt):
         """
          Find matches in a period specified by a start and end datetime. The search is performed forwards starting from the start
         datetime (excluding) until the start datetime (including). For efficiency there are separate methods for searching forwards
-        and backwards.
+        and backwards. Months, days, hours and minutes that do not match are skipped by searching the sorted sets of the
+        expression.
         :param start_dt: Start datetime (excluding)
         :param end_dt: End datetime (including)
         :return: Set of matching datetimes for the expression in the period, [] if there are no matches
@@ -378,259 +464,38 @@ class CronExpression:
         dtz = self._localized_time(start_dt).replace(second=0, microsecond=0) + timedelta(minutes=1)
         end_dtz = self._localized_time(end_dt)
 
-        # until the end of the period is reached
-        while dtz <= end_dtz:
-            self._prepare_expression(dtz)
-            # month does not match, move forward to first event in next month
-            if dtz.month not in self._month:
-                dtz = self._move_to_next_month(dtz)
-                continue
-
-            # day or weekday does not match move forward to first event in next day
-            if dtz.day not in self._day_of_month or dtz.weekday() not in self._day_of_week:
-                dtz = self._move_to_next_day(dtz)
-                continue
-
-            # hours do not match move forward to first event in next hour
-            if dtz.hour not in self._hours:
-                dtz = self._move_to_next_hour(dtz)
-                continue
-
-            # minutes do not match, move forward to first event in next minute
-            if dtz.minute not in self._minutes:
-                dtz = self._move_to_next_minute(dtz)
-                continue
-
-            yield dtz
-            dtz = self._move_to_next_minute(dtz)
-
-    def _move_to_previous_month(self, dt):
-        """
-        Move to end of previous month
-        :param dt: Tested datetime
-        :return: Last day for expression in previous month
-        """
-        # is the current month is the list
-        if dt.month in self._month:
-            # get the index -1, note that if the index is -1 the the last item in the list is used so no special
-            # handling required if it is the first one in the list and we have to move back to previous month
-            index = self._month.index(dt.month) - 1
-        else:
-            # find a matching index in the list that is <= current month
-            index = len(self._month) - 1
-            while index >= 0:
-                if self._month[index] <= dt.month:
-                    break
-                index -= 1
-
-        # get the month from the list
-        previous_month = self._month[index]
-
-        # year - 1 if the new month is later than the current month
-        year = dt.year if previous_month < dt.month else dt.year - 1
-
-        previous_month_builder = MonthdaySetBuilder(year=year, month=previous_month)
-        month_days_previous = sorted(previous_month_builder.build(self._day_of_month_str))
-        day = max(month_days_previous) if month_days_previous != [] else previous_month_builder.last
-
-        # return the last event for the last day of the previous month
-        return datetime(year=year, month=previous_month, day=day, hour=max(self._hours), minute=max(self._minutes),
-                        tzinfo=dt.tzinfo)
-
-    def _move_to_next_month(self, dt):
-        """
-        Move to first day in next month
-        :param dt: Tested datetime
-        :return: First day in next month for expression
-        """
-        # is the current month is the set
-        if dt.month in self._month:
-            # get the index + 1, wrap to first in list if last entry
-            index = (self._month.index(dt.month) + 1) % len(self._month)
-        else:
-            # find a matching index in the list that is >= current month
-            index = 0
-            while index < len(self._month) - 1:
-                if self._month[index] >= dt.month:
-                    break
-                index += 1
-        # get the month
-        next_month = self._month[index]
-
-        # year + 1 if the new month is earlier than the next month
-        year = dt.year if next_month > dt.month else dt.year + 1
-
-        next_month_builder = MonthdaySetBuilder(year=year, month=next_month)
-        month_days_next = sorted(next_month_builder.build(self._day_of_month_str))
-        day = min(month_days_next) if month_days_next != [] else next_month_builder.first
-
-        return datetime(year=year, month=next_month, day=day, hour=min(self._hours), minute=min(self._minutes), tzinfo=dt.tzinfo)
-
-    def _move_to_previous_day(self, dt):
-        """
-        Move to previous day for expression, move to previous month if necessary
-        :param dt: Tested datetime
-        :return: Next day for expression
-        """
-
-        # test if day is in the current set
-        if dt.day in self._day_of_month:
-            # if so use the index -1
-            index = self._day_of_month.index(dt.day) - 1
-        else:
-            # otherwise get the index of the first entry equal or less than the current day
-            index = len(self._day_of_month) - 1
-            while index > 0:
-                if self._day_of_month[index] <= dt.day:
-                    break
-                index -= 1
-
-        # get the day from the set, if it is empty use the current day to move into the next month
-        d = self._day_of_month[index] if index > -1 else dt.day
-
-        # if the day > the current day then move back to the last event in the previous month
-        if d >= dt.day:
-            return self._move_to_previous_month(dt)
-        else:
-            # last event of previous day in same month
-            return dt.replace(day=d, hour=max(self._hours), minute=max(self._minutes))
-
-    def _move_to_next_day(self, dt):
-        """
-        Move to next day for expression, move to next month if necessary
-        :param dt: Tested datetime
-        :return: Next day for expression
-        """
-        # test if day is in the current set
-        if dt.day in self._day_of_month:
-            # if so use the index -1
-            index = (self._day_of_month.index(dt.day) + 1) % len(self._day_of_month)
-        else:
-            # otherwise get the index of the first entry >= the current day
-            index = 0
-            while index < len(self._day_of_month) - 1:
-                if self._day_of_month[index] >= dt.day:
-                    break
-                index += 1
-
-        # get the day from the set, if it is empty then use current day to move forward to next month
-        d = self._day_of_month[index] if self._day_of_month != [] else dt.day
-
-        # if the day > the current day then move back to the last event in the previous month
-        if d <= dt.day:
-            return self._move_to_next_month(dt)
-        else:
-            # last event of previous day in same month
-            return dt.replace(day=d, hour=min(self._hours), minute=min(self._minutes))
-
-    def _move_to_previous_hour(self, dt):
-        """
-        Move to previous hour for expression, move to previous day if necessary
-        :param dt: Tested datetime
-        :return: Previous hour for expression
-        """
-        # test if current hour is in the set
-        if dt.hour in self._hours:
-            # if so use the index -1
-            index = self._hours.index(dt.hour) - 1
-        else:
-            # otherwise find the first entry in the set that is <= current hour
-            index = len(self._hours) - 1
-            while index > 0:
-                if self._hours[index] <= dt.hour:
-                    break
-                index -= 1
-        # get the hour from the list
-        h = self._hours[index]
-
-        # if the hour >= the current hour then move back to last event in previous day
-        if h >= dt.hour:
-            return self._move_to_previous_day(dt)
-        else:
-            # previous event at same day
-            return dt.replace(hour=h, minute=max(self._minutes))
-
-    def _move_to_next_hour(self, dt):
-        """
-        Move to next hour for expression, move to next day if necessary
-        :param dt: Tested datetime
-        :return: Next hour for expression
-        """
-        # test if current hour is in the set
-        if dt.hour in self._hours:
-            # if so used the index -1
-            index = (self._hours.index(dt.hour) + 1) % len(self._hours)
-        else:
-            # otherwise find the first entry in the set that is >= current hour
-            index = 0
-            while index < len(self._hours) - 1:
-                if self._hours[index] >= dt.hour:
-                    break
-                index += 1
-        # get the hour from the list
-        h = self._hours[index]
-
-        # if the hour <= the current hour then move to first event in next day
-        if h <= dt.hour:
-            return self._move_to_next_day(dt)
-        else:
-            # next event at same day
-            return dt.replace(hour=h, minute=min(self._minutes))
-
-    def _move_to_previous_minute(self, dt):
-        """
-        Move to previous minute, move to previous hour if necessary
-        :param dt: Tested datetime
-        :return: Previous minute for expression
-        """
-        # test if current minute is in the set
-        if dt.minute in self._minutes:
-            # use the index -1
-            index = self._minutes.index(dt.minute) - 1
-        else:
-            # otherwise find the index of the minute <= current minute
-            index = len(self._minutes) - 1
-            while index > 0:
-                if self._minutes[index] <= dt.minute:
-                    break
-                index -= 1
-
-        # get minute from the list
-        minute = self._minutes[index]
-
-        if minute >= dt.minute:
-            # if minute >= current minute then return last event in previous hour
-            return self._move_to_previous_hour(dt)
-        else:
-            # return previous event in same hour
-            return dt.replace(minute=minute)
-
-            # gets the last event in the previous minute in the set
-
-    def _move_to_next_minute(self, dt):
-        """
-        Moves to next minute, move to next hour if necessary
-        :param dt: tested datetime
-        :return: Next minute for expression
-        """
-        # test if current minute is in the set
-        if dt.minute in self._minutes:
-            # use the index +1
-            index = (self._minutes.index(dt.minute) + 1) % len(self._minutes)
-        else:
-            # otherwise find the index of the minute <= current minute
-            index = 0
-            while index < len(self._minutes) - 1:
-                if self._minutes[index] >= dt.minute:
-                    break
-                index += 1
-
-        # get minute from the list
-        minute = self._minutes[index]
-
-        if minute <= dt.minute:
-            # if minute <= current minute then return first event in next hour
-            return self._move_to_next_hour(dt)
-        else:
-            # return next event in same hour
-            return dt.replace(minute=minute)
+        self._prepare_sets()
+        if len(self._month) == 0 or len(self._hours) == 0 or len(self._minutes) == 0:
+            return
+
+        year, month, day, hour, minute = dtz.year, dtz.month, dtz.day, dtz.hour, dtz.minute
+
+        while True:
+            # move forward to first month in the set that is >= current month
+            index = bisect.bisect_left(self._month, month)
+            if index == len(self._month):
+                year, month, day, hour, minute = year + 1, self._month[0], 1, 0, 0
+            elif self._month[index] != month:
+                month, day, hour, minute = self._month[index], 1, 0, 0
+
+            # stop if the first minute of the month is after the end of the period
+            if datetime(year=year, month=month, day=1, tzinfo=dtz.tzinfo) > end_dtz:
+                return
+
+            days = self._days_in_month(year, month)
+            for d in days[bisect.bisect_left(days, day):]:
+                if datetime(year=year, month=month, day=d, tzinfo=dtz.tzinfo) > end_dtz:
+                    return
+                if not self._is_matching_weekday(year, month, d):
+                    continue
+                first_hour = hour if d == day else 0
+                for h in self._hours[bisect.bisect_left(self._hours, first_hour):]:
+                    first_minute = minute if d == day and h == hour else 0
+                    for m in self._minutes[bisect.bisect_left(self._minutes, first_minute):]:
+                        match = datetime(year=year, month=month, day=d, hour=h, minute=m, tzinfo=dtz.tzinfo)
+                        if match > end_dtz:
+                            return
+                        yield match
+
+            # continue at the start of the next month
+            year, month, day, hour, minute = (year, month + 1, 1, 0, 0) if month < 12 else (year + 1, 1, 1, 0, 0)
@@ -0,0 +1,76 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import threading
+from collections import OrderedDict
+
+from scheduling.cron_expression import CronExpression
+
+# max number of parsed expressions kept in the cache, least recently used expressions are removed first
+MAX_CACHED_EXPRESSIONS = 4096
+
+CACHE_HITS = "hits"
+CACHE_MISSES = "misses"
+CACHE_SIZE = "size"
+
+# parsed expressions by (expression, timezone), kept in module so they are reused by warm Lambda invocations
+_expressions = OrderedDict()
+_lock = threading.Lock()
+_statistics = {CACHE_HITS: 0, CACHE_MISSES: 0}
+
+
+def get_cron_expression(expression, tz=None):
+    """
+    Returns a shared instance of a cron expression. Instances keep the sets for the parsed fields of the expression and the
+    days calculated for months, so reusing them avoids parsing the expression for every test. Shared instances must not be
+    created with a default datetime to test against.
+    :param expression: Cron expression, see CronExpression for syntax
+    :param tz: Optional timezone, see CronExpression
+    :return: CronExpression instance for the expression and timezone
+    """
+    key = (expression, tz)
+    with _lock:
+        cron = _expressions.pop(key, None)
+        if cron is not None:
+            _statistics[CACHE_HITS] += 1
+        else:
+            _statistics[CACHE_MISSES] += 1
+            cron = CronExpression(expression=expression, tz=tz)
+            if len(_expressions) >= MAX_CACHED_EXPRESSIONS:
+                _expressions.popitem(last=False)
+        # (re)insert as most recently used item
+        _expressions[key] = cron
+        return cron
+
+
+def statistics():
+    """
+    Returns the number of cache hits and misses since the cache was created or cleared and the number of cached expressions
+    :return: Dictionary with hits, misses and size of the cache
+    """
+    with _lock:
+        return {
+            CACHE_HITS: _statistics[CACHE_HITS],
+            CACHE_MISSES: _statistics[CACHE_MISSES],
+            CACHE_SIZE: len(_expressions)
+        }
+
+
+def clear():
+    """
+    Removes all expressions from the cache and resets the counters
+    :return:
+    """
+    with _lock:
+        _expressions.clear()
+        _statistics[CACHE_HITS] = 0
+        _statistics[CACHE_MISSES] = 0
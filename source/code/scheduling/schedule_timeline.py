@@ -0,0 +1,149 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import heapq
+from datetime import timedelta
+
+# period searched for the next time a task fires, if a task does not fire within this period it is searched again at the end
+# of the period
+DEFAULT_HORIZON = timedelta(days=7)
+
+
+class ScheduleTimeline:
+    """
+    Index of the next time tasks fire, kept in a min-heap ordered by time. The next time a task fires is only calculated when
+    the task is added or changed and after it fired, so finding the tasks that fire in a period and the first task that fires
+    does not require testing the schedules of all tasks.
+    """
+
+    def __init__(self, next_fire_func, horizon=DEFAULT_HORIZON):
+        """
+        Initializes the timeline
+        :param next_fire_func: Function that returns the first time a task fires for a schedule, called with the schedule of the
+        task, the time after which to search and the timespan to search. The function must return None if the task does not fire
+        in the timespan.
+        :param horizon: Timespan searched for the next time a task fires
+        """
+        self._next_fire_func = next_fire_func
+        self._horizon = horizon
+        # items are tuples (time, task name, generation, is recheck)
+        self._heap = []
+        # schedules of tasks by task name
+        self._schedules = {}
+        # generation of the valid heap item of every task, items of other generations are ignored
+        self._generations = {}
+        self._generation = 0
+        # valid heap item for every task
+        self._entries = {}
+
+    def update_tasks(self, schedules, dt):
+        """
+        Updates the timeline for the current set of tasks, only tasks that are new or which schedule was changed are added
+        :param schedules: Dictionary of task schedules by task name, a schedule can be any value that can be compared and is
+        passed to the next fire function
+        :param dt: Time after which the new and changed tasks are searched for the next time they fire
+        :return: Names of added and changed tasks
+        """
+        for name in [n for n in self._schedules if n not in schedules]:
+            self.remove_task(name)
+
+        changed = [n for n in schedules if self._schedules.get(n) != schedules[n] or n not in self._schedules]
+        for name in changed:
+            self._schedules[name] = schedules[name]
+            self._schedule(name, dt)
+        return changed
+
+    def remove_task(self, name):
+        """
+        Removes a task from the timeline
+        :param name: Name of the task
+        :return:
+        """
+        self._schedules.pop(name, None)
+        self._entries.pop(name, None)
+        # heap items of the task are ignored as the generation no longer exists
+        self._generations.pop(name, None)
+
+    def fire(self, dt):
+        """
+        Returns the tasks that fire up and until a time and moves these tasks to the next time they fire after that time
+        :param dt: End of the period (including)
+        :return: Names of the tasks that fire
+        """
+        fired = []
+        while True:
+            self._remove_stale_items()
+            if len(self._heap) == 0 or self._heap[0][0] > dt:
+                break
+            fire_dt, name, _, is_recheck = heapq.heappop(self._heap)
+            if is_recheck:
+                # task did not fire until the end of the searched period, continue searching from there
+                self._schedule(name, fire_dt)
+            else:
+                fired.append(name)
+                self._schedule(name, dt)
+        return fired
+
+    def first(self, until=None):
+        """
+        Returns the first task that fires
+        :param until: Optional end of the period (including) in which to return the first task
+        :return: Tuple (time, task name) for the task that fires first, None if there is no task firing in the period
+        """
+        while True:
+            self._remove_stale_items()
+            if len(self._heap) == 0:
+                break
+            fire_dt, name, _, is_recheck = self._heap[0]
+            if until is not None and fire_dt > until:
+                break
+            if not is_recheck:
+                return fire_dt, name
+            # continue searching from the end of the searched period of the task
+            heapq.heappop(self._heap)
+            self._schedule(name, fire_dt)
+        return None
+
+    def next_fire(self, name):
+        """
+        Returns the next time a task fires
+        :param name: Name of the task
+        :return: Time of the next time the task fires, None if the task is not in the timeline or does not fire within the
+        searched period
+        """
+        entry = self._entries.get(name)
+        return entry[0] if entry is not None and not entry[3] else None
+
+    def _schedule(self, name, dt):
+        # adds a heap item for the next time a task fires after dt, or for the end of the searched period if it does not fire
+        fire_dt = self._next_fire_func(self._schedules[name], dt, self._horizon)
+        self._generation += 1
+        self._generations[name] = self._generation
+        if fire_dt is not None:
+            item = (fire_dt, name, self._generation, False)
+        else:
+            item = (dt + self._horizon, name, self._generation, True)
+        self._entries[name] = item
+
+        # rebuild the heap if most of its items are stale
+        if len(self._heap) > 2 * len(self._entries) + 16:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+        else:
+            heapq.heappush(self._heap, item)
+
+    def _is_stale(self, item):
+        return self._generations.get(item[1]) != item[2]
+
+    def _remove_stale_items(self):
+        while len(self._heap) > 0 and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
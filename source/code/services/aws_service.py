@@ -14,20 +14,25 @@
 
 import copy
 import re
-import uuid
+import threading
 
 import boto3
 import jmespath
 
 import boto_retry
-from boto_retry import get_client_with_retries
+from boto_retry import client_pool, credentials_cache, get_client_with_retries
+from util import rate_limiter
 from util.named_tuple_builder import as_namedtuple
+from util.worker_pool import WorkerPool
 
 ERR_UNEXPECTED_MULIPLE_RESULTS = "Requested a single resource result but there are multiple resources in the result"
 ERR_NO_BOTO_SERVICE_METHOD = "Service client for service \"{}\" has no method named \"{}\""
 
 DEFAULT_NEXT_TOKEN = "NextToken"
 
+# max number of concurrent calls to retrieve the tags for the resources in a page of a describe call
+DEFAULT_TAGS_CONCURRENCY = 8
+
 
 class AwsService:
     """
@@ -63,8 +68,11 @@ class AwsService:
         :param service_retry_strategy: service retry strategy for making boto api calls
         """
 
-        self._region = None
-        self._service_client = None
+        self._default_region = None
+        # clients are cached by region, the lock protects the session and client cache when the service instance is used
+        # from multiple threads
+        self._service_clients = {}
+        self._lock = threading.RLock()
         self._assumed_role = None
 
         # use session, role or none (non used default session)
@@ -102,6 +110,9 @@ class AwsService:
 
         self._service_retry_strategy = service_retry_strategy
 
+        # max number of concurrent calls for retrieving tags that require an explicit call per resource
+        self._tags_concurrency = DEFAULT_TAGS_CONCURRENCY
+
     @staticmethod
     def is_regional():
         """
@@ -125,22 +136,26 @@ class AwsService:
     @staticmethod
     def get_session(role_arn=None, sts_client=None):
         """
-        Created a session for the specified role
+        Returns a (pooled) session for the specified role
         :param role_arn: Role arn
         :param sts_client: Optional sts client, if not specified a (cache) sts client instance is used
         :return: Session for the specified role
         """
 
         if role_arn is not None:
-            sts = sts_client if sts_client is not None else boto3.client("sts")
-            account = AwsService.account_from_role_arn(role_arn)
-            token = sts.assume_role(RoleArn=role_arn, RoleSessionName="{}-{}".format(account, str(uuid.uuid4())))
-            credentials = token["Credentials"]
-            return boto3.Session(aws_access_key_id=credentials["AccessKeyId"],
-                                 aws_secret_access_key=credentials["SecretAccessKey"],
-                                 aws_session_token=credentials["SessionToken"])
+
+            # credentials are reused until shortly before they expire, the pool replaces the session when they are refreshed
+            credentials = credentials_cache.get_credentials(role_arn=role_arn, sts_client=sts_client)
+
+            def assume_role_session():
+                return boto3.Session(aws_access_key_id=credentials[credentials_cache.CREDENTIALS_ACCESS_KEY],
+                                     aws_secret_access_key=credentials[credentials_cache.CREDENTIALS_SECRET_KEY],
+                                     aws_session_token=credentials[credentials_cache.CREDENTIALS_TOKEN])
+
+            return client_pool.get_session(role_arn=role_arn, session_factory=assume_role_session,
+                                           credentials_id=credentials[credentials_cache.CREDENTIALS_ACCESS_KEY])
         else:
-            return boto3.Session()
+            return client_pool.get_session()
 
     @property
     def session(self):
@@ -149,10 +164,13 @@ class AwsService:
         default boto3 session is used
         :return: Session
         """
-        if self._session is None:
-            self._session = AwsService.get_session(role_arn=self.role_arn,
-                                                   sts_client=self.sts_client if self.role_arn is not None else None)
-        return self._session
+        with self._lock:
+            # sessions that were not passed to the instance are taken from the pool every time as pooled sessions are replaced
+            # before the credentials of an assumed role expire
+            if self._session is None:
+                return AwsService.get_session(role_arn=self.role_arn,
+                                              sts_client=self.sts_client if self.role_arn is not None else None)
+            return self._session
 
     @property
     def sts_client(self):
@@ -161,7 +179,7 @@ class AwsService:
         :return: Sts client
         """
         if self._sts_client is None:
-            self._sts_client = boto3.client("sts")
+            self._sts_client = client_pool.get_client("sts")
         return self._sts_client
 
     def service_regions(self):
@@ -173,30 +191,43 @@ class AwsService:
 
     def service_client(self, region=None, method_names=None):
         """
-        Returns a client for the service using the session/role/region of the service class instance
+        Returns a (cached) client for the service using the session/role/region of the service class instance. Clients for
+        pooled sessions are taken from the client pool and are shared with other instances, for these clients the wrapper methods
+        use the default retry strategy for the service.
         :param region:
         :param method_names: names of function to create wrapper methods for with retry logic
         :return: client for making the call to describe the resources
         """
 
-        if region is None:
-            region = boto3.client(self.service_name).meta.config.region_name
+        with self._lock:
 
-        if self._service_client is None or self._service_client.meta.config.region_name != region:
+            session = self.session
+            if client_pool.is_pooled_session(session):
+                return client_pool.get_client(service_name=self.service_name, methods=method_names, region=region,
+                                              session=session,
+                                              context=getattr(self._service_retry_strategy, "_context", None))
 
-            args = {
-                "service_name": self.service_name,
-                "region_name": region
-            }
+            if region is None:
+                if self._default_region is None:
+                    self._default_region = client_pool.get_client(self.service_name).meta.config.region_name
+                region = self._default_region
 
-            self._service_client = self.session.client(**args)
+            client = self._service_clients.get(region)
+            if client is None:
+                args = {
+                    "service_name": self.service_name,
+                    "region_name": region
+                }
+                client = session.client(**args)
+                self._service_clients[region] = client
 
             if self._service_retry_strategy is not None and method_names is not None:
                 for method in method_names:
-                    boto_retry.make_method_with_retries(boto_client_or_resource=self._service_client, name=method,
-                                                        service_retry_strategy=self._service_retry_strategy)
+                    if getattr(client, method + boto_retry.DEFAULT_SUFFIX, None) is None:
+                        boto_retry.make_method_with_retries(boto_client_or_resource=client, name=method,
+                                                            service_retry_strategy=self._service_retry_strategy)
 
-        return self._service_client
+            return client
 
     @staticmethod
     def get_aws_account(sts=None):
@@ -420,6 +451,19 @@ class AwsService:
         """
         return resource.get("Tags", [])
 
+    def _get_tags_for_resources(self, client, resources, resource_name):
+        """
+        Returns the tags for a page of resources that require additional boto calls to retrieve their tags. The default
+        implementation calls _get_tags_for_resource concurrently for the resources, overwrite this method for services that
+        can retrieve the tags for multiple resources in a single call
+        :param client: Client that can be used to make the boto call to retrieve the tags
+        :param resources: The resources for which to retrieve the tags
+        :param resource_name: Name of the resource type
+        :return: List with the tags for every resource, in the same order as the resources
+        """
+        return WorkerPool(max_workers=self._tags_concurrency).map(
+            lambda r: self._get_tags_for_resource(client, r, resource_name), resources)
+
     def _get_tag_resource(self, resource_name):
         """
         Returns the name of the service/resource specific resource that is used to explicitly retrieve the tags for that
@@ -429,6 +473,26 @@ class AwsService:
         """
         return ""
 
+    def describe_args_for_tag_conditions(self, resource_name, tag_conditions, describe_args):
+        """
+        Translates conditions on the tags of resources into parameters for the describe call, so resources can be filtered by
+        the service. Overwrite in inherited services that support filtering resources by tags
+        :param resource_name: Name of the resource type
+        :param tag_conditions: List of TagCondition items (see util/tag_filter_pushdown.py)
+        :param describe_args: Parameters for the describe call
+        :return: Parameters for the describe call including the filters for the conditions, None if the conditions can not be
+        evaluated by the service
+        """
+        return None
+
+    def _requires_tag_calls(self, resource_name):
+        """
+        Tests if the tags for a resource type must be retrieved with additional boto calls
+        :param resource_name: Name of the resource type
+        :return: True if tags must be retrieved with additional calls
+        """
+        return resource_name in self.resources_with_tags and bool(self._get_tag_resource(resource_name))
+
     def _transform_returned_resource(self, client, resource, resource_name, tags, tags_as_dict, use_tuple, **kwargs):
         """
         This method takes the resource from the boto "describe" method and transforms them into the requested
@@ -500,14 +564,23 @@ class AwsService:
             function_args = self._map_describe_function_parameters(resource_name, describe_args)
 
         # get method from boto service client
-        client = self.service_client(region=region, method_names=[describe_func_name])
+        client = self.service_client(region=region)
         describe_func = getattr(client, describe_func_name, None)
         if describe_func is None:
             raise ValueError(ERR_NO_BOTO_SERVICE_METHOD.format(self.service_name, describe_func_name))
 
-        # use the method with retry logic if a retry strategy was used
+        # use the retry logic of the service instance if a retry strategy was used, the client may be shared with other instances
         if self._service_retry_strategy is not None:
-            describe_func = getattr(client, describe_func_name + boto_retry.DEFAULT_SUFFIX)
+            # calls are limited by the same limiter as the calls of pooled clients for the account of the role
+            account = AwsService.account_from_role_arn(self.role_arn) if self.role_arn is not None else None
+            limiter = rate_limiter.get_rate_limiter(service=self.service_name, api=describe_func_name, account=account,
+                                                    region=client.meta.region_name)
+
+            def describe_func(**call_args):
+                return self._service_retry_strategy.call(client, describe_func_name, call_args, rate_limiter=limiter)
+
+        # tags that require additional calls are retrieved for all resources of a page before the resources are transformed
+        prefetch_tags = tags and self._requires_tag_calls(resource_name)
 
         done = False
         while not done:
@@ -515,17 +588,24 @@ class AwsService:
             # call boto method to retrieve until no more resources are retrieved
             resp = describe_func(**function_args)
 
-            # extract resources from result and transform to requested output format
-            for obj in self._extract_resources(resourcename=resource_name, resp=resp, select=select):
+            # extract resources from result
+            page = self._extract_resources(resourcename=resource_name, resp=resp, select=select)
+            for obj in page:
                 # annotate with additional account and region attributes
                 obj["AwsAccount"] = self.aws_account
-                obj["Region"] = self.service_client(region).meta.region_name if self.is_regional() else None
+                obj["Region"] = client.meta.region_name if self.is_regional() else None
+
+            if prefetch_tags and len(page) > 0:
+                for obj, obj_tags in zip(page, self._get_tags_for_resources(client, page, resource_name)):
+                    obj["Tags"] = obj_tags
 
+            # transform to requested output format
+            for obj in page:
                 # yield the transformed resource
-                yield self._transform_returned_resource(self.service_client(region=region),
+                yield self._transform_returned_resource(client,
                                                         resource=obj,
                                                         resource_name=resource_name,
-                                                        tags=tags,
+                                                        tags=tags and not prefetch_tags,
                                                         tags_as_dict=tags_as_dictionary(),
                                                         use_tuple=use_tuple(),
                                                         kwargs=describe_args)
@@ -230,6 +230,9 @@ RESOURCE_NAMES = [
     VPN_CONNECTIONS,
     VPN_GATEWAYS]
 
+# name of parameter for filters in describe calls
+FILTERS = "Filters"
+
 RESOURCES_WITH_TAGS = [
     CUSTOMER_GATEWAYS,
     DHCP_OPTIONS,
@@ -302,6 +305,29 @@ class Ec2Service(AwsService):
         return AwsService._transform_returned_resource(self, client, temp, resource_name=resource_name, tags_as_dict=tags_as_dict,
                                                        use_tuple=use_tuple, **kwargs)
 
+    def describe_args_for_tag_conditions(self, resource_name, tag_conditions, describe_args):
+        """
+        Translates conditions on the tags of resources into tag:<name> and tag-key filters for the describe call
+        :param resource_name: Name of the resource type
+        :param tag_conditions: List of TagCondition items (see util/tag_filter_pushdown.py)
+        :param describe_args: Parameters for the describe call
+        :return: Parameters for the describe call including the filters for the conditions, None if the resource does not
+        support tags
+        """
+        if len(tag_conditions) == 0 or self._resource_name(resource_name) not in RESOURCES_WITH_TAGS:
+            return None
+
+        args = dict(describe_args)
+        # filters are combined with filters that are already in the parameters, multiple filters must all match
+        filters = list(args.get(FILTERS, []))
+        for condition in tag_conditions:
+            filters.append({
+                "Name": "tag-key" if condition.key is None else "tag:{}".format(condition.key),
+                "Values": list(condition.values)
+            })
+        args[FILTERS] = filters
+        return args
+
     def _get_tags_for_resource(self, client, resource, resource_name):
         """
         Returns the tags for specific resources that require additional boto calls to retrieve their tags.
@@ -0,0 +1,66 @@
+"""
+Measures the cost of the CronExpression calls made by the scheduler for every task on every tick.
+
+Usage: python tests/benchmark_cron_expression.py [number of expressions]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from scheduling.cron_expression import CronExpression
+
+EXPRESSION_TEMPLATES = [
+    "{m} {h} * * ?",
+    "{m} {h} * * 1-5",
+    "{m} {h} L * ?",
+    "{m} {h} 15W * ?",
+    "{m} {h} * * mon#2",
+    "{m} {h} * * friL",
+    "{m} 0/{i} * * ?",
+    "0/{i} * * * ?",
+    "{m} {h} 1,15 * ?",
+    "{m} {h} 1 1/3 ?"
+]
+
+
+def build_expressions(count):
+    random.seed(0)
+    return [random.choice(EXPRESSION_TEMPLATES).format(m=random.randint(0, 59), h=random.randint(0, 23), i=random.randint(2, 12))
+            for _ in range(count)]
+
+
+def measure(name, expressions, fn, reuse=False):
+    # with reuse the calls are made on expressions that have already been used, which excludes the cost of parsing them
+    crons = [CronExpression(expression=e) for e in expressions] if reuse else None
+    if reuse:
+        for c in crons:
+            fn(c)
+
+    start = time.time()
+    for i, e in enumerate(expressions):
+        fn(crons[i] if reuse else CronExpression(expression=e))
+    elapsed = time.time() - start
+    print("{:<40}{:>10.1f} us/call{:>10.2f} s total".format(name + (" (reused)" if reuse else ""),
+                                                           elapsed * 1000000 / len(expressions), elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    expressions = build_expressions(count)
+    now = datetime.now(tz=pytz.timezone("UTC")).replace(second=0, microsecond=0)
+    last_run = now - timedelta(minutes=5)
+
+    print("{} expressions".format(count))
+    for reuse in [False, True]:
+        measure("first_within_next(24h)", expressions, lambda c: c.first_within_next(timedelta(hours=24), now), reuse)
+        measure("last_since(5 minutes ago)", expressions, lambda c: c.last_since(last_run, now), reuse)
+        measure("first_within_next(31d)", expressions, lambda c: c.first_within_next(timedelta(days=31), now), reuse)
+        measure("last_within_last(31d)", expressions, lambda c: c.last_within_last(timedelta(days=31), now), reuse)
+        measure("match", expressions, lambda c: c.match(now), reuse)
+
+
+if __name__ == "__main__":
+    main()
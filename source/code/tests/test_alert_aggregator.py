@@ -0,0 +1,121 @@
+import unittest
+
+from util.alert_aggregator import AlertAggregator, fingerprint
+
+SOURCE = ("group", "stream")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1500000000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAlertAggregator(unittest.TestCase):
+    def test_fingerprint(self):
+        self.assertEquals(fingerprint("Error", "Volume vol-0a1b2c failed after 3 attempts"),
+                          fingerprint("Error", "Volume vol-9f8e7d failed after 12 attempts"))
+        self.assertNotEquals(fingerprint("Error", "Volume failed"), fingerprint("Warning", "Volume failed"))
+        # messages logged with the same generic format string are different alerts
+        self.assertNotEquals(fingerprint("Error", "Access denied for role"), fingerprint("Error", "Stack does not exist"))
+
+    def test_digest(self):
+        published = []
+        aggregator = AlertAggregator(lambda t, m: published.append((t, m)), background=False)
+        for i in range(0, 3000):
+            aggregator.add("topic", "Error", fingerprint("Error", "Error {}"), "Error {}".format(i), SOURCE)
+        aggregator.add("topic", "Warning", fingerprint("Warning", "Warning"), "Warning", SOURCE)
+        self.assertEquals(aggregator.pending_count(), 3001)
+
+        aggregator.flush()
+        self.assertEquals(len(published), 1)
+        self.assertEquals(published[0][0], "topic")
+        self.assertTrue(published[0][1].startswith("3001 alert(s), 2 distinct, 2999 suppressed"))
+        self.assertTrue("Error (3000 x)" in published[0][1])
+        self.assertTrue("Error 0\n" in published[0][1])
+        self.assertTrue("Warning (1 x)" in published[0][1])
+        self.assertEquals(aggregator.pending_count(), 0)
+
+    def test_window(self):
+        published = []
+        clock = Clock()
+        aggregator = AlertAggregator(lambda t, m: published.append(m), window=10, clock=clock, background=False)
+
+        # first alert is published immediately
+        aggregator.add("topic", "Error", "fp", "Error", SOURCE)
+        self.assertEquals(len(aggregator.due_digests()), 1)
+
+        # alerts within the window after a digest are collected until the window has passed
+        clock.now += 1
+        aggregator.add("topic", "Error", "fp", "Error", SOURCE)
+        aggregator.add("topic", "Error", "fp", "Error", SOURCE)
+        clock.now += 9
+        self.assertEquals(aggregator.due_digests(), [])
+        clock.now += 1
+        digests = aggregator.due_digests()
+        self.assertEquals(len(digests), 1)
+        self.assertTrue(digests[0][1].startswith("2 alert(s), 1 distinct, 1 suppressed"))
+
+    def test_rate_limit(self):
+        published = []
+        clock = Clock()
+        aggregator = AlertAggregator(lambda t, m: published.append(m), window=10, max_digests_per_minute=2, clock=clock,
+                                     background=False)
+
+        for i in range(0, 2):
+            aggregator.add("topic", "Error", "fp", "Error {}".format(i), SOURCE)
+            clock.now += 10
+            self.assertEquals(len(aggregator.due_digests()), 1)
+
+        # digest exceeding the rate stays pending until the rate allows a new digest
+        aggregator.add("topic", "Error", "fp", "Error 2\nDetails", SOURCE)
+        clock.now += 10
+        self.assertEquals(aggregator.due_digests(), [])
+        self.assertEquals(aggregator.pending_count(), 1)
+
+        # also when flushed
+        aggregator.flush()
+        self.assertEquals(published, [])
+        self.assertEquals(aggregator.pending_count(), 1)
+
+        # published with all collected alerts when the rate allows a new digest
+        aggregator.add("topic", "Error", "fp", "Error 3", SOURCE)
+        clock.now += 20
+        aggregator.flush()
+        self.assertEquals(aggregator.pending_count(), 0)
+        self.assertEquals(len(published), 1)
+        self.assertTrue(published[0].startswith("2 alert(s), 1 distinct, 1 suppressed"))
+        self.assertTrue("Error 2\nDetails" in published[0])
+
+    def test_flush_rate_limit(self):
+        published = []
+        clock = Clock()
+        aggregator = AlertAggregator(lambda t, m: published.append(t), window=10, max_digests_per_minute=6, clock=clock,
+                                     background=False)
+
+        # a flush for every failing item or invocation does not exceed the max number of digests per minute
+        for i in range(0, 120):
+            aggregator.add("topic", "Error", "fp", "Error {}".format(i), SOURCE)
+            aggregator.add("other", "Error", "fp", "Error {}".format(i), SOURCE)
+            aggregator.flush()
+            clock.now += 1
+        # the initial 6 digests and 1 digest for every 10 seconds in the remaining 119 seconds
+        self.assertEquals(published.count("topic"), 17)
+        self.assertEquals(published.count("other"), 17)
+        # alerts after the last digest stay pending
+        self.assertTrue(aggregator.pending_count() > 0)
+
+        clock.now += 60
+        aggregator.flush()
+        self.assertEquals(aggregator.pending_count(), 0)
+
+    def test_publish_error(self):
+        def fail(t, m):
+            raise ValueError("failed")
+
+        aggregator = AlertAggregator(fail, background=False)
+        aggregator.add("topic", "Error", "fp", "Error", SOURCE)
+        aggregator.flush()
+        self.assertEquals(aggregator.pending_count(), 0)
@@ -0,0 +1,114 @@
+import unittest
+from datetime import datetime
+
+from scheduling.cron_expression import CronExpression
+
+
+class TestCronExpression(unittest.TestCase):
+    def matches(self, expression, start, end):
+        # matches in the period from start (excluding) until end (including), searched forwards and backwards
+        forwards = [m.replace(tzinfo=None) for m in CronExpression(expression).until(end, start, earliest_first=True)]
+        backwards = [m.replace(tzinfo=None) for m in CronExpression(expression).until(end, start, earliest_first=False)]
+        self.assertEquals(backwards, list(reversed(forwards)))
+        return forwards
+
+    def test_period(self):
+        # start of the period is excluded, end of the period is included
+        self.assertEquals(self.matches("0 12 * * ?", datetime(2017, 1, 1, 12, 0), datetime(2017, 1, 3, 12, 0)),
+                          [datetime(2017, 1, 2, 12, 0), datetime(2017, 1, 3, 12, 0)])
+        self.assertEquals(self.matches("0 12 * * ?", datetime(2017, 1, 1, 12, 1), datetime(2017, 1, 2, 11, 59)), [])
+
+    def test_last_day_of_month(self):
+        self.assertEquals(self.matches("0 12 L * ?", datetime(2016, 1, 15), datetime(2016, 5, 1)),
+                          [datetime(2016, 1, 31, 12, 0),
+                           datetime(2016, 2, 29, 12, 0),
+                           datetime(2016, 3, 31, 12, 0),
+                           datetime(2016, 4, 30, 12, 0)])
+        self.assertEquals(self.matches("0 12 L * ?", datetime(2017, 1, 15), datetime(2017, 5, 1)),
+                          [datetime(2017, 1, 31, 12, 0),
+                           datetime(2017, 2, 28, 12, 0),
+                           datetime(2017, 3, 31, 12, 0),
+                           datetime(2017, 4, 30, 12, 0)])
+
+    def test_nearest_weekday(self):
+        # 15 Jan and 15 Oct 2017 are sundays, 15 Jul 2017 is a saturday
+        self.assertEquals([m.date() for m in self.matches("30 8 15W * ?", datetime(2017, 1, 1), datetime(2017, 11, 1))],
+                          [datetime(2017, 1, 16).date(),
+                           datetime(2017, 2, 15).date(),
+                           datetime(2017, 3, 15).date(),
+                           datetime(2017, 4, 14).date(),
+                           datetime(2017, 5, 15).date(),
+                           datetime(2017, 6, 15).date(),
+                           datetime(2017, 7, 14).date(),
+                           datetime(2017, 8, 15).date(),
+                           datetime(2017, 9, 15).date(),
+                           datetime(2017, 10, 16).date()])
+
+        # nearest weekday does not move into the previous month, 1 Apr and 1 Jul 2017 are saturdays
+        self.assertEquals(self.matches("0 0 1W 4,7 ?", datetime(2017, 3, 1), datetime(2017, 8, 1)),
+                          [datetime(2017, 4, 3), datetime(2017, 7, 3)])
+
+    def test_nth_weekday(self):
+        # second friday
+        self.assertEquals(self.matches("0 9 ? * 4#2", datetime(2017, 1, 1), datetime(2017, 4, 1)),
+                          [datetime(2017, 1, 13, 9, 0), datetime(2017, 2, 10, 9, 0), datetime(2017, 3, 10, 9, 0)])
+
+        # fifth tuesday only matches in months with five tuesdays
+        self.assertEquals(self.matches("0 0 ? * 1#5", datetime(2017, 1, 1), datetime(2018, 1, 1)),
+                          [datetime(2017, 1, 31), datetime(2017, 5, 30), datetime(2017, 8, 29), datetime(2017, 10, 31)])
+
+    def test_last_weekday(self):
+        # last sunday
+        self.assertEquals(self.matches("0 9 ? * 6L", datetime(2017, 1, 1), datetime(2017, 4, 1)),
+                          [datetime(2017, 1, 29, 9, 0), datetime(2017, 2, 26, 9, 0), datetime(2017, 3, 26, 9, 0)])
+
+    def test_step_ranges(self):
+        self.assertEquals(self.matches("5 10-14/2 1-10/3 * ?", datetime(2017, 5, 31), datetime(2017, 6, 5)),
+                          [datetime(2017, 6, 1, 10, 5),
+                           datetime(2017, 6, 1, 12, 5),
+                           datetime(2017, 6, 1, 14, 5),
+                           datetime(2017, 6, 4, 10, 5),
+                           datetime(2017, 6, 4, 12, 5),
+                           datetime(2017, 6, 4, 14, 5)])
+
+        self.assertEquals(self.matches("0/20 0/6 * * ?", datetime(2017, 12, 31, 17, 59), datetime(2018, 1, 1, 0, 20)),
+                          [datetime(2017, 12, 31, 18, 0),
+                           datetime(2017, 12, 31, 18, 20),
+                           datetime(2017, 12, 31, 18, 40),
+                           datetime(2018, 1, 1, 0, 0),
+                           datetime(2018, 1, 1, 0, 20)])
+
+    def test_month_boundaries(self):
+        self.assertEquals(self.matches("59 23 L * ?", datetime(2017, 1, 31, 23, 58), datetime(2017, 3, 1, 0, 0)),
+                          [datetime(2017, 1, 31, 23, 59), datetime(2017, 2, 28, 23, 59)])
+
+        # days that do not exist in a month are skipped
+        self.assertEquals(self.matches("0 0 31 * ?", datetime(2017, 1, 1), datetime(2017, 9, 1)),
+                          [datetime(2017, 1, 31), datetime(2017, 3, 31), datetime(2017, 5, 31), datetime(2017, 7, 31),
+                           datetime(2017, 8, 31)])
+
+    def test_year_boundaries(self):
+        self.assertEquals(self.matches("0 0 1 1 ?", datetime(2016, 1, 1), datetime(2018, 1, 1)),
+                          [datetime(2017, 1, 1), datetime(2018, 1, 1)])
+
+        self.assertEquals(self.matches("59 23 L 12 ?", datetime(2015, 12, 31, 23, 59), datetime(2017, 12, 31, 23, 58)),
+                          [datetime(2016, 12, 31, 23, 59)])
+
+    def test_next_year_first_month(self):
+        # searching forwards from a month after the last month in the set continues in the first month of the set in the
+        # next year, these months were skipped before
+        self.assertEquals(self.matches("0 6 * 1,6 0", datetime(2016, 12, 31), datetime(2017, 1, 3)),
+                          [datetime(2017, 1, 2, 6, 0)])
+
+        self.assertEquals(CronExpression("45 1 * 3/4 mon-fri").first_until(datetime(2018, 1, 1), datetime(2016, 12, 31)).replace(
+            tzinfo=None), datetime(2017, 3, 1, 1, 45))
+
+        self.assertEquals([m.month for m in self.matches("0 0 1 feb-mar ?", datetime(2016, 11, 30), datetime(2018, 4, 1))],
+                          [2, 3, 2, 3])
+
+    def test_leap_year(self):
+        self.assertEquals(self.matches("0 0 29 2 ?", datetime(2015, 1, 1), datetime(2021, 1, 1)),
+                          [datetime(2016, 2, 29), datetime(2020, 2, 29)])
+
+        self.assertEquals(self.matches("0 0 L 2 ?", datetime(2015, 3, 1), datetime(2017, 3, 1)),
+                          [datetime(2016, 2, 29), datetime(2017, 2, 28)])
@@ -0,0 +1,141 @@
+import threading
+import time
+import unittest
+
+from util.rate_limiter import AdaptiveRateLimiter, get_rate_limiter, is_throttling_error, MAX_BURST, MIN_RATE
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1500000000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ServiceError(Exception):
+    def __init__(self, code, status=400):
+        Exception.__init__(self, code)
+        self.response = {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_is_throttling_error(self):
+        self.assertTrue(is_throttling_error(ServiceError("Throttling")))
+        self.assertTrue(is_throttling_error(ServiceError("RequestLimitExceeded", 503)))
+        self.assertTrue(is_throttling_error(ServiceError("Other", 429)))
+        self.assertFalse(is_throttling_error(ServiceError("InvalidParameterValue")))
+        self.assertFalse(is_throttling_error(ValueError("Throttling")))
+
+    def test_not_limited_until_throttled(self):
+        clock = Clock()
+        limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+        for _ in range(0, 100):
+            self.assertEquals(limiter.acquire(), 0)
+            limiter.succeeded()
+        self.assertIsNone(limiter.rate)
+
+    def test_first_throttle_and_cooldown(self):
+        clock = Clock()
+        limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+
+        # 20 calls per second for 2 seconds, then throttled
+        for _ in range(0, 40):
+            limiter.acquire()
+            clock.now += 0.05
+        limiter.throttled()
+        self.assertAlmostEqual(limiter.rate, 14.0, places=3)
+
+        # throttles caused by the same burst do not decrease the rate again
+        clock.now += 0.5
+        limiter.throttled()
+        self.assertAlmostEqual(limiter.rate, 14.0, places=3)
+
+        # but later throttles do, not below the min rate
+        clock.now += 1
+        limiter.throttled()
+        self.assertAlmostEqual(limiter.rate, 9.8, places=3)
+        for _ in range(0, 20):
+            clock.now += 1
+            limiter.throttled()
+        self.assertEquals(limiter.rate, MIN_RATE)
+
+    def test_additive_increase(self):
+        clock = Clock()
+        limiter = AdaptiveRateLimiter(min_rate=10, max_rate=20, clock=clock, sleep=clock.sleep)
+        limiter.throttled()
+        self.assertEquals(limiter.rate, 10)
+
+        clock.now += 2
+        limiter.succeeded()
+        self.assertAlmostEqual(limiter.rate, 12.0, places=3)
+
+        # limit is no longer applied when the rate reaches the max rate
+        clock.now += 10
+        limiter.succeeded()
+        self.assertIsNone(limiter.rate)
+
+    def test_waiting(self):
+        clock = Clock()
+        limiter = AdaptiveRateLimiter(min_rate=10, clock=clock, sleep=clock.sleep)
+        limiter.throttled()
+
+        # calls wait for a token
+        start = clock.now
+        for _ in range(0, 20):
+            limiter.acquire()
+        self.assertAlmostEqual(clock.now - start, 2.0, places=3)
+
+        # burst of calls after a period without calls is limited
+        clock.now += 60
+        start = clock.now
+        for _ in range(0, MAX_BURST + 10):
+            limiter.acquire()
+        self.assertAlmostEqual(clock.now - start, 1.0, places=3)
+
+    def test_waiting_calls_do_not_take_tokens_in_advance(self):
+        clock = Clock()
+        stolen = []
+
+        def sleep(seconds):
+            clock.sleep(seconds)
+            # another call takes the token while this call is waiting
+            if len(stolen) == 0:
+                stolen.append(limiter.acquire())
+
+        limiter = AdaptiveRateLimiter(min_rate=10, clock=clock, sleep=sleep)
+        limiter.throttled()
+        start = clock.now
+        limiter.acquire()
+        self.assertAlmostEqual(clock.now - start, 0.2, places=3)
+
+    def test_concurrent_waiting_calls(self):
+        limiter = AdaptiveRateLimiter(min_rate=20)
+        limiter.throttled()
+        calls = []
+
+        def call():
+            limiter.acquire()
+            calls.append(time.time())
+
+        start = time.time()
+        threads = [threading.Thread(target=call) for _ in range(0, 20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # calls are spread over a second instead of continuing all at once after waiting
+        calls = sorted(calls)
+        self.assertTrue(calls[-1] - start >= 0.9)
+        for i in range(0, len(calls) - 5):
+            self.assertTrue(calls[i + 5] - calls[i] >= 0.2)
+
+    def test_shared_limiters(self):
+        self.assertIs(get_rate_limiter("ec2", "describe_instances", "111111111111", "us-east-1"),
+                      get_rate_limiter("ec2", "describe_instances", "111111111111", "us-east-1"))
+        self.assertIsNot(get_rate_limiter("ec2", "describe_instances", "111111111111", "us-east-1"),
+                         get_rate_limiter("ec2", "describe_instances", "111111111111", "us-west-2"))
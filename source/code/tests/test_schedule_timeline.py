@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime, timedelta
+
+from scheduling.schedule_timeline import ScheduleTimeline
+
+START = datetime(2017, 1, 1)
+
+
+def next_fire(schedule, dt, timespan):
+    # schedules are (interval in minutes, offset in minutes) for tasks firing at START + offset + n * interval
+    interval, offset = schedule
+    minutes = int((dt - START).total_seconds() // 60) - offset
+    fire_dt = START + timedelta(minutes=offset + (minutes // interval + 1) * interval)
+    return fire_dt if fire_dt <= dt + timespan else None
+
+
+def fires_between(schedule, start_dt, end_dt):
+    fire_dt = next_fire(schedule, start_dt, end_dt - start_dt)
+    return fire_dt is not None
+
+
+class TestScheduleTimeline(unittest.TestCase):
+    def test_fire(self):
+        timeline = ScheduleTimeline(next_fire)
+        timeline.update_tasks({"a": (5, 0), "b": (7, 1), "c": (60, 30)}, START)
+        self.assertEquals(timeline.first(), (START + timedelta(minutes=1), "b"))
+        self.assertEquals(timeline.fire(START), [])
+        self.assertEquals(timeline.fire(START + timedelta(minutes=4)), ["b"])
+        self.assertEquals(timeline.fire(START + timedelta(minutes=5)), ["a"])
+        self.assertEquals(timeline.first(), (START + timedelta(minutes=8), "b"))
+        self.assertEquals(timeline.next_fire("a"), START + timedelta(minutes=10))
+        self.assertEquals(timeline.next_fire("x"), None)
+        self.assertEquals(timeline.first(until=START + timedelta(minutes=7)), None)
+
+        # same tasks as testing all schedules every minute
+        dt = START + timedelta(minutes=5)
+        for _ in range(0, 300):
+            end_dt = dt + timedelta(minutes=1)
+            expected = sorted([n for n, s in [("a", (5, 0)), ("b", (7, 1)), ("c", (60, 30))] if fires_between(s, dt, end_dt)])
+            self.assertEquals(sorted(timeline.fire(end_dt)), expected)
+            dt = end_dt
+
+    def test_missed_fires_are_returned_once(self):
+        timeline = ScheduleTimeline(next_fire)
+        timeline.update_tasks({"a": (5, 0)}, START)
+        self.assertEquals(timeline.fire(START + timedelta(minutes=30)), ["a"])
+        self.assertEquals(timeline.next_fire("a"), START + timedelta(minutes=35))
+
+    def test_update_tasks(self):
+        timeline = ScheduleTimeline(next_fire)
+        self.assertEquals(sorted(timeline.update_tasks({"a": (5, 0), "b": (7, 0)}, START)), ["a", "b"])
+        self.assertEquals(timeline.update_tasks({"a": (5, 0), "b": (7, 0)}, START), [])
+        self.assertEquals(timeline.update_tasks({"a": (3, 0)}, START), ["a"])
+        self.assertEquals(timeline.first(), (START + timedelta(minutes=3), "a"))
+        self.assertEquals(timeline.fire(START + timedelta(minutes=7)), ["a"])
+        # removed and added again
+        timeline.update_tasks({}, START)
+        self.assertEquals(timeline.first(), None)
+        timeline.update_tasks({"a": (3, 0)}, START + timedelta(minutes=7))
+        self.assertEquals(timeline.first(), (START + timedelta(minutes=9), "a"))
+
+    def test_tasks_beyond_horizon(self):
+        timeline = ScheduleTimeline(next_fire, horizon=timedelta(minutes=10))
+        timeline.update_tasks({"a": (25, 0), "b": (100, 0)}, START)
+        self.assertEquals(timeline.next_fire("a"), None)
+        self.assertEquals(timeline.first(until=START + timedelta(minutes=20)), None)
+        self.assertEquals(timeline.first(), (START + timedelta(minutes=25), "a"))
+        self.assertEquals(timeline.fire(START + timedelta(minutes=99)), ["a"])
+        self.assertEquals(sorted(timeline.fire(START + timedelta(minutes=100))), ["a", "b"])
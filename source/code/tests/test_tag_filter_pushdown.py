@@ -0,0 +1,47 @@
+import fnmatch
+import unittest
+
+from util.tag_filter_pushdown import TagCondition, plan_for_tag_filter, plan_for_task_tag
+from util.tag_filter_set import TagFilterSet
+
+
+def matches_conditions(conditions, tags):
+    # evaluates the conditions the way a service evaluates filters, all conditions must match
+    for c in conditions:
+        if c.key is None:
+            if not any([fnmatch.fnmatchcase(k, v) for k in tags for v in c.values]):
+                return False
+        elif c.key not in tags or not any([fnmatch.fnmatchcase(tags[c.key], v) for v in c.values]):
+            return False
+    return True
+
+
+class TestTagFilterPushdown(unittest.TestCase):
+    def test_task_tag(self):
+        self.assertEquals(plan_for_task_tag("Tasks", "backup"), [TagCondition(key="Tasks", values=["*backup*"])])
+        self.assertEquals(plan_for_task_tag("Tasks", "a\\b"), [TagCondition(key=None, values=["Tasks"])])
+        self.assertEquals(plan_for_task_tag("Ta*", "backup"), [])
+
+    def test_tag_filter(self):
+        self.assertEquals(plan_for_tag_filter(None), [])
+        self.assertEquals(plan_for_tag_filter("*"), [])
+        self.assertEquals(plan_for_tag_filter("Name"), [TagCondition(key=None, values=["Name"])])
+        self.assertEquals(plan_for_tag_filter("Name,Env*"), [TagCondition(key=None, values=["Env*", "Name"])])
+        self.assertEquals(plan_for_tag_filter("Env=prod,Env=test*"), [TagCondition(key="Env", values=["prod", "test*"])])
+        self.assertEquals(plan_for_tag_filter("Env=prod,Name=web"), [TagCondition(key=None, values=["Env", "Name"])])
+        self.assertEquals(plan_for_tag_filter("Env=\\prod.*"), [TagCondition(key=None, values=["Env"])])
+        self.assertEquals(plan_for_tag_filter("\\En.*=prod"), [])
+
+    def test_conditions_select_all_matching_resources(self):
+        tag_sets = [{}, {"Env": "prod"}, {"Env": "test-1"}, {"Name": "web"}, {"Environment": "production", "Name": ""},
+                    {"Env": "acceptance", "Owner": "me"}]
+        filters = ["Env", "Env=prod", "Env=prod,Env=test*", "Env*", "*ner", "Env=*prod*,Name=web", "Env=\\pr.*", "Name="]
+        for tag_filter in filters:
+            conditions = plan_for_tag_filter(tag_filter)
+            for tags in tag_sets:
+                if len(TagFilterSet(tag_filter).pairs_matching_any_filter(tags)) > 0:
+                    self.assertTrue(matches_conditions(conditions, tags), "{} {}".format(tag_filter, tags))
+
+        for tags in [{"Tasks": "backup"}, {"Tasks": "cleanup,backup"}, {"Tasks": "backups"}, {"Other": "backup"}]:
+            if "backup" in tags.get("Tasks", "").split(","):
+                self.assertTrue(matches_conditions(plan_for_task_tag("Tasks", "backup"), tags))
@@ -0,0 +1,50 @@
+import unittest
+
+from util.tag_filter_set import TagFilterSet, compile_string_filter, get_tag_filter_set
+
+
+class TestTagFilterSet(unittest.TestCase):
+    def test_match_string(self):
+        f = TagFilterSet("")
+        self.assertTrue(f.match_string("", ""))
+        self.assertTrue(f.match_string(None, None))
+        self.assertFalse(f.match_string("", "a"))
+        self.assertTrue(f.match_string("*", "abc"))
+        self.assertTrue(f.match_string("abc", "abc"))
+        self.assertFalse(f.match_string("abc", "abcd"))
+        self.assertTrue(f.match_string("ab*", "abcd"))
+        self.assertFalse(f.match_string("ab*", "xabcd"))
+        self.assertTrue(f.match_string("*cd", "abcd"))
+        self.assertFalse(f.match_string("*cd", "abcdx"))
+        self.assertTrue(f.match_string("*bc*", "abcd"))
+        self.assertFalse(f.match_string("*bc*", "acbd"))
+        self.assertTrue(f.match_string("\\a.c", "abcd"))
+        self.assertFalse(f.match_string("\\a.c", "xabc"))
+        self.assertFalse(f.match_string("\\a(", "a("))
+
+    def test_compiled_filters_are_cached(self):
+        self.assertIs(compile_string_filter("ab*"), compile_string_filter("ab*"))
+        self.assertIs(get_tag_filter_set("Env=prod,Name"), get_tag_filter_set("Env=prod,Name"))
+        self.assertIsNot(get_tag_filter_set("Env=prod"), get_tag_filter_set("Env=prod", name_val_sep=":"))
+
+    def test_pairs(self):
+        tags = {"Env": "production", "Name": "web", "Owner": ""}
+        self.assertEquals(TagFilterSet("Env=prod*,Name").pairs_matching_any_filter(tags),
+                          {"Env": "production", "Name": "web"})
+        self.assertEquals(TagFilterSet("Owner=").pairs_matching_any_filter(tags), {"Owner": ""})
+        self.assertEquals(TagFilterSet("*=*,\\[EN].*").pairs_matching_all_filters(tags), {"Env": "production", "Name": "web"})
+        self.assertEquals(TagFilterSet("Env=test").pairs_matching_any_filter(tags), {})
+
+    def test_matches_any(self):
+        tag_sets = [{}, {"Env": "prod"}, {"Env": "test-1"}, {"Name": "web"}, {"Environment": "production", "Name": ""}]
+        filters = ["Env", "Env=prod", "Env=prod,Env=test*", "Env*", "*ment", "Env=*prod*,Name=web", "Env=\\pr.*", "Name="]
+        for tag_filter in filters:
+            filter_set = get_tag_filter_set(tag_filter)
+            for tags in tag_sets:
+                self.assertEquals(filter_set.matches_any(tags), len(filter_set.pairs_matching_any_filter(tags)) > 0,
+                                  "{} {}".format(tag_filter, tags))
+
+    def test_strings(self):
+        f = TagFilterSet("a*,*z")
+        self.assertEquals(f.strings_matching_any_filter(["abc", "xyz", "az", "m"]), ["abc", "xyz", "az"])
+        self.assertEquals(f.strings_matching_all_filters(["abc", "xyz", "az", "m"]), ["az"])
@@ -0,0 +1,68 @@
+import threading
+import time
+import unittest
+
+from util.worker_pool import WorkerPool
+
+
+class TestWorkerPool(unittest.TestCase):
+    def test_map(self):
+        # results in order of items
+        self.assertEquals(WorkerPool(max_workers=4).map(lambda x: x * 2, range(0, 20)), [x * 2 for x in range(0, 20)])
+        # single worker
+        self.assertEquals(WorkerPool(max_workers=1).map(lambda x: x * 2, range(0, 5)), [0, 2, 4, 6, 8])
+        # no items
+        self.assertEquals(WorkerPool().map(lambda x: x, []), [])
+
+    def test_map_exceptions(self):
+        def fail_on_odd(x):
+            if x % 2 == 1:
+                raise ValueError(x)
+            return x
+
+        self.assertRaises(ValueError, WorkerPool(max_workers=3).map, fail_on_odd, range(0, 6))
+        results = WorkerPool(max_workers=3).map(fail_on_odd, range(0, 6), return_exceptions=True)
+        self.assertEquals([r for r in results if not isinstance(r, ValueError)], [0, 2, 4])
+        self.assertEquals(len([r for r in results if isinstance(r, ValueError)]), 3)
+
+    def test_stream(self):
+        events = list(WorkerPool(max_workers=3).stream(lambda x: range(0, x), [1, 2, 3, 4]))
+        # one completion event for every item
+        self.assertEquals(sorted([e.item for e in events if e.completed]), [1, 2, 3, 4])
+        # all values for all items
+        for i in [1, 2, 3, 4]:
+            self.assertEquals(sorted([e.value for e in events if e.item == i and not e.completed]), list(range(0, i)))
+        # values of an item are returned before its completion event
+        for i in [1, 2, 3, 4]:
+            item_events = [e for e in events if e.item == i]
+            self.assertTrue(item_events[-1].completed)
+            self.assertTrue(item_events[-1].elapsed >= 0)
+
+    def test_stream_error_isolation(self):
+        def values(x):
+            yield x
+            if x == 2:
+                raise ValueError(x)
+            yield x
+
+        events = list(WorkerPool(max_workers=2).stream(values, [1, 2, 3]))
+        completed = {e.item: e for e in events if e.completed}
+        self.assertIsNone(completed[1].exception)
+        self.assertIsInstance(completed[2].exception, ValueError)
+        self.assertIsNone(completed[3].exception)
+        self.assertEquals(len([e for e in events if e.item == 3 and not e.completed]), 2)
+
+    def test_concurrency(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def work(_):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[0], running[1])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        WorkerPool(max_workers=3).map(work, range(0, 9))
+        self.assertTrue(1 < running[1] <= 3)
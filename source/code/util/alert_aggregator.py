@@ -0,0 +1,225 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import re
+import threading
+import time
+from datetime import datetime
+
+# period in seconds in which alerts for a topic are collected before they are published as a single digest, the first alert
+# for a topic after a period without digests is published immediately. This period must be shorter than the typical execution
+# time of the Lambda functions, so alerts are published before an invocation times out.
+DIGEST_WINDOW = 10
+# max number of digests published to a topic per minute, also when the aggregator is flushed. Digests that exceed the rate stay
+# pending and are published by the background thread or a flush in a later (warm) invocation when the rate allows it
+MAX_DIGESTS_PER_MINUTE = 6
+# max number of distinct alerts in a digest, alerts exceeding this number are only counted as suppressed
+MAX_DIGEST_ALERTS = 50
+# max length of the sample message of an alert in a digest
+MAX_ALERT_MESSAGE_LENGTH = 2048
+# interval in seconds in which the background thread checks for digests to publish
+DIGEST_CHECK_INTERVAL = 1
+
+DIGEST_HEADER = "{} alert(s), {} distinct, {} suppressed, from {} to {}\n"
+DIGEST_ALERT = "\n{} ({} x) Loggroup: {}\nLogstream {}\n{}\n"
+DIGEST_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+ERR_PUBLISHING_DIGEST = "Error publishing alert digest to topic {}, {}"
+
+# numbers, hex ids and uuids in messages, replaced to find similar messages
+_variable_parts = re.compile(r"\b[0-9a-f-]*[0-9][0-9a-f-]*\b", re.IGNORECASE)
+
+
+def fingerprint(level, msg):
+    """
+    Returns the fingerprint of an alert, similar alerts which only differ in numbers and ids have the same fingerprint
+    :param level: Level of the alert
+    :param msg: Formatted message of the alert
+    :return: Fingerprint of the alert
+    """
+    return "{}:{}".format(level, _variable_parts.sub("#", msg))
+
+
+class _TopicDigest:
+    """
+    Alerts collected for a topic that are not published yet
+    """
+
+    def __init__(self, start, due):
+        """
+        Initializes the digest
+        :param start: Time of the first alert in the digest
+        :param due: Time at which the digest must be published
+        """
+        self.start = start
+        self.end = start
+        self.due = due
+        # alerts by fingerprint, items are lists with the level, count, source and message of the first alert
+        self.alerts = {}
+        # fingerprints in order of their first alert
+        self.order = []
+        self.total = 0
+
+
+class AlertAggregator:
+    """
+    Collects alerts and publishes them as digests. Alerts with the same fingerprint are published once with the number of
+    times they occurred. Digests are published by a background thread immediately for the first alert after a period without
+    digests and else when the window for the topic has passed, or by calling flush. Digests exceeding the max number of
+    digests per topic per minute are delayed, also when flushed, and collect the alerts until the rate allows publishing.
+    """
+
+    def __init__(self, publish, window=DIGEST_WINDOW, max_digests_per_minute=MAX_DIGESTS_PER_MINUTE, clock=None,
+                 background=True):
+        """
+        Initializes the aggregator
+        :param publish: Function called with the topic and message to publish a digest
+        :param window: Period in seconds in which alerts are collected before the digest is published
+        :param max_digests_per_minute: Max number of digests published to a topic per minute
+        :param clock: Function returning the current time in seconds, default is time.time
+        :param background: True to publish digests from a background thread, False to publish only when flush is called
+        """
+        self._publish = publish
+        self._window = window
+        self._max_digests_per_minute = max_digests_per_minute
+        self._clock = clock if clock is not None else time.time
+        self._background = background
+        self._thread = None
+        self._lock = threading.Lock()
+        # pending digests by topic
+        self._digests = {}
+        # rate limit per topic, items are lists with the available number of publishes and the time these were calculated
+        self._rates = {}
+        # time of the last published digest by topic
+        self._last_published = {}
+
+    def add(self, topic, level, fp, message, source):
+        """
+        Adds an alert
+        :param topic: Topic to publish the alert to
+        :param level: Level of the alert
+        :param fp: Fingerprint of the alert
+        :param message: Alert message
+        :param source: Tuple with the log group and stream that logged the alert
+        :return:
+        """
+        now = self._clock()
+        with self._lock:
+            digest = self._digests.get(topic)
+            if digest is None:
+                # first alert after a period without digests is published immediately
+                last_published = self._last_published.get(topic)
+                immediate = last_published is None or now - last_published >= self._window
+                digest = _TopicDigest(now, now if immediate else now + self._window)
+                self._digests[topic] = digest
+            digest.end = now
+            digest.total += 1
+
+            alert = digest.alerts.get(fp)
+            if alert is not None:
+                alert[1] += 1
+            elif len(digest.alerts) < MAX_DIGEST_ALERTS:
+                digest.alerts[fp] = [level, 1, source, message[0:MAX_ALERT_MESSAGE_LENGTH]]
+                digest.order.append(fp)
+            # alerts exceeding the max number of distinct alerts are only included in the total count
+
+            if self._background and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._publish_in_background)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _take_publish(self, topic, now):
+        """
+        Takes a publish from the rate limit for a topic
+        :param topic: The topic
+        :param now: Current time
+        :return: True if the digest for the topic can be published
+        """
+        rate = self._rates.setdefault(topic, [float(self._max_digests_per_minute), now])
+        rate[0] = min(float(self._max_digests_per_minute), rate[0] + (now - rate[1]) * self._max_digests_per_minute / 60.0)
+        rate[1] = now
+        if rate[0] < 1:
+            return False
+        rate[0] -= 1
+        return True
+
+    def due_digests(self, force=False):
+        """
+        Removes the digests that can be published from the pending digests
+        :param force: True to include digests for which the window has not passed yet, digests that exceed the rate of digests
+        for their topic are never included
+        :return: List of tuples with the topic and the digest message
+        """
+        now = self._clock()
+        result = []
+        with self._lock:
+            for topic in list(self._digests):
+                digest = self._digests[topic]
+                if not force and now < digest.due:
+                    continue
+                if self._take_publish(topic, now):
+                    del self._digests[topic]
+                    self._last_published[topic] = now
+                    result.append((topic, self._format_digest(digest)))
+        return result
+
+    @staticmethod
+    def _format_digest(digest):
+        """
+        Builds the message for a digest
+        :param digest: The digest
+        :return: Digest message
+        """
+        distinct = len(digest.alerts)
+        lines = [DIGEST_HEADER.format(digest.total, distinct, digest.total - distinct,
+                                      datetime.fromtimestamp(digest.start).strftime(DIGEST_TIME_FORMAT),
+                                      datetime.fromtimestamp(digest.end).strftime(DIGEST_TIME_FORMAT))]
+        for fp in digest.order:
+            level, count, source, message = digest.alerts[fp]
+            lines.append(DIGEST_ALERT.format(level, count, source[0], source[1], message))
+        return "".join(lines)
+
+    def _publish_digests(self, digests):
+        """
+        Publishes digests, errors are printed as alerts can not be logged
+        :param digests: List of tuples with the topic and digest message
+        :return:
+        """
+        for topic, message in digests:
+            try:
+                self._publish(topic, message)
+            except Exception as ex:
+                print(ERR_PUBLISHING_DIGEST.format(topic, ex))
+
+    def _publish_in_background(self):
+        """
+        Publishes the digests for which the window has passed, runs in a daemon thread
+        :return:
+        """
+        while True:
+            time.sleep(DIGEST_CHECK_INTERVAL)
+            self._publish_digests(self.due_digests())
+
+    def flush(self):
+        """
+        Publishes all pending digests that are within the rate of digests for their topic, other digests stay pending
+        :return:
+        """
+        self._publish_digests(self.due_digests(force=True))
+
+    def pending_count(self):
+        """
+        Returns the number of alerts that are not published yet
+        :return: Number of pending alerts
+        """
+        with self._lock:
+            return sum([d.total for d in self._digests.values()])
@@ -12,12 +12,15 @@
 ######################################################################################################################
 
 import os
+import threading
 import time
+import weakref
 from datetime import datetime
 
-import boto3
+from botocore.exceptions import ClientError
 
 from boto_retry import get_client_with_retries
+from util.alert_aggregator import AlertAggregator, fingerprint
 
 LOG_FORMAT = "{:0>4d}-{:0>2d}-{:0>2d} - {:0>2d}:{:0>2d}:{:0>2d}.{:0>3s} - {:7s} : {}"
 
@@ -29,16 +32,129 @@ LOG_LEVEL_ERROR = "ERROR"
 LOG_LEVEL_WARNING = "WARNING"
 LOG_LEVEL_DEBUG = "DEBUG"
 
+# CloudWatch limits for a single put_log_events call
 LOG_MAX_BATCH_SIZE = 1048576
+LOG_MAX_BATCH_COUNT = 10000
 LOG_ENTRY_ADDITIONAL = 26
 
+# interval in seconds in which the buffers of loggers in background flush mode are written to their streams
+BACKGROUND_FLUSH_INTERVAL = 5
+# max number of put_log_events calls for a flush if the sequence token for the stream was not valid
+MAX_PUT_LOG_EVENTS_ATTEMPTS = 3
+
+# number of messages logged as a sample for summarized messages
+SUMMARY_SAMPLE_SIZE = 3
+INFO_SUMMARY = "{} x \"{}\", first {}:\n{}"
+
+# streams that are known to exist and the sequence token for the next put_log_events call for these streams, indexed by log
+# group and stream, kept in module so they are reused by warm Lambda invocations
+_streams_lock = threading.Lock()
+_known_streams = set()
+_sequence_tokens = {}
+# locks by log group and stream that serialize the writes to a stream, which keeps the sequence tokens in order, messages
+# can be added to the buffer of a logger while its previous messages are written
+_stream_write_locks = {}
+
+# loggers flushed by the background thread, loggers that are no longer used are removed from the set automatically
+_background_lock = threading.Lock()
+_background_loggers = weakref.WeakSet()
+_background_thread = None
+
+
+def _publish_alert_digest(topic, message):
+    """
+    Publishes a digest of alerts to a sns topic
+    :param topic: Arn of the topic
+    :param message: Digest message
+    :return:
+    """
+    get_client_with_retries("sns", ["publish"]).publish_with_retries(TopicArn=topic, Message=message)
+
+
+# errors and warnings are published as digests shared by all loggers in the container
+_alerts = AlertAggregator(_publish_alert_digest)
+
+
+class Lazy:
+    """
+    Deferred log message argument, the function is only called if the message is logged
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        """
+        Initializes the argument
+        :param func: Function that returns the value of the argument
+        :param args: Positional arguments for the function
+        :param kwargs: Keyword arguments for the function
+        """
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+
+    def value(self):
+        """
+        Returns the value of the argument
+        :return: Value returned by the function
+        """
+        return self._func(*self._args, **self._kwargs)
+
+
+def _format_message(msg, args):
+    """
+    Formats a message, deferred arguments are evaluated
+    :param msg: Message format string
+    :param args: Message arguments
+    :return: Formatted message
+    """
+    if len(args) == 0:
+        return msg
+    return msg.format(*[a.value() if isinstance(a, Lazy) else a for a in args])
+
+
+def _flush_background_loggers():
+    """
+    Flushes the loggers in background flush mode every BACKGROUND_FLUSH_INTERVAL seconds, runs in a daemon thread
+    :return:
+    """
+    while True:
+        time.sleep(BACKGROUND_FLUSH_INTERVAL)
+        with _background_lock:
+            loggers = list(_background_loggers)
+        for logger in loggers:
+            logger._flush_buffer()
+
+
+def _add_background_logger(logger):
+    """
+    Adds a logger to the loggers flushed by the background thread, the thread is started for the first logger
+    :param logger: The logger
+    :return:
+    """
+    global _background_thread
+    with _background_lock:
+        _background_loggers.add(logger)
+        if _background_thread is None or not _background_thread.is_alive():
+            _background_thread = threading.Thread(target=_flush_background_loggers)
+            _background_thread.daemon = True
+            _background_thread.start()
+
 
 class Logger:
     """
     Wrapper class for CloudWatch logging with buffering and helper methods
     """
 
-    def __init__(self, logstream, context, loggroup=None, buffersize=10, debug=False):
+    def __init__(self, logstream, context, loggroup=None, buffersize=10, debug=False, background_flush=False):
+        """
+        Initializes the logger
+        :param logstream: Name of the log stream
+        :param context: Lambda context, if None messages are printed
+        :param loggroup: Name of the log group, if None the group from the environment or the Lambda context is used
+        :param buffersize: Number of buffered messages that are written to the stream in a single call
+        :param debug: True to log debug messages
+        :param background_flush: True to buffer messages up to the CloudWatch limits and write them to the stream from a
+        background thread every BACKGROUND_FLUSH_INTERVAL seconds instead of every buffersize messages
+        """
 
         def get_loggroup(lambda_context):
             group = os.getenv(ENV_LOG_GROUP, None)
@@ -48,24 +164,21 @@ class Logger:
                 group = lambda_context.log_group_name
             return group
 
-        def create_stream_if_not_exists():
-
-            client = boto3.client("logs")
-            resp = client.describe_log_streams(logGroupName=self._loggroup, logStreamNamePrefix=self._logstream)
-            if len(resp.get("logStreams", [])) == 0:
-                client.create_log_stream(logGroupName=self._loggroup, logStreamName=self._logstream)
-
         self._logstream = logstream
-        self._buffer_size = min(buffersize, 10000)
+        self._buffer_size = LOG_MAX_BATCH_COUNT if background_flush else min(buffersize, LOG_MAX_BATCH_COUNT)
         self._context = context
         self._buffer = []
         self._debug = debug
         self._cached_size = 0
         self._loggroup = loggroup if loggroup is not None else get_loggroup(self._context)
-        if self._loggroup:
-            create_stream_if_not_exists()
+        # buffer is shared with the background thread and the threads of the handlers using the logger
+        self._lock = threading.RLock()
 
-        self._sns = None
+        # summarized messages by message format string, items are lists with the count and the formatted sample messages
+        self._summaries = {}
+
+        if background_flush and self._context is not None:
+            _add_background_logger(self)
 
     def __enter__(self):
         """
@@ -86,24 +199,30 @@ class Logger:
 
     def _emit(self, level, msg, *args):
 
-        s = msg if len(args) == 0 else msg.format(*args)
+        s = _format_message(msg, args)
         t = time.time()
         dt = datetime.fromtimestamp(t)
         s = LOG_FORMAT.format(dt.year, dt.month, dt.day, dt.hour, dt.minute,
                               dt.second, str(dt.microsecond)[0:3], level, s)
 
-        if self._cached_size + (len(s) + LOG_ENTRY_ADDITIONAL) > LOG_MAX_BATCH_SIZE:
-            self.flush()
+        # buffered entries are taken from the buffer while holding the lock but written after it is released
+        batches = []
+        with self._lock:
+            if self._cached_size + (len(s) + LOG_ENTRY_ADDITIONAL) > LOG_MAX_BATCH_SIZE:
+                batches.append(self._take_buffer())
+
+            self._cached_size += len(s) + LOG_ENTRY_ADDITIONAL
 
-        self._cached_size += len(s) + LOG_ENTRY_ADDITIONAL
+            if self._context is not None:
+                self._buffer.append((long(t * 1000), s))
+            else:
+                print("> " + s)
 
-        if self._context is not None:
-            self._buffer.append((long(t * 1000), s))
-        else:
-            print("> " + s)
+            if len(self._buffer) >= self._buffer_size:
+                batches.append(self._take_buffer())
 
-        if len(self._buffer) >= self._buffer_size:
-            self.flush()
+        for entries in batches:
+            self._write_entries(entries)
 
         return s
 
@@ -115,12 +234,6 @@ class Logger:
         """
         return self._debug
 
-    @property
-    def sns(self):
-        if self._sns is None:
-            self._sns = get_client_with_retries("sns", ["publish"], context=self._context)
-        return self._sns
-
     @debug_enabled.setter
     def debug_enabled(self, value):
         """
@@ -130,17 +243,22 @@ class Logger:
         """
         self._debug = value
 
-    def publish_to_sns(self, level, msg):
+    def publish_to_sns(self, level, msg, text=None):
         """
-        Publis message to sns topic
-        :param msg: 
-        :param level: 
+        Adds message to the digest for the sns topic, similar messages are published once with the number of occurrences. The
+        digest is published asynchronously when its window has passed or when the logger is flushed.
+        :param msg: Logged message
+        :param level: Level of the message
+        :param text: Formatted message without the time and level, used to find similar messages, if None the message is used
         :return: 
         """
         sns_arn = os.getenv(ENV_SNS_TOPIC, None)
         if sns_arn is not None:
-            message = "Loggroup: {}\nLogstream {}\n{} : {}".format(self._loggroup, self._logstream, level, msg)
-            self.sns.publish_with_retries(TopicArn=sns_arn, Message=message)
+            _alerts.add(topic=sns_arn,
+                        level=level,
+                        fp=fingerprint(level, text if text is not None else msg),
+                        message=msg,
+                        source=(self._loggroup, self._logstream))
 
     def info(self, msg, *args):
         """
@@ -158,8 +276,9 @@ class Logger:
         :param args: parameters
         :return: 
         """
-        s = self._emit(LOG_LEVEL_ERROR, msg, *args)
-        self.publish_to_sns("Error", s)
+        text = _format_message(msg, args)
+        s = self._emit(LOG_LEVEL_ERROR, text)
+        self.publish_to_sns("Error", s, text)
 
     def warning(self, msg, *args):
         """
@@ -168,8 +287,9 @@ class Logger:
         :param args: parameters
         :return: 
         """
-        s = self._emit(LOG_LEVEL_WARNING, msg, *args)
-        self.publish_to_sns("Warning", s)
+        text = _format_message(msg, args)
+        s = self._emit(LOG_LEVEL_WARNING, text)
+        self.publish_to_sns("Warning", s, text)
 
     def debug(self, msg, *args):
         """
@@ -181,50 +301,181 @@ class Logger:
         if self._debug:
             self._emit(LOG_LEVEL_DEBUG, msg, *args)
 
+    def info_summary(self, msg, *args):
+        """
+        Logs repetitive informational messages, e.g. for every processed item, as a single summarized message with the number
+        of messages and a sample of the first messages. The summary is logged when the logger is flushed. If debugging is
+        enabled every message is logged.
+        :param msg: Message format string, messages are summarized by their format string
+        :param args: Message parameters
+        :return:
+        """
+        if self._debug:
+            self.info(msg, *args)
+            return
+
+        with self._lock:
+            summary = self._summaries.setdefault(msg, [0, []])
+            summary[0] += 1
+            if len(summary[1]) < SUMMARY_SAMPLE_SIZE:
+                summary[1].append(_format_message(msg, args))
+
+    def write_summaries(self):
+        """
+        Logs the summaries of the summarized messages
+        :return:
+        """
+        with self._lock:
+            summaries = self._summaries
+            self._summaries = {}
+
+        for msg in sorted(summaries):
+            count, samples = summaries[msg]
+            if count == 1:
+                self.info(samples[0])
+            else:
+                self.info(INFO_SUMMARY, count, msg, len(samples), "\n".join(samples))
+
     def clear(self):
         """
         Clear all buffered error messages
         :return: 
         """
-        self._buffer = []
+        with self._lock:
+            self._buffer = []
+            self._cached_size = 0
+            self._summaries = {}
 
     @property
     def _client(self):
-        client = get_client_with_retries("logs", ["describe_log_streams", "put_log_events"], context=self._context)
+        client = get_client_with_retries("logs", ["create_log_stream", "describe_log_streams", "put_log_events"],
+                                         context=self._context)
         return client
 
-    def flush(self):
+    def _create_stream_if_not_exists(self, client):
         """
-        Writes all buffered messages to CloudWatch Stream
-        :return: 
+        Creates the log stream if it was not created or used before by this container
+        :param client: CloudWatch logs client
+        :return:
         """
+        key = (self._loggroup, self._logstream)
+        with _streams_lock:
+            if key in _known_streams:
+                return
 
-        if len(self._buffer) == 0:
-            return
+        try:
+            client.create_log_stream_with_retries(logGroupName=self._loggroup, logStreamName=self._logstream)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code", "") != "ResourceAlreadyExistsException":
+                raise ex
 
+        with _streams_lock:
+            _known_streams.add(key)
+
+    def _put_log_events(self, client, entries):
+        """
+        Writes entries to the log stream using the sequence token returned by the previous call for the stream. If the token is
+        not valid, because other containers have written to the stream, the call is retried with the expected token.
+        :param client: CloudWatch logs client
+        :param entries: Entries to write, tuples of timestamp and message
+        :return:
+        """
+        key = (self._loggroup, self._logstream)
         put_event_args = {
             "logGroupName": self._loggroup,
             "logStreamName": self._logstream,
-            "logEvents": [{"timestamp": r[0], "message": r[1]} for r in self._buffer]
+            # entries from multiple threads must be sorted by time
+            "logEvents": [{"timestamp": r[0], "message": r[1]} for r in sorted(entries, key=lambda e: e[0])]
         }
 
-        client = self._client
+        for attempt in range(1, MAX_PUT_LOG_EVENTS_ATTEMPTS + 1):
+
+            with _streams_lock:
+                sequence_token = _sequence_tokens.get(key)
+            if sequence_token is not None:
+                put_event_args["sequenceToken"] = sequence_token
+            else:
+                put_event_args.pop("sequenceToken", None)
+
+            try:
+                resp = client.put_log_events_with_retries(**put_event_args)
+                with _streams_lock:
+                    _sequence_tokens[key] = resp.get("nextSequenceToken")
+                return
+
+            except ClientError as ex:
+                code = ex.response.get("Error", {}).get("Code", "")
+                if attempt == MAX_PUT_LOG_EVENTS_ATTEMPTS:
+                    raise ex
+
+                if code == "ResourceNotFoundException":
+                    # stream was deleted
+                    with _streams_lock:
+                        _known_streams.discard(key)
+                        _sequence_tokens.pop(key, None)
+                    self._create_stream_if_not_exists(client)
+
+                elif code in ["InvalidSequenceTokenException", "DataAlreadyAcceptedException"]:
+                    expected_token = ex.response.get("expectedSequenceToken")
+                    if expected_token is None:
+                        resp = client.describe_log_streams_with_retries(logGroupName=self._loggroup,
+                                                                        logStreamNamePrefix=self._logstream)
+                        streams = [st for st in resp.get("logStreams", []) if st["logStreamName"] == self._logstream]
+                        expected_token = streams[0].get("uploadSequenceToken") if len(streams) > 0 else None
+                    with _streams_lock:
+                        _sequence_tokens[key] = expected_token
+                    if code == "DataAlreadyAcceptedException":
+                        return
+                else:
+                    raise ex
 
-        try:
-            next_log_token = None
+    def flush(self):
+        """
+        Writes the summaries and all buffered messages to CloudWatch Stream and publishes the pending alert digests
+        :return: 
+        """
+        self.write_summaries()
+        self._flush_buffer()
+        _alerts.flush()
 
-            resp = client.describe_log_streams_with_retries(logGroupName=self._loggroup, logStreamNamePrefix=self._logstream)
-            if "logStreams" in resp and len(resp["logStreams"]) > 0:
-                next_log_token = resp["logStreams"][0].get("uploadSequenceToken")
+    def _take_buffer(self):
+        """
+        Removes all messages from the buffer, must be called while holding the lock of the logger
+        :return: Removed messages
+        """
+        entries = self._buffer
+        self._buffer = []
+        self._cached_size = 0
+        return entries
 
-            if next_log_token is not None:
-                put_event_args["sequenceToken"] = next_log_token
+    def _flush_buffer(self):
+        """
+        Writes all buffered messages to CloudWatch Stream
+        :return:
+        """
+        with self._lock:
+            entries = self._take_buffer()
+        self._write_entries(entries)
 
-            client.put_log_events_with_retries(**put_event_args)
-            self._buffer = []
-            self._cached_size = 0
+    def _write_entries(self, entries):
+        """
+        Writes messages to the CloudWatch Stream, writes to the same stream are serialized
+        :param entries: Messages to write
+        :return:
+        """
+        if len(entries) == 0:
             return
-        except Exception as ex:
-            print("Error writing to logstream {} ({})".format(self._logstream, str(ex)))
-            for entry in self._buffer:
-                print (entry)
+
+        key = (self._loggroup, self._logstream)
+        with _streams_lock:
+            write_lock = _stream_write_locks.setdefault(key, threading.Lock())
+
+        with write_lock:
+            try:
+                client = self._client
+                self._create_stream_if_not_exists(client)
+                self._put_log_events(client, entries)
+            except Exception as ex:
+                print("Error writing to logstream {} ({})".format(self._logstream, str(ex)))
+                for entry in entries:
+                    print (entry)
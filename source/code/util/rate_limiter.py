@@ -0,0 +1,212 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import threading
+import time
+
+# error codes returned by services when calls are throttled
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "RequestThrottled",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException",
+    "BandwidthLimitExceeded",
+    "SlowDown",
+    "PriorRequestNotComplete"
+}
+
+# min and max rate in calls per second a limiter can learn
+MIN_RATE = 0.5
+MAX_RATE = 1000.0
+# rate is multiplied by this factor when a call is throttled
+RATE_DECREASE_FACTOR = 0.7
+# rate is increased by this number of calls per second for every second in which calls were not throttled
+RATE_INCREASE = 1.0
+# throttled calls within this period after a decrease of the rate are caused by the same burst and do not decrease it again
+DECREASE_COOLDOWN = 1.0
+# max number of calls that can be made in a burst when the limit is active
+MAX_BURST = 5
+# fraction of a token that is ignored when testing if a token is available
+TOKEN_TOLERANCE = 1e-6
+# period in seconds over which the rate of the calls is measured before calls are throttled for the first time
+MEASURE_INTERVAL = 1.0
+
+# limiters by service, api, account and region, shared by all threads and kept in module so they are reused by warm Lambda
+# invocations
+_limiters = {}
+_lock = threading.Lock()
+
+
+def is_throttling_error(ex):
+    """
+    Tests if an exception raised by a boto3 call is caused by throttling
+    :param ex: Raised exception
+    :return: True if the call was throttled
+    """
+    response = getattr(ex, "response", None)
+    if not isinstance(response, dict):
+        return False
+    if response.get("Error", {}).get("Code", "") in THROTTLING_ERROR_CODES:
+        return True
+    return response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) == 429
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket rate limiter that learns the sustainable call rate of an API. Calls are not limited until the first call is
+    throttled, from then the rate is decreased multiplicatively for every throttled call and increased additively while calls
+    succeed (AIMD).
+    """
+
+    def __init__(self, min_rate=MIN_RATE, max_rate=MAX_RATE, clock=None, sleep=None):
+        """
+        Initializes the limiter
+        :param min_rate: Min rate in calls per second
+        :param max_rate: Max rate in calls per second, the limit is no longer applied when the rate reaches this value
+        :param clock: Function returning the current time in seconds, default is time.time
+        :param sleep: Function used to wait, default is time.sleep
+        """
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._clock = clock if clock is not None else time.time
+        self._sleep = sleep if sleep is not None else time.sleep
+        self._lock = threading.Lock()
+
+        # rate is None as long as calls are not limited
+        self._rate = None
+        self._tokens = 0.0
+        self._last_refill = self._clock()
+        self._last_increase = self._last_refill
+        self._last_decrease = None
+
+        # calls counted in the current and previous interval to measure the rate of calls
+        self._interval_start = self._last_refill
+        self._interval_count = 0
+        self._measured_rate = 0.0
+
+    @property
+    def rate(self):
+        """
+        Returns the current limit
+        :return: Rate in calls per second, None if calls are not limited
+        """
+        return self._rate
+
+    def _measure(self, now):
+        """
+        Counts a call to measure the rate of the calls
+        :param now: Current time
+        :return:
+        """
+        elapsed = now - self._interval_start
+        if elapsed >= MEASURE_INTERVAL:
+            self._measured_rate = self._interval_count / elapsed
+            self._interval_start = now
+            self._interval_count = 0
+        self._interval_count += 1
+
+    def acquire(self):
+        """
+        Waits until a token is available for a call within the current limit. Waiting calls only take a token when it is
+        available, so calls that waited do not exceed the limit when they continue.
+        :return: Time waited in seconds
+        """
+        waited = 0
+        with self._lock:
+            self._measure(self._clock())
+
+        while True:
+            with self._lock:
+                if self._rate is None:
+                    return waited
+
+                now = self._clock()
+                self._tokens = min(float(MAX_BURST), self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+                # tolerance for rounding errors in the refill, which would make the caller wait for a tiny fraction of a token
+                if self._tokens >= 1 - TOKEN_TOLERANCE:
+                    self._tokens = max(0.0, self._tokens - 1)
+                    return waited
+
+                # time until the next token is available
+                wait = (1 - self._tokens) / self._rate
+
+            self._sleep(wait)
+            waited += wait
+
+    def succeeded(self):
+        """
+        Increases the limit after calls that were not throttled
+        :return:
+        """
+        with self._lock:
+            if self._rate is None:
+                return
+            now = self._clock()
+            self._rate = self._rate + (now - self._last_increase) * RATE_INCREASE
+            self._last_increase = now
+            if self._rate >= self._max_rate:
+                self._rate = None
+
+    def throttled(self):
+        """
+        Decreases the limit after a throttled call
+        :return:
+        """
+        with self._lock:
+            now = self._clock()
+            if self._last_decrease is not None and now - self._last_decrease < DECREASE_COOLDOWN:
+                return
+
+            if self._rate is None:
+                # rate of the calls that were throttled, including the calls in the current interval
+                elapsed = max(now - self._interval_start, MEASURE_INTERVAL)
+                rate = max(self._measured_rate, self._interval_count / elapsed)
+                self._tokens = 0.0
+            else:
+                rate = self._rate
+
+            self._rate = min(self._max_rate, max(self._min_rate, rate * RATE_DECREASE_FACTOR))
+            self._last_refill = now
+            self._last_increase = now
+            self._last_decrease = now
+
+
+def get_rate_limiter(service, api, account, region):
+    """
+    Returns the limiter for an API, the same limiter is used by all threads
+    :param service: Name of the service
+    :param api: Name of the API
+    :param account: Account the API is called for, None if unknown
+    :param region: Region the API is called in
+    :return: Limiter for the API
+    """
+    key = (service, api, account, region)
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter()
+            _limiters[key] = limiter
+        return limiter
+
+
+def clear():
+    """
+    Removes all limiters
+    :return:
+    """
+    with _lock:
+        _limiters.clear()
@@ -0,0 +1,75 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+from collections import namedtuple
+
+# Condition on the tags of a resource that can be evaluated by a service when selecting resources. If key is None the resource
+# must have a tag with a name matching any of the values, else the resource must have a tag with that name with a value
+# matching any of the values. Values can start and/or end with a "*" wildcard.
+TagCondition = namedtuple("TagCondition", ["key", "values"])
+
+NAME_VAL_SEP = "="
+FILTER_SEP = ","
+REGEX_CHAR = "\\"
+WILDCARD_CHAR = "*"
+
+
+def _is_pattern_pushable(pattern):
+    """
+    Tests if a string filter can be evaluated by a service. Regular expressions and strings containing the escape character can
+    only be evaluated by the TagFilterSet class.
+    :param pattern: String filter
+    :return: True if the filter can be passed to a service
+    """
+    return pattern is not None and pattern != "" and REGEX_CHAR not in pattern
+
+
+def plan_for_task_tag(tag_name, task_name):
+    """
+    Returns the conditions for selecting resources that have the name of a task in the list of values of a tag
+    :param tag_name: Name of the tag holding the list of task names
+    :param task_name: Name of the task
+    :return: List of conditions, empty list if there are no conditions that can be evaluated by a service
+    """
+    if not _is_pattern_pushable(tag_name) or WILDCARD_CHAR in tag_name:
+        return []
+
+    # the value is a list of task names, the exact match on the name of the task is done after selecting the resources
+    if _is_pattern_pushable(task_name):
+        return [TagCondition(key=tag_name, values=[WILDCARD_CHAR + task_name + WILDCARD_CHAR])]
+    return [TagCondition(key=None, values=[tag_name])]
+
+
+def plan_for_tag_filter(tag_filter):
+    """
+    Returns the conditions for selecting resources matching a tag filter. The returned conditions select the same or more
+    resources than the filter, resources must always be matched against the filter after they are selected.
+    :param tag_filter: Tag filter, see TagFilterSet for format
+    :return: List of conditions, empty list if there are no conditions that can be evaluated by a service
+    """
+    if tag_filter is None or tag_filter == "" or tag_filter == WILDCARD_CHAR:
+        return []
+
+    filters = [f.split(NAME_VAL_SEP, 1) for f in tag_filter.split(FILTER_SEP)]
+
+    # all tag names must be strings or wildcards, not regular expressions
+    if not all([_is_pattern_pushable(f[0]) for f in filters]):
+        return []
+
+    # name-value filters for a single tag name with values that can be evaluated by the service
+    names = set([f[0] for f in filters])
+    if len(names) == 1 and WILDCARD_CHAR not in filters[0][0] and \
+            all([len(f) == 2 and _is_pattern_pushable(f[1]) for f in filters]):
+        return [TagCondition(key=filters[0][0], values=sorted(set([f[1] for f in filters])))]
+
+    # resources must have at least one tag with a name matching any of the names in the filters
+    return [TagCondition(key=None, values=sorted(names))]
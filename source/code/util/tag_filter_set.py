@@ -10,9 +10,178 @@
 #  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
 #  and limitations under the License.                                                                                #
 ######################################################################################################################
-
 import re
 
+# max number of compiled filters and filter sets that are cached
+MAX_CACHED_FILTERS = 1000
+
+# compiled string filters by (filter string, regex character, wildcard character)
+_compiled_string_filters = {}
+# compiled filter sets by (filters, name value separator, filter separator, regex character, wildcard character)
+_compiled_filter_sets = {}
+
+
+class EmptyMatcher:
+    """
+    Matches empty or None strings
+    """
+
+    @staticmethod
+    def match(s):
+        return s == "" or s is None
+
+
+class AnyMatcher:
+    """
+    Matches any string
+    """
+
+    @staticmethod
+    def match(_):
+        return True
+
+
+class ExactMatcher:
+    """
+    Matches strings equal to the filter string
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def match(self, s):
+        return self.value == s
+
+
+class PrefixMatcher:
+    """
+    Matches strings starting with the filter string
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def match(self, s):
+        return s is not None and s.startswith(self.value)
+
+
+class SuffixMatcher:
+    """
+    Matches strings ending with the filter string
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def match(self, s):
+        return s is not None and s.endswith(self.value)
+
+
+class ContainsMatcher:
+    """
+    Matches strings containing the filter string
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def match(self, s):
+        return s is not None and self.value in s
+
+
+class RegexMatcher:
+    """
+    Matches strings matching a regular expression, an invalid expression does not match any string
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        try:
+            self._regex = re.compile(expression)
+        except re.error as ex:
+            print("\"{}\" is not a valid regular expression ({})".format(expression, ex))
+            self._regex = None
+
+    def match(self, s):
+        return self._regex is not None and s is not None and self._regex.match(s) is not None
+
+
+class PairMatcher:
+    """
+    Matches name value pairs, if there is no value matcher only the name is matched
+    """
+
+    def __init__(self, name_matcher, value_matcher=None):
+        self.name_matcher = name_matcher
+        self.value_matcher = value_matcher
+
+    def match(self, name, value):
+        if self.name_matcher.match(name):
+            return self.value_matcher is None or self.value_matcher.match(value)
+        return False
+
+
+def compile_string_filter(filter_string, regex_char="\\", wildcard_char="*"):
+    """
+    Returns the (cached) matcher for a single string filter
+    :param filter_string: The filter, can start or end with a wildcard character, contain just the wildcard character or a
+    regular expression starting with the regex character
+    :param regex_char: Character that starts a regular expression
+    :param wildcard_char: Wildcard character
+    :return: Matcher for the filter
+    """
+    key = (filter_string, regex_char, wildcard_char)
+    matcher = _compiled_string_filters.get(key)
+    if matcher is not None:
+        return matcher
+
+    if filter_string == "" or filter_string is None:
+        # empty or none matches empty or none
+        matcher = EmptyMatcher()
+    elif filter_string.startswith(regex_char) and len(filter_string) > 1:
+        matcher = RegexMatcher(filter_string[1:])
+    elif filter_string == wildcard_char:
+        # just "*" matches any value
+        matcher = AnyMatcher()
+    elif filter_string.startswith(wildcard_char):
+        if filter_string.endswith(wildcard_char):
+            # *contained*
+            matcher = ContainsMatcher(filter_string[1:-1])
+        else:
+            # *endswith
+            matcher = SuffixMatcher(filter_string[1:])
+    elif filter_string.endswith(wildcard_char):
+        # startswith*
+        matcher = PrefixMatcher(filter_string[:-1])
+    else:
+        matcher = ExactMatcher(filter_string)
+
+    if len(_compiled_string_filters) >= MAX_CACHED_FILTERS:
+        _compiled_string_filters.clear()
+    _compiled_string_filters[key] = matcher
+    return matcher
+
+
+def get_tag_filter_set(filters, name_val_sep="=", filter_sep=",", regex_char="\\", wildcard_char="*"):
+    """
+    Returns a (cached) compiled filter set for a filter string, use instead of creating a TagFilterSet for filters that are used
+    to match many strings or tags
+    :param filters: Filters string
+    :param name_val_sep: Separator for name and value in filter
+    :param filter_sep: Separator between filters
+    :param regex_char: Character that starts a regular expression
+    :param wildcard_char: Wildcard character
+    :return: Filter set for the filters
+    """
+    key = (filters, name_val_sep, filter_sep, regex_char, wildcard_char)
+    filter_set = _compiled_filter_sets.get(key)
+    if filter_set is None:
+        filter_set = TagFilterSet(filters, name_val_sep, filter_sep, regex_char, wildcard_char)
+        if len(_compiled_filter_sets) >= MAX_CACHED_FILTERS:
+            _compiled_filter_sets.clear()
+        _compiled_filter_sets[key] = filter_set
+    return filter_set
+
 
 class TagFilterSet:
     """
@@ -23,6 +192,7 @@ class TagFilterSet:
     For filtering key-value pairs set in dictionaries the format of the filters is <namefilter>=<valuefilter> where
     both items can start/end with a wildcard or with a \ for regular expressions. If the item has the
     format <namefilter> then the pairs will match this filter if the just keyname matches the expression.
+    The filters are compiled into matchers when the set is created.
     """
 
     def __init__(self, filters, name_val_sep="=", filter_sep=",", regex_char="\\", wildcard_char="*"):
@@ -30,6 +200,17 @@ class TagFilterSet:
         self._name_val_sep = name_val_sep
         self._regex_char = regex_char
         self._wildcard_char = wildcard_char
+        # matchers for filters used as string filters
+        self._string_matchers = [self._compile(f) for f in self._filters]
+        # matchers for filters used as name value pair filters
+        self._pair_matchers = [self._compile_pair(f) for f in self._filters]
+
+    def _compile(self, filter_string):
+        return compile_string_filter(filter_string, self._regex_char, self._wildcard_char)
+
+    def _compile_pair(self, filter_string):
+        filter_parts = filter_string.split(self._name_val_sep, 1)
+        return PairMatcher(self._compile(filter_parts[0]), self._compile(filter_parts[1]) if len(filter_parts) > 1 else None)
 
     # matches a single string against a single filter
     def match_string(self, filter_string, s):
@@ -41,37 +222,7 @@ class TagFilterSet:
         :param s: The string to test
         :return: True id the string matches, False if not
         """
-
-        # empty or none matches empty or none
-        if filter_string == "" or filter_string is None:
-            return s == "" or s is None
-
-        # filter is regex
-        try:
-            if filter_string.startswith(self._regex_char) and len(filter_string) > 1:
-                return re.match(filter_string[1:], s) is not None
-        except re.error as ex:
-            print("\"{}\" is not a valid regular expression ({})".format(filter_string[1:], ex))
-            return False
-
-        # just "*" matches any value
-        if filter_string == self._wildcard_char:
-            return True
-
-        if filter_string.startswith(self._wildcard_char):
-            if filter_string.endswith(self._wildcard_char):
-                # *contained*
-                return filter_string[1:-1] in s
-            else:
-                # *endswith
-                return s.endswith(filter_string[1:])
-
-        if filter_string.endswith(self._wildcard_char):
-            # startswith*
-            return s.startswith(filter_string[:-1])
-        else:
-            # exact match
-            return filter_string == s
+        return self._compile(filter_string).match(s)
 
     def matches_name_value_pair(self, filterstring, name, value):
         """
@@ -81,9 +232,19 @@ class TagFilterSet:
         :param value: value to test
         :return: True if the filter matched the key pair, False if not
         """
-        filter_parts = filterstring.split(self._name_val_sep, 1)
-        if self.match_string(filter_parts[0], name):
-            return len(filter_parts) == 1 or self.match_string(filter_parts[1], value)
+        return self._compile_pair(filterstring).match(name, value)
+
+    def matches_any(self, pairs):
+        """
+        Tests if any key value pair matches any of the name value filters, stops at the first match
+        :param pairs: Dictionary containing the pairs to test
+        :return: True if at least one pair matches a filter
+        """
+        for name in pairs:
+            value = pairs[name]
+            for m in self._pair_matchers:
+                if m.match(name, value):
+                    return True
         return False
 
     def string_matches_any_filter(self, s):
@@ -92,8 +253,8 @@ class TagFilterSet:
         :param s: string to test
         :return: True if the string matches any of the filters
         """
-        for f in self._filters:
-            if self.match_string(f, s):
+        for m in self._string_matchers:
+            if m.match(s):
                 return True
         return False
 
@@ -103,8 +264,8 @@ class TagFilterSet:
         :param s: string to test
         :return: True if the string matches all of the filters
         """
-        for f in self._filters:
-            if not self.match_string(f, s):
+        for m in self._string_matchers:
+            if not m.match(s):
                 return False
         return True
 
@@ -114,11 +275,7 @@ class TagFilterSet:
         :param filter_list: List of strings to test against a set of string filters
         :return: list of strings matching any of the string filters
         """
-        result = []
-        for s in filter_list:
-            if any([self.match_string(f, s) for f in self._filters]):
-                result.append(s)
-        return result
+        return [s for s in filter_list if self.string_matches_any_filter(s)]
 
     def strings_matching_all_filters(self, filter_list):
         """
@@ -126,11 +283,7 @@ class TagFilterSet:
         :param filter_list: List of strings to test against a set of string filters
         :return: list of strings matching all of the string filters
         """
-        result = []
-        for s in filter_list:
-            if all([self.match_string(f, s) for f in self._filters]):
-                result.append(s)
-        return result
+        return [s for s in filter_list if self.string_matches_all_filters(s)]
 
     def pairs_matching_any_filter(self, pairs):
         """
@@ -140,8 +293,10 @@ class TagFilterSet:
         """
         result = {}
         for name in pairs:
-            if any([self.matches_name_value_pair(f, name, pairs[name]) for f in self._filters]):
-                result[name] = pairs[name]
+            for m in self._pair_matchers:
+                if m.match(name, pairs[name]):
+                    result[name] = pairs[name]
+                    break
         return result
 
     # pairs that match all filters (AND)
@@ -153,6 +308,6 @@ class TagFilterSet:
         """
         result = {}
         for name in pairs:
-            if all([self.matches_name_value_pair(f, name, pairs[name]) for f in self._filters]):
+            if all(m.match(name, pairs[name]) for m in self._pair_matchers):
                 result[name] = pairs[name]
         return result
@@ -0,0 +1,152 @@
+######################################################################################################################
+#  Copyright 2016 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Amazon Software License (the "License"). You may not use this file except in compliance        #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://aws.amazon.com/asl/                                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# default number of worker threads
+DEFAULT_MAX_WORKERS = 8
+# default max number of events buffered between worker threads and the consumer
+DEFAULT_QUEUE_SIZE = 1000
+# interval in seconds in which blocked workers check if processing was stopped by the consumer
+STOP_CHECK_INTERVAL = 0.1
+
+# event returned by the stream method of the pool. For every value returned by the processing function for an item an event with
+# completed set to False is returned. When processing of an item has finished an event with completed set to True is returned
+# holding the exception raised when processing the item (or None) and the elapsed time in seconds.
+WorkerEvent = namedtuple("WorkerEvent", ["item", "value", "completed", "exception", "elapsed"])
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of worker threads for processing items concurrently. Threads are used instead of processes as the
+    multiprocessing pool and its semaphores are not available in the Lambda execution environment.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Initializes the pool
+        :param max_workers: Max number of items that are processed concurrently
+        :param queue_size: Max number of values that are buffered for the consumer before workers are blocked
+        """
+        self.max_workers = max(1, int(max_workers)) if max_workers is not None else DEFAULT_MAX_WORKERS
+        self.queue_size = queue_size
+
+    def stream(self, func, items):
+        """
+        Processes items concurrently and returns the values returned by the processing function as they become available.
+        The processing function must return an iterable, every value it returns is passed to the consumer as soon as it is
+        available. Exceptions raised when processing an item are returned in the completion event for that item and do not
+        stop the processing of other items.
+        :param func: Function that is called for every item, must return an iterable
+        :param items: Items to process
+        :return: Generator of WorkerEvent items
+        """
+
+        items = list(items)
+        if len(items) == 0:
+            return
+
+        # no need for threads if only a single item can be processed at a time
+        if self.max_workers == 1 or len(items) == 1:
+            for item in items:
+                start = time.time()
+                exception = None
+                try:
+                    for value in func(item):
+                        yield WorkerEvent(item, value, False, None, None)
+                except Exception as ex:
+                    exception = ex
+                yield WorkerEvent(item, None, True, exception, time.time() - start)
+            return
+
+        pending = queue.Queue()
+        for item in items:
+            pending.put(item)
+
+        events = queue.Queue(maxsize=self.queue_size)
+        stopped = threading.Event()
+
+        def put(event):
+            # blocks if the consumer can not keep up, gives up if the consumer stopped processing the events
+            while not stopped.is_set():
+                try:
+                    events.put(event, timeout=STOP_CHECK_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker():
+            while not stopped.is_set():
+                try:
+                    work_item = pending.get_nowait()
+                except queue.Empty:
+                    return
+                start_item = time.time()
+                item_exception = None
+                try:
+                    for v in func(work_item):
+                        if not put(WorkerEvent(work_item, v, False, None, None)):
+                            return
+                except Exception as e:
+                    item_exception = e
+                put(WorkerEvent(work_item, None, True, item_exception, time.time() - start_item))
+
+        for _ in range(0, min(self.max_workers, len(items))):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+
+        completed = 0
+        try:
+            while completed < len(items):
+                event = events.get()
+                if event.completed:
+                    completed += 1
+                yield event
+        finally:
+            stopped.set()
+
+    def map(self, func, items, return_exceptions=False):
+        """
+        Calls a function for every item concurrently and returns the results in the order of the items
+        :param func: Function to call for every item
+        :param items: Items to process
+        :param return_exceptions: Set to True to return the exception raised for an item as its result instead of raising it
+        :return: List of results
+        """
+
+        items = list(items)
+        results = [None] * len(items)
+        exception = None
+
+        for event in self.stream(lambda indexed_item: [func(indexed_item[1])], enumerate(items)):
+            index = event.item[0]
+            if not event.completed:
+                results[index] = event.value
+            elif event.exception is not None:
+                if return_exceptions:
+                    results[index] = event.exception
+                elif exception is None:
+                    exception = event.exception
+
+        if exception is not None:
+            raise exception
+
+        return results